@@ -1,3 +1,5 @@
+import logging
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
@@ -6,11 +8,53 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_session
 from app.core.config import settings
 from app.core.security import ALGORITHM
+from app.core.tracing import span
 from app.models.user import User
+from app.service.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
 
 # L'URL où le frontend doit envoyer le login (/api/v1/auth/login)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
+async def get_user_from_token(token: str, session: AsyncSession) -> Optional[User]:
+    """
+    Utilisateur d'un token JWT, ou None si le token est invalide.
+    Les tokens recents portent l'id de l'utilisateur (claim "uid") : le cache
+    repond sans requete SQL. Les anciens tokens (email seul) passent par la base.
+    """
+    try:
+        with span("auth.jwt_decode"):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        logger.error(f"Erreur de décodage du token : {str(e)}")
+        return None
+    email: Optional[str] = payload.get("sub")
+    user_id: Optional[int] = payload.get("uid")
+    if email is None:
+        logger.error("Token valide mais 'sub' (email) manquant")
+        return None
+
+    if user_id is not None:
+        user = user_cache.get(user_id)
+        # L'email du token doit toujours correspondre (id reattribue, email modifie...)
+        if user is not None and user.email == email:
+            return user
+        statement = select(User).where(User.id == user_id, User.email == email)
+    else:
+        statement = select(User).where(User.email == email)
+
+    # Recherche de l'user en base
+    with span("auth.user_lookup"):
+        result = await session.execute(statement)
+        user = result.scalars().first()
+        # Fin de la transaction de lecture : la connexion ne reste pas reservee
+        # pendant le reste de la requete (generation LLM comprise)
+        await session.close()
+    if user is None:
+        return None
+    return user_cache.put(user)
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     session: AsyncSession = Depends(get_session)
@@ -20,19 +64,7 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    # Recherche de l'user en base
-    statement = select(User).where(User.email == email)
-    result = await session.execute(statement)
-    user = result.scalars().first()
-    
+    user = await get_user_from_token(token, session)
     if user is None:
         raise credentials_exception
     return user
@@ -41,4 +73,4 @@ async def get_current_user(
 async def get_current_admin(current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Privilèges administrateur requis")
-    return current_user
\ No newline at end of file
+    return current_user
@@ -1,10 +1,25 @@
+import asyncio
+import hmac
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import database_stats, init_db
+from app.core.lifecycle import readiness
+from app.core.metrics import metrics
+from app.core.tracing import RequestMetricsMiddleware
+from app.core.security import shutdown_password_hashing
+from app.core.vector_db import get_client, get_embeddings
 from app.models.base import HealthCheck
 from app.api.v1.api import api_router
+from app.service.chunking import load_tokenizer
+from app.service.rag_service import rag_service
+from app.service.ingestion import ingestion_service
+from app.service.ingestion_worker import ingestion_worker
+from app.service.history_writer import history_writer
+from app.service.websocket_manager import manager
+from app.service.retrieval import hybrid_retriever
 from fastapi.middleware.cors import CORSMiddleware
 
 # En production, cela permet de filtrer les logs et de les envoyer vers des fichiers ou des systemes externes
@@ -14,6 +29,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def warm_up():
+    """
+    Initialise les ressources lourdes en arriere-plan, dans l'ordre de leurs
+    dependances, pendant que le serveur repond deja a /health.
+    Qdrant est reessaye tant qu'il est injoignable.
+    """
+    delay = 1
+    while True:
+        try:
+            await asyncio.to_thread(get_client)
+            readiness.mark("qdrant")
+            break
+        except Exception as e:
+            readiness.mark("qdrant", False, str(e))
+            logger.warning(f"Qdrant indisponible ({e}), nouvel essai dans {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    # Version du corpus (invalidation du cache) et index BM25 construit a partir de Qdrant
+    hybrid_retriever.schedule_refresh(force=True)
+
+    for component, load in (
+        ("embeddings", lambda: get_embeddings().embed_query("prechauffage")),
+        # Budgets de tokens (prompt, historique) : pas de chargement au premier message
+        ("tokenizer", load_tokenizer),
+        ("llm", rag_service.setup),
+    ):
+        try:
+            await asyncio.to_thread(load)
+            readiness.mark(component)
+        except Exception as e:
+            readiness.mark(component, False, str(e))
+            logger.error(f"Echec du prechauffage ({component}) : {e}")
+    logger.info(f"Prechauffage termine : {readiness.report()}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -22,14 +72,32 @@ async def lifespan(app: FastAPI):
     logger.info("Demarrage de l'application et initialisation de la DB...")
     try:
         await init_db()
+        readiness.mark("database")
         logger.info("Connexion a la base de donnees etablie avec succes.")
     except Exception as e:
         logger.error(f"Erreur critique lors de l'initialisation de la DB : {e}")
         raise e
 
+    history_writer.start()
+    await manager.start()
+    if settings.INGESTION_WORKER_EMBEDDED:
+        ingestion_worker.start()
+
+    # Modeles et Qdrant charges en arriere-plan : le serveur accepte deja les requetes
+    warm_up_task = asyncio.create_task(warm_up())
+
     yield
 
     logger.info("Arret de l'application.")
+    warm_up_task.cancel()
+    await manager.stop()
+    # Les echanges encore en file sont ecrits avant l'arret
+    await history_writer.stop()
+    if settings.INGESTION_WORKER_EMBEDDED:
+        await ingestion_worker.stop()
+    rag_service.query_embedder.close()
+    ingestion_service.shutdown()
+    shutdown_password_hashing()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -44,8 +112,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],  # Pagination de /chat/history
     )
 
+# Duree des requetes par route, detail des etapes (en-tete Server-Timing)
+app.add_middleware(RequestMetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/")
@@ -62,6 +134,45 @@ async def health_check():
     """
     return {
         "status": "active",
-        "database": "connected",
+        "ready": readiness.ready,
+        "database": "connected" if readiness.report()["components"]["database"] else "pending",
         "environment": "production" if not settings.DEBUG else "development"
-    }
\ No newline at end of file
+    }
+
+@app.get("/health/live")
+async def liveness_check():
+    """
+    Vivacite : le processus repond (ne depend d'aucune ressource externe).
+    """
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Disponibilite : base, Qdrant, modele d'embeddings et LLM initialises.
+    Retourne 503 tant que le prechauffage n'est pas termine.
+    """
+    report = readiness.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+@app.get("/health/db")
+async def database_health():
+    """
+    Pool de connexions (utilisation, attentes, timeouts), requetes lentes
+    et file d'ecriture de l'historique.
+    """
+    return {**database_stats(), "history_writer": history_writer.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """
+    Metriques Prometheus : durees par etape et par route, tokens, chunks,
+    files d'attente (LLM, historique, WebSocket), caches et pool de connexions.
+    """
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404)
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+            raise HTTPException(status_code=401, detail="Token de collecte invalide")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
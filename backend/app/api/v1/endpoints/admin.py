@@ -0,0 +1,70 @@
+import asyncio
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.profiler import ProfilerBusy, profiler
+from app.models.user import User
+from app.api.deps import get_current_admin
+
+router = APIRouter()
+
+@router.get("/profile")
+async def capture_profile(
+    seconds: float = Query(10, gt=0, description="Duree de la capture (plafonnee a PROFILER_MAX_SECONDS)"),
+    format: Literal["top", "folded"] = Query("top"),
+    limit: int = Query(30, ge=1, le=200),
+    include_idle: bool = Query(False, description="Garder les threads en attente (pools inoccupes, event loop)"),
+    current_user: User = Depends(get_current_admin),
+):
+    """
+    Profil par echantillonnage du processus pendant `seconds` secondes :
+    fonctions les plus presentes (top) ou piles repliees pour un flamegraph (folded).
+    """
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profileur desactive (PROFILER_ENABLED)")
+    seconds = min(seconds, settings.PROFILER_MAX_SECONDS)
+    try:
+        result = await asyncio.to_thread(profiler.capture, seconds, None, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "folded":
+        return PlainTextResponse(profiler.folded(result))
+    return profiler.top(result, limit)
+
+class UserUpdate(BaseModel):
+    """Champs absents : inchanges ; null : efface (utilisateur non restreint sur ce champ)."""
+    role: Optional[Literal["student", "teacher", "admin"]] = None
+    faculty: Optional[str] = None
+    academic_year: Optional[str] = None
+
+@router.patch("/users/{user_id}")
+async def update_user(
+    user_id: int,
+    update: UserUpdate,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_admin),
+):
+    """Role et perimetre de recherche (faculte, annee universitaire) d'un utilisateur."""
+    user = await session.get(User, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="Utilisateur introuvable")
+    values = update.model_dump(exclude_unset=True)
+    if values.get("role", user.role) is None:
+        raise HTTPException(status_code=400, detail="Le role ne peut pas etre vide")
+    for field, value in values.items():
+        setattr(user, field, value)
+    session.add(user)
+    await session.commit()
+    return {
+        "id": user.id,
+        "email": user.email,
+        "role": user.role,
+        "faculty": user.faculty,
+        "academic_year": user.academic_year,
+    }
@@ -1,9 +1,11 @@
+from typing import Literal
+
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from app.core.database import get_session
-from app.core.security import create_access_token, get_password_hash, verify_password
+from app.core.security import create_user_token, get_password_hash_async, verify_password_async
 from app.models.user import User
 from pydantic import BaseModel, EmailStr, Field
 
@@ -14,7 +16,9 @@ class UserCreate(BaseModel):
     email: EmailStr
     password: str = Field(..., min_length=8, max_length=72)  # bcrypt limit
     full_name: str
-    role: str = "student" # Par defaut
+    # Inscription publique : toujours etudiant. Role, faculte et annee (perimetre
+    # de recherche) sont attribues par un administrateur (PATCH /admin/users/{id})
+    role: Literal["student"] = "student"
 
 @router.post("/signup")
 async def signup(user_in: UserCreate, session: AsyncSession = Depends(get_session)):
@@ -27,9 +31,9 @@ async def signup(user_in: UserCreate, session: AsyncSession = Depends(get_sessio
     # Créer l'user
     new_user = User(
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=await get_password_hash_async(user_in.password),
         full_name=user_in.full_name,
-        role=user_in.role
+        role=user_in.role,
     )
     session.add(new_user)
     await session.commit()
@@ -44,10 +48,14 @@ async def login(
     statement = select(User).where(User.email == form_data.username)
     result = await session.execute(statement)
     user = result.scalars().first()
+    # Rend la connexion au pool avant bcrypt : sinon une vague de connexions
+    # monopolise le pool SQL et bloque toutes les autres routes
+    await session.close()
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    # bcrypt dans le pool dedie : l'event loop continue de servir les autres requetes
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Email ou mot de passe incorrect")
 
     # Création du token
-    access_token = create_access_token(data={"sub": user.email, "role": user.role})
+    access_token = create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -1,110 +1,291 @@
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select # <--- Il manquait cet import pour la DB
+from sqlmodel import select
 from pydantic import BaseModel
-from jose import jwt, JWTError
 
-from app.core.database import get_session
-from app.core.config import settings
-from app.core.security import ALGORITHM
+from app.core.database import async_session_maker, get_session
+from app.core.metrics import metrics
+from app.core.tracing import finish_trace, start_trace
 from app.models.user import User
-from app.models.chat import ChatHistory
+from app.models.chat import Conversation
 
 # ATTENTION ICI : On harmonise tout vers "app.service" (singulier)
 from app.service.rag_service import rag_service 
 from app.service.websocket_manager import manager 
-from app.api.deps import get_current_user
+from app.service.answer_cache import answer_cache
+from app.service.history_writer import history_writer
+from app.service.chat_history import InvalidCursor, fetch_history_page, history_etag
+from app.service.conversation import ConversationContext, conversation_memory
+from app.service.llm_providers import llm_router
+from app.service.llm_scheduler import LLMOverloaded, llm_scheduler
+from app.service.retrieval_scope import scope_for_user
+from app.api.deps import get_current_user, get_current_admin, get_user_from_token
 
 router = APIRouter()
 logger = logging.getLogger(__name__) # <--- Il manquait le logger
 
+WS_MESSAGE_SECONDS = metrics.histogram(
+    "ws_message_duration_seconds", "Traitement d'un message WebSocket (jusqu'a la reponse complete)", ["mode"]
+)
+
 class ChatRequest(BaseModel):
     question: str
+    conversation_id: Optional[int] = None  # Sans conversation : question isolee, sans memoire
 
 class ChatResponse(BaseModel):
     answer: str
+    conversation_id: Optional[int] = None
+
+BUSY_DETAIL = "Le service est très sollicité, réessayez dans quelques instants."
+
+class ConversationCreate(BaseModel):
+    title: Optional[str] = None
+
+async def load_conversation(user: User, conversation_id: Optional[int]) -> Optional[ConversationContext]:
+    """Memoire de la conversation, lue avec une session courte (liberee avant l'appel LLM)."""
+    if conversation_id is None:
+        return None
+    async with async_session_maker() as session:
+        conversation = await conversation_memory.get(session, user.id, conversation_id)
+        if conversation is None:
+            raise HTTPException(status_code=404, detail="Conversation introuvable")
+        return await conversation_memory.load(session, conversation)
+
+# --- Conversations ---
+@router.post("/conversations")
+async def create_conversation(
+    request: ConversationCreate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    conversation = await conversation_memory.create(session, current_user.id, request.title)
+    return {"id": conversation.id, "title": conversation.title, "created_at": conversation.created_at}
+
+@router.get("/conversations")
+async def list_conversations(
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    statement = (
+        select(Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at)
+        .where(Conversation.user_id == current_user.id)
+        .order_by(Conversation.updated_at.desc())
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in (await session.execute(statement)).all()]
 
 # --- Route HTTP Classique ---
 @router.post("/query", response_model=ChatResponse)
 async def ask_question(
     request: ChatRequest,
     current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session)
 ):
     if not request.question.strip():
         raise HTTPException(status_code=400, detail="Question vide")
     
-    answer = await rag_service.get_answer(request.question)
+    history = await load_conversation(current_user, request.conversation_id)
+    try:
+        turn = await rag_service.answer_turn(
+            request.question, history, current_user.id, scope_for_user(current_user)
+        )
+    except LLMOverloaded:
+        raise HTTPException(status_code=503, detail=BUSY_DETAIL, headers={"Retry-After": "5"})
     
-    chat_entry = ChatHistory(
-        user_id=current_user.id,
-        question=request.question,
-        answer=answer
+    # Ecriture differee, hors du chemin critique de la reponse
+    await history_writer.submit(
+        current_user.id, request.question, turn.answer, request.conversation_id, turn.prompt_tokens
     )
-    session.add(chat_entry)
-    await session.commit()
 
-    return ChatResponse(answer=answer)
+    return ChatResponse(answer=turn.answer, conversation_id=request.conversation_id)
+
+# --- Route HTTP Streaming (Server-Sent Events) ---
+@router.post("/query/stream")
+async def ask_question_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+):
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question vide")
+    history = await load_conversation(current_user, request.conversation_id)
+
+    async def event_stream():
+        try:
+            async for event in rag_service.stream_answer(
+                request.question, history, current_user.id, scope_for_user(current_user)
+            ):
+                if event["type"] == "end":
+                    # Sauvegarde unique de la reponse complete
+                    event["conversation_id"] = request.conversation_id
+                    await history_writer.submit(
+                        current_user.id, request.question, event["answer"],
+                        request.conversation_id, event["prompt_tokens"]
+                    )
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except LLMOverloaded:
+            error = {"type": "error", "detail": BUSY_DETAIL, "retry": True}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"Erreur pendant le streaming HTTP : {e}")
+            error = {"type": "error", "detail": "Erreur lors de la génération de la réponse"}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/history")
 async def get_history(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Curseur X-Next-Cursor de la page precedente"),
+    view: Literal["full", "summary"] = Query("full"),
+    conversation_id: Optional[int] = Query(None),
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session)
 ):
-    statement = select(ChatHistory).where(ChatHistory.user_id == current_user.id)
-    result = await session.execute(statement)
-    chats = result.scalars().all()
+    """
+    Historique pagine : les `limit` echanges precedant `before`, dans l'ordre
+    chronologique. Le curseur de la page plus ancienne est renvoye dans
+    l'en-tete X-Next-Cursor. Un historique inchange repond 304 (If-None-Match).
+    """
+    etag = await history_etag(session, current_user.id, limit, before, view, conversation_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        chats, next_cursor = await fetch_history_page(
+            session, current_user.id, limit, before, summary=view == "summary", conversation_id=conversation_id
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response.headers.update(headers)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return chats
 
+@router.get("/cache/stats")
+async def get_cache_stats(current_user: User = Depends(get_current_admin)):
+    """Compteurs du cache de reponses (pour ajuster le seuil de similarite)."""
+    return answer_cache.stats()
+
+@router.get("/ws/stats")
+async def get_ws_stats(current_user: User = Depends(get_current_admin)):
+    """Connexions WebSocket de ce worker, evictions et trafic pub/sub."""
+    return manager.stats()
+
+@router.get("/llm/stats")
+async def get_llm_stats(current_user: User = Depends(get_current_admin)):
+    """
+    File d'attente du LLM (appels en cours, profondeur, temps d'attente, coalescences)
+    et sante des fournisseurs (latence, erreurs, mises a l'ecart, bascules).
+    """
+    return {**llm_scheduler.stats(), "providers": llm_router.stats()}
+
+class BroadcastRequest(BaseModel):
+    message: str
+
+@router.post("/broadcast")
+async def broadcast_message(request: BroadcastRequest, current_user: User = Depends(get_current_admin)):
+    """Annonce envoyee a tous les etudiants connectes, sur tous les workers."""
+    await manager.broadcast(request.message)
+    return {"status": "sent"}
+
 # --- Partie WebSocket ---
 
-async def get_user_from_token(token: str, session: AsyncSession):
+async def stream_ws_answer(websocket: WebSocket, user: User, question: str, conversation_id: Optional[int] = None):
+    """
+    Mode streaming du WebSocket : trames JSON "token" au fil de la generation,
+    puis une trame "end" avec les sources et le temps de traitement.
+    """
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            logger.error("Token valide mais 'sub' (email) manquant")
-            return None
-    except JWTError as e:
-        logger.error(f"Erreur de décodage du token : {str(e)}") # <--- Ceci vous dira s'il est expiré
-        return None
-    
-    statement = select(User).where(User.email == email)
-    result = await session.execute(statement)
-    return result.scalars().first()
+        history = await load_conversation(user, conversation_id)
+        async for event in rag_service.stream_answer(question, history, user.id, scope_for_user(user)):
+            if event["type"] == "end":
+                event["conversation_id"] = conversation_id
+                await history_writer.submit(
+                    user.id, question, event["answer"], conversation_id, event["prompt_tokens"]
+                )
+            await manager.send_personal_json(event, websocket)
+    except WebSocketDisconnect:
+        raise
+    except LLMOverloaded:
+        await manager.send_personal_json({"type": "error", "detail": BUSY_DETAIL, "retry": True}, websocket)
+    except Exception as e:
+        logger.error(f"Erreur pendant le streaming WebSocket : {e}")
+        await manager.send_personal_json(
+            {"type": "error", "detail": "Erreur lors de la génération de la réponse"}, websocket
+        )
+
+async def text_ws_answer(websocket: WebSocket, user: User, question: str, conversation_id: Optional[int] = None):
+    """Mode texte (clients historiques) : accuse de reception puis reponse complete."""
+    # Feedback immédiat
+    await manager.send_personal_message(" : Je réfléchis...", websocket)
+
+    # Génération IA ; une erreur est signalee au client sans fermer la connexion
+    try:
+        history = await load_conversation(user, conversation_id)
+        turn = await rag_service.answer_turn(question, history, user.id, scope_for_user(user))
+    except LLMOverloaded:
+        await manager.send_personal_message(f" : {BUSY_DETAIL}", websocket)
+        return
+    except Exception as e:
+        logger.error(f"Erreur pendant la reponse WebSocket : {e}")
+        await manager.send_personal_message(" : Erreur lors de la génération de la réponse", websocket)
+        return
+
+    # Sauvegarde
+    await history_writer.submit(user.id, question, turn.answer, conversation_id, turn.prompt_tokens)
+
+    # Réponse finale
+    await manager.send_personal_message(f" : {turn.answer}", websocket)
 
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(...),
-    session: AsyncSession = Depends(get_session)
+    stream: bool = Query(False),
+    conversation_id: Optional[int] = Query(None),
 ):
-    user = await get_user_from_token(token, session)
+    # Aucune session ne reste ouverte pendant la vie du WebSocket :
+    # le pool serait epuise par quelques centaines d'etudiants connectes
+    async with async_session_maker() as session:
+        user = await get_user_from_token(token, session)
+        if user and conversation_id is not None:
+            if await conversation_memory.get(session, user.id, conversation_id) is None:
+                await websocket.close(code=4004)
+                return
     if not user:
         await websocket.close(code=4003)
         return
 
-    await manager.connect(websocket)
+    await manager.connect(websocket, user.id, json_mode=stream)
     
     try:
         while True:
             data = await websocket.receive_text()
-            
-            # Feedback immédiat
-            await manager.send_personal_message(" : Je réfléchis...", websocket)
-            
-            # Génération IA
-            answer = await rag_service.get_answer(data)
-            
-            # Sauvegarde
-            chat_entry = ChatHistory(user_id=user.id, question=data, answer=answer)
-            session.add(chat_entry)
-            await session.commit()
-
-            # Réponse finale
-            await manager.send_personal_message(f" : {answer}", websocket)
+            manager.touch(websocket)
+            trace = start_trace("WS message")
+            # Trace et latence aussi pour les refus (surcharge) et les deconnexions
+            try:
+                if stream:
+                    await stream_ws_answer(websocket, user, data, conversation_id)
+                else:
+                    await text_ws_answer(websocket, user, data, conversation_id)
+            finally:
+                WS_MESSAGE_SECONDS.observe(trace.elapsed, mode="stream" if stream else "text")
+                finish_trace(trace)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        logger.info(f"Utilisateur {user.email} déconnecté du chat.")
\ No newline at end of file
+        logger.info(f"Utilisateur {user.email} déconnecté du chat.")
+    finally:
+        manager.disconnect(websocket)
\ No newline at end of file
@@ -1,35 +1,110 @@
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
-from app.service.ingestion import ingestion_service
+import asyncio
+import os
+import shutil
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from app.api.deps import get_current_admin
+from app.core.config import settings
+from app.core.database import get_session
+from app.models.base import utc_now
+from app.models.document import IngestionJob
+from app.models.user import User
+from app.service.ingestion_worker import ingestion_worker
+from app.service.retrieval_scope import document_scope
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-async def run_ingestion_task(file: UploadFile):
+def spool_upload(file: UploadFile) -> str:
     """
-    Tache d'arriere-plan pour traiter le fichier sans bloquer l'API.
+    Copie le fichier uploade sur disque : le job survit ainsi a un redemarrage
+    et le worker peut le relire depuis un autre processus.
     """
-    try:
-        await ingestion_service.process_pdf(file)
-    except Exception as e:
-        logger.error(f"Echec de la tache de fond pour {file.filename}: {e}")
+    os.makedirs(settings.UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(settings.UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+    with open(path, "wb") as spool:
+        shutil.copyfileobj(file.file, spool)
+    return path
+
+def job_report(job: IngestionJob) -> dict:
+    """Etat d'un job avec son debit (pages/s, chunks/s)."""
+    report = job.model_dump(exclude={"spool_path"})
+    elapsed = None
+    if job.started_at:
+        elapsed = ((job.finished_at or utc_now()) - job.started_at).total_seconds()
+    report["elapsed_s"] = round(elapsed, 2) if elapsed is not None else None
+    report["pages_per_second"] = round(job.pages / elapsed, 2) if elapsed else None
+    report["chunks_per_second"] = round(job.chunks / elapsed, 2) if elapsed else None
+    return report
 
 @router.post("/upload")
 async def upload_document(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    faculty: Optional[str] = Form(None),
+    audience: Optional[str] = Form(None),
+    academic_year: Optional[str] = Form(None),
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_admin),
 ):
     """
-    Endpoint pour uploader un document PDF (RAG).
-    Le traitement est asynchrone.
+    Endpoint pour uploader un document PDF (RAG), reserve aux administrateurs.
+    Le fichier est mis en file ; le traitement est fait par le worker d'ingestion.
+    faculty, audience (student, teacher) et academic_year limitent les
+    utilisateurs qui retrouvent le document ; absents, il est commun a tous.
     """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Seuls les fichiers PDF sont acceptes.")
+    try:
+        scope = document_scope(faculty, audience, academic_year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    spool_path = await asyncio.to_thread(spool_upload, file)
 
-    # On lance le traitement en arriere-plan
-    background_tasks.add_task(run_ingestion_task, file)
+    job = IngestionJob(
+        filename=file.filename,
+        spool_path=spool_path,
+        max_attempts=settings.INGESTION_JOB_MAX_ATTEMPTS,
+        **scope,
+    )
+    session.add(job)
+    await session.commit()
+    await session.refresh(job)
+
+    ingestion_worker.notify()
 
     return {
         "message": "Fichier recu. Le traitement (indexation) a demarre en arriere-plan.",
-        "filename": file.filename
-    }
\ No newline at end of file
+        "filename": file.filename,
+        "job_id": job.id,
+        "scope": scope,
+    }
+
+@router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_admin),
+):
+    statement = select(IngestionJob).order_by(IngestionJob.created_at.desc()).limit(limit)
+    if status:
+        statement = statement.where(IngestionJob.status == status)
+    result = await session.execute(statement)
+    return [job_report(job) for job in result.scalars().all()]
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: int,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_admin),
+):
+    job = await session.get(IngestionJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable")
+    return job_report(job)
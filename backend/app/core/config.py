@@ -5,10 +5,150 @@ class Settings(BaseSettings):
     API_V1_STR: str
     DATABASE_URL: str
     QDRANT_URL: str
-    GROQ_API_KEY: str
+    GROQ_API_KEY: str = ""  # Inutile si LLM_PROVIDERS=local
     SECRET_KEY: str
     DEBUG: bool = False
 
+    # Pool de connexions PostgreSQL
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 10  # Attente maximale d'une connexion libre (secondes)
+    DB_POOL_RECYCLE: int = 1800  # Connexions renouvelees apres 30 min
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 30000  # 0 = pas de limite
+    DB_SLOW_QUERY_MS: int = 200
+
+    # Collection Qdrant (alias) et son index
+    QDRANT_COLLECTION: str = "documents"
+    QDRANT_HNSW_M: int = 16
+    QDRANT_HNSW_EF_CONSTRUCT: int = 100
+    QDRANT_HNSW_EF: int = 0  # ef a la recherche ; 0 = valeur par defaut de Qdrant
+    QDRANT_QUANTIZATION: str = "int8"  # "int8" ou "none"
+    QDRANT_QUANTIZATION_RESCORE: bool = True
+    QDRANT_QUANTIZATION_OVERSAMPLING: float = 2.0
+    QDRANT_ON_DISK: bool = False
+    QDRANT_PAYLOAD_INDEXES: str = (
+        "source:keyword,faculty:keyword,audience:keyword,academic_year:keyword,uploaded_at:datetime"
+    )
+
+    # Copie locale des chunks et vecteurs : reconstruction de l'index sans re-encoder
+    CHUNK_STORE_ENABLED: bool = True
+    CHUNK_STORE_DIR: str = "storage/chunk_store"
+    CHUNK_STORE_SEARCH: str = "fallback"  # "off", "fallback" (Qdrant indisponible) ou "exact" (sans Qdrant, tests)
+
+    # Cache de reponses (exact + semantique)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.92
+
+    # Moteur d'embeddings : "huggingface" (PyTorch) ou "onnx" (export int8, CPU, sans PyTorch)
+    EMBEDDING_BACKEND: str = "huggingface"
+    ONNX_MODEL_DIR: str = "storage/models/all-MiniLM-L6-v2-onnx"  # python -m app.core.onnx_embeddings
+    ONNX_MODEL_FILE: str = "model_int8.onnx"  # "model.onnx" pour la version float32
+    ONNX_THREADS: int = 2  # Threads ONNX Runtime par appel
+    ONNX_MAX_BATCH_TOKENS: int = 8192  # Taille des lots (tokens, padding compris)
+    ONNX_MAX_LENGTH: int = 256  # Troncature, comme sentence-transformers
+
+    # Embedding des questions (micro-batching hors event loop)
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_BATCH_WAIT_MS: float = 5
+    EMBEDDING_THREADS: int = 2
+    EMBEDDING_CACHE_SIZE: int = 2048
+
+    # Pipeline d'ingestion PDF
+    INGESTION_PROCESSES: int = 2
+    INGESTION_PAGE_BATCH: int = 8
+    INGESTION_EMBED_BATCH: int = 64
+    INGESTION_UPSERT_CONCURRENCY: int = 2
+
+    # Decoupage des documents : "recursive" (tokens, structure) ou "character" (ancien split_text)
+    CHUNKER: str = "recursive"
+    CHUNK_MAX_TOKENS: int = 200  # Fenetre MiniLM : 256 tokens
+    CHUNK_OVERLAP_TOKENS: int = 20
+    CHUNK_MIN_TOKENS: int = 50
+
+    # Recherche hybride (vecteurs + BM25) et contexte du prompt
+    HYBRID_SEARCH_ENABLED: bool = True
+    RETRIEVAL_K: int = 4  # Nombre maximal de chunks dans le prompt
+    RETRIEVAL_FETCH_K: int = 20  # Candidats par methode avant fusion
+    RETRIEVAL_CANDIDATES: int = 10  # Candidats apres fusion RRF
+    RRF_K: int = 60
+    RERANKER_MODEL: str = ""  # ex. "cross-encoder/ms-marco-MiniLM-L-6-v2" ; vide = desactive
+    CONTEXT_TOKEN_BUDGET: int = 1200
+    BM25_REFRESH_SECONDS: int = 60  # Verification du corpus : index BM25 et cache de reponses de l'API
+    # Recherche restreinte au perimetre de l'utilisateur (faculte, public, annee universitaire)
+    RETRIEVAL_SCOPE_ENABLED: bool = True
+    RETRIEVAL_SCOPE_FILTER_CACHE_SIZE: int = 256  # Filtres Qdrant construits, par perimetre
+
+    # File de jobs d'ingestion persistante
+    UPLOAD_SPOOL_DIR: str = "storage/uploads"
+    INGESTION_WORKER_EMBEDDED: bool = True  # False quand "python -m app.worker" tourne a part
+    INGESTION_WORKER_CONCURRENCY: int = 2
+    INGESTION_JOB_MAX_ATTEMPTS: int = 3
+    INGESTION_JOB_RETRY_DELAY_SECONDS: int = 30
+    INGESTION_JOB_STALE_SECONDS: int = 600  # Job 'running' sans heartbeat depuis ce delai : remis en file
+    INGESTION_HEARTBEAT_SECONDS: float = 30  # Heartbeat d'un job en cours, independant de sa progression
+    INGESTION_POLL_INTERVAL_SECONDS: float = 2
+
+    # Memoire des conversations (fenetre d'echanges recents + resume glissant)
+    CONVERSATION_WINDOW_TURNS: int = 4
+    CONVERSATION_HISTORY_TOKEN_BUDGET: int = 600
+    CONVERSATION_SUMMARY_MAX_TOKENS: int = 250
+    QUERY_REWRITE_ENABLED: bool = True  # Reformule les relances en questions autonomes pour la recherche
+
+    # Ecriture differee de l'historique des conversations
+    HISTORY_BATCH_SIZE: int = 100
+    HISTORY_FLUSH_INTERVAL_MS: float = 200
+    HISTORY_QUEUE_SIZE: int = 10000
+
+    # WebSocket : files d'envoi par connexion, eviction et diffusion entre workers
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_SECONDS: float = 5
+    WS_HEARTBEAT_SECONDS: float = 30
+    # Eviction des clients JSON inactifs (0 = desactivee) ; les clients texte ne sont jamais evinces
+    WS_IDLE_TIMEOUT_SECONDS: float = 0
+    WS_PUBSUB_BACKEND: str = "memory"  # "memory" (un seul worker) ou "postgres" (LISTEN/NOTIFY)
+    WS_PUBSUB_CHANNEL: str = "chat_ws"
+
+    # Fournisseurs LLM : chaine de bascule et delais par fournisseur
+    LLM_PROVIDERS: str = "groq"  # ex. "groq,local" (secours hors ligne) ou "local" (tests de charge)
+    LLM_PROVIDER_TIMEOUTS: str = "groq:20,local:10"  # Delai max. du premier token et entre deux tokens (s)
+    LLM_PROVIDER_COOLDOWN_SECONDS: float = 30  # Mise a l'ecart d'un fournisseur defaillant
+    LLM_PROVIDER_MAX_ERROR_RATE: float = 0.5  # Sur ses 20 derniers appels
+    GROQ_MODEL: str = "llama-3.3-70b-versatile"
+    LOCAL_LLM_LATENCY_MS: float = 300  # Remplacant local : delai du premier token
+    LOCAL_LLM_TOKEN_MS: float = 15  # puis delai entre deux tokens
+    LOCAL_LLM_ANSWER_TOKENS: int = 60
+
+    # Ordonnancement des appels LLM (concurrence, equite, quotas du fournisseur)
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_PER_USER_CONCURRENCY: int = 1
+    LLM_MAX_QUEUE: int = 200  # Au-dela, les questions sont refusees (503)
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 30
+    # Quotas du compte fournisseur ; chaque processus n'en prend que 1/LLM_PROCESS_COUNT
+    LLM_REQUESTS_PER_MINUTE: float = 30  # Quota Groq (palier gratuit) ; 0 = illimite
+    LLM_TOKENS_PER_MINUTE: float = 0  # ex. 6000 sur le palier gratuit ; 0 = illimite
+    LLM_PROCESS_COUNT: int = 1  # Processus qui appellent le LLM (workers uvicorn x replicas)
+    LLM_BACKGROUND_CONCURRENCY: int = 2  # Places de la voie de fond (reformulation, resumes)
+    LLM_BACKGROUND_QUOTA_SHARE: float = 0.2  # Part des quotas reservee a la voie de fond
+    LLM_COMPLETION_TOKENS_ESTIMATE: int = 300  # Tokens de reponse comptes d'avance par appel
+    LLM_COALESCE_ENABLED: bool = True  # Generations identiques en cours partagees
+
+    # Observabilite : /metrics (Prometheus), traces des requetes lentes, profileur
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ""  # Si renseigne, /metrics exige "Authorization: Bearer <token>"
+    TRACE_SLOW_REQUEST_MS: float = 2000  # Detail des etapes journalise au-dela ; 0 = jamais
+    PROFILER_ENABLED: bool = True  # /admin/profile (administrateurs) ; aucun cout hors capture
+    PROFILER_INTERVAL_MS: float = 5
+    PROFILER_MAX_SECONDS: float = 60
+
+    # Authentification : cache des utilisateurs et hachage bcrypt hors event loop
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    BCRYPT_THREADS: int = 2  # Nombre maximal de hachages bcrypt simultanes
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,21 +1,274 @@
+"""
+Moteur, sessions et schema de la base.
+
+Au demarrage, init_db cree les tables manquantes et refuse de demarrer si une
+table existante est en retard sur les modeles (colonne ou index ajoute). Les
+colonnes et index s'ajoutent par une commande unique, lancee avant l'API et
+les workers (service "migrate" de docker-compose) :
+
+    python -m app.core.database check|migrate
+
+Sur Postgres, un verrou consultatif serialise ces operations entre processus.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import List
+
 from sqlmodel import SQLModel
+from sqlalchemy import event, exc, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tracing import record
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseMetrics:
+    """Utilisation du pool, temps d'attente d'une connexion et requetes lentes."""
+
+    def __init__(self, slow_query_ms: float = 200):
+        self.slow_query_ms = slow_query_ms
+        self.checkouts = 0
+        self.waits = 0  # Checkouts qui ont du attendre une connexion
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+        self.timeouts = 0
+        self.queries = 0
+        self.slow_queries = 0
+
+    def record_checkout(self, waited: float):
+        record("db.pool_wait", waited)
+        self.checkouts += 1
+        if waited > 0.001:
+            self.waits += 1
+            self.wait_total_s += waited
+            self.wait_max_s = max(self.wait_max_s, waited)
+
+    def record_query(self, statement: str, elapsed: float):
+        # Une etape par type d'ordre (db.select, db.insert...) : cardinalite bornee
+        record("db." + (statement.split(None, 1) or ["?"])[0].lower(), elapsed)
+        self.queries += 1
+        if elapsed * 1000 < self.slow_query_ms:
+            return
+        self.slow_queries += 1
+        statement = " ".join(statement.split())[:200]
+        logger.warning(f"Requete SQL lente ({elapsed * 1000:.0f} ms) : {statement}")
+
+    def stats(self, pool=None) -> dict:
+        report = {
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_avg_ms": round(self.wait_total_s / self.waits * 1000, 1) if self.waits else 0.0,
+            "wait_max_ms": round(self.wait_max_s * 1000, 1),
+            "timeouts": self.timeouts,
+            "queries": self.queries,
+            "slow_queries": self.slow_queries,
+            "slow_query_ms": self.slow_query_ms,
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            report["pool"] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+                "utilisation": round(pool.checkedout() / (pool.size() + max(pool._max_overflow, 0)), 3),
+            }
+        return report
+
+
+db_metrics = DatabaseMetrics(slow_query_ms=settings.DB_SLOW_QUERY_MS)
+metrics.gauge(
+    "db_events_total", "Checkouts du pool, attentes, timeouts, requetes et requetes lentes",
+    lambda: {
+        "checkouts": db_metrics.checkouts,
+        "waits": db_metrics.waits,
+        "timeouts": db_metrics.timeouts,
+        "queries": db_metrics.queries,
+        "slow_queries": db_metrics.slow_queries,
+    },
+    ["event"], kind="counter",
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Pool de connexions qui mesure l'attente d'une connexion libre."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            db_metrics.timeouts += 1
+            raise
+        db_metrics.record_checkout(time.perf_counter() - started)
+        return connection
+
+
+def _engine_options() -> dict:
+    url = make_url(settings.DATABASE_URL)
+    if url.get_backend_name() != "postgresql":
+        # SQLite (developpement) : pool par defaut du dialecte
+        return {}
+    options = {
+        "poolclass": InstrumentedPool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS and url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+    return options
 
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=settings.DEBUG, # True seulement en dev, False en prod pour la performance
-    future=True
+    future=True,
+    **_engine_options(),
+)
+
+metrics.gauge(
+    "db_pool_connections", "Connexions du pool (en cours d'utilisation, libres)",
+    lambda: {"checked_out": engine.pool.checkedout(), "idle": engine.pool.checkedin()}
+    if isinstance(engine.pool, AsyncAdaptedQueuePool) else {},
+    ["state"],
 )
 
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    db_metrics.record_query(statement, time.perf_counter() - started)
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+# Fabrique de sessions partagee (API, WebSocket et worker d'ingestion)
+async_session_maker = sessionmaker(
+    engine, class_=AsyncSession, expire_on_commit=False
+)
+
+# Verrou consultatif Postgres des operations sur le schema (init_db, migrate)
+SCHEMA_LOCK_KEY = 0x434155524953
+
+def _lock_schema(connection):
+    """Libere a la fin de la transaction ; SQLite (developpement) : sans objet."""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+def _schema_drift(connection) -> List[str]:
+    """Colonnes et index des modeles absents des tables existantes."""
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    drift = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        drift += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        drift += [f"{table.name}:{index.name}" for index in table.indexes if index.name not in indexes]
+    return drift
+
+def _add_missing_columns(connection):
+    # Colonnes ajoutees a un modele existant (nullables ou avec valeur par defaut serveur)
+    existing_tables = set(inspect(connection).get_table_names())
+    preparer = connection.dialect.identifier_preparer
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            if not column.nullable and column.server_default is None:
+                logger.error(f"Colonne {table.name}.{column.name} manquante et obligatoire : migration manuelle requise")
+                continue
+            ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+            ddl += column.type.compile(dialect=connection.dialect)
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+                ddl += " NOT NULL" if not column.nullable else ""
+            connection.execute(text(ddl))
+            logger.info(f"Colonne {table.name}.{column.name} ajoutee")
+
+def _create_missing_indexes(connection):
+    # create_all ignore les index ajoutes a une table deja existante
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
 async def init_db():
+    """Tables manquantes ; RuntimeError si le schema des tables existantes est en retard."""
     async with engine.begin() as conn:
+        await conn.run_sync(_lock_schema)
         await conn.run_sync(SQLModel.metadata.create_all)
+        drift = await conn.run_sync(_schema_drift)
+    if drift:
+        raise RuntimeError(
+            f"Schema de la base en retard ({', '.join(drift)}) : lancer python -m app.core.database migrate"
+        )
+
+async def migrate_db() -> List[str]:
+    """Tables, colonnes et index manquants, en une transaction ; retourne l'ecart constate avant."""
+    async with engine.begin() as conn:
+        await conn.run_sync(_lock_schema)
+        await conn.run_sync(SQLModel.metadata.create_all)
+        drift = await conn.run_sync(_schema_drift)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+    return drift
+
+async def check_db() -> List[str]:
+    async with engine.connect() as conn:
+        return await conn.run_sync(_schema_drift)
 
 async def get_session() -> AsyncSession:
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
-    async with async_session() as session:
-        yield session
\ No newline at end of file
+    async with async_session_maker() as session:
+        yield session
+
+def database_stats() -> dict:
+    return db_metrics.stats(engine.sync_engine.pool)
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema de la base : verification ou ajout des colonnes et index manquants")
+    parser.add_argument("command", choices=["check", "migrate"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    # Tous les modeles, pour que SQLModel.metadata decrive le schema complet
+    import app.models.base  # noqa: F401
+    import app.models.chat  # noqa: F401
+    import app.models.document  # noqa: F401
+    import app.models.user  # noqa: F401
+
+    async def run():
+        try:
+            if args.command == "migrate":
+                return await migrate_db(), await check_db()
+            return [], await check_db()
+        finally:
+            await engine.dispose()
+
+    added, drift = asyncio.run(run())
+    print(json.dumps({"command": args.command, "added": added, "drift": drift}, indent=2))
+    # Reste en retard : colonne obligatoire sans valeur par defaut (migration manuelle)
+    if drift:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
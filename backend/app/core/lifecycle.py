@@ -0,0 +1,38 @@
+"""
+Etat de demarrage de l'application : la vivacite (le processus repond) est
+distincte de la disponibilite (base, Qdrant, modele d'embeddings, tokenizer et LLM prets).
+"""
+import time
+from typing import Dict, Optional
+
+class Readiness:
+    COMPONENTS = ("database", "qdrant", "embeddings", "tokenizer", "llm")
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._ready: Dict[str, bool] = {name: False for name in self.COMPONENTS}
+        self._errors: Dict[str, str] = {}
+        self._ready_after: Dict[str, float] = {}
+
+    def mark(self, component: str, ok: bool = True, error: Optional[str] = None):
+        self._ready[component] = ok
+        if ok:
+            self._errors.pop(component, None)
+            self._ready_after.setdefault(component, round(time.monotonic() - self.started_at, 2))
+        elif error:
+            self._errors[component] = error
+
+    @property
+    def ready(self) -> bool:
+        return all(self._ready.values())
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "components": dict(self._ready),
+            "errors": dict(self._errors),
+            "ready_after_s": dict(self._ready_after),
+            "uptime_s": round(time.monotonic() - self.started_at, 2),
+        }
+
+readiness = Readiness()
@@ -0,0 +1,193 @@
+"""
+Moteur d'embeddings ONNX Runtime (CPU), substituable a HuggingFaceEmbeddings.
+
+Execute une exportation ONNX (quantifiee int8 par defaut) de all-MiniLM-L6-v2 :
+pas d'import de PyTorch, memoire residente et temps d'encodage reduits sur nos
+serveurs sans GPU. Le calcul reproduit celui de sentence-transformers
+(troncature a 256 tokens, moyenne des tokens ponderee par le masque, norme L2) :
+les vecteurs restent comparables a ceux deja indexes dans Qdrant
+(voir benchmarks/embedding_benchmark.py pour la verification).
+
+- Lots dynamiques : les textes sont tries par longueur puis regroupes tant que
+  le lot tient dans max_batch_tokens (padding compris) ; les textes courts
+  (questions) partent en grands lots, les chunks longs en lots plus petits.
+- Padding a la longueur maximale du lot seulement, et non a 256.
+- Nombre de threads ONNX Runtime configurable (ONNX_THREADS).
+
+Exportation du modele (une fois, sur une machine ou PyTorch est installe) :
+
+    python -m app.core.onnx_embeddings [--output storage/models/all-MiniLM-L6-v2-onnx]
+
+Necessite onnxruntime et tokenizers (et onnx pour l'exportation) : extra "onnx" du projet.
+"""
+import argparse
+import logging
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MODEL_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+class OnnxEmbeddings(Embeddings):
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = "model_int8.onnx",
+        threads: int = 2,
+        max_batch_tokens: int = 8192,
+        max_length: int = 256,
+    ):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError(
+                "EMBEDDING_BACKEND=onnx necessite les paquets onnxruntime et tokenizers : "
+                "poetry install --extras onnx (image Docker : --build-arg POETRY_EXTRAS=onnx)"
+            ) from e
+
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise RuntimeError(
+                f"Modele ONNX introuvable ({model_path}) : lancer python -m app.core.onnx_embeddings"
+            )
+
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()  # Padding fait ici, a la longueur du lot
+        self.tokenizer.enable_truncation(max_length)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs() if i.name in MODEL_INPUTS]
+        self.batches = 0
+        self.padding_tokens = 0
+        logger.info(f"Embeddings ONNX charges : {model_path} ({threads} threads)")
+
+    @classmethod
+    def from_settings(cls) -> "OnnxEmbeddings":
+        return cls(
+            model_dir=settings.ONNX_MODEL_DIR,
+            model_file=settings.ONNX_MODEL_FILE,
+            threads=settings.ONNX_THREADS,
+            max_batch_tokens=settings.ONNX_MAX_BATCH_TOKENS,
+            max_length=settings.ONNX_MAX_LENGTH,
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(list(texts))
+        vectors = [None] * len(texts)
+        for batch in self._batches(encodings):
+            for index, vector in zip(batch, self._run([encodings[i] for i in batch])):
+                vectors[index] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "padding_tokens": self.padding_tokens}
+
+    # --- Interne ---
+
+    def _batches(self, encodings) -> List[List[int]]:
+        """Indices regroupes par longueur croissante, dans la limite de max_batch_tokens."""
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        batches, current = [], []
+        for index in order:
+            # Trie par longueur : le dernier texte ajoute fixe la longueur du lot
+            length = len(encodings[index].ids)
+            if current and (len(current) + 1) * length > self.max_batch_tokens:
+                batches.append(current)
+                current = []
+            current.append(index)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _run(self, encodings) -> np.ndarray:
+        length = max(len(encoding.ids) for encoding in encodings)
+        arrays = {name: np.zeros((len(encodings), length), dtype=np.int64) for name in MODEL_INPUTS}
+        for row, encoding in enumerate(encodings):
+            size = len(encoding.ids)
+            arrays["input_ids"][row, :size] = encoding.ids
+            arrays["attention_mask"][row, :size] = encoding.attention_mask
+            arrays["token_type_ids"][row, :size] = encoding.type_ids
+        hidden = self.session.run(None, {name: arrays[name] for name in self.input_names})[0]
+
+        self.batches += 1
+        self.padding_tokens += int(arrays["attention_mask"].size - arrays["attention_mask"].sum())
+        return mean_pooling(hidden, arrays["attention_mask"])
+
+def mean_pooling(hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Moyenne des tokens reels puis norme L2 (modules Pooling + Normalize de sentence-transformers)."""
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    summed = (hidden * mask).sum(axis=1)
+    pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.clip(norms, 1e-12, None)
+
+# --- Exportation ---
+
+def export_model(output_dir: str, quantize: bool = True) -> str:
+    """Exporte le modele PyTorch en ONNX (float32), puis le quantifie en int8 (poids)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    from app.core.vector_db import EMBEDDING_MODEL
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    tokenizer.save_pretrained(output_dir)  # tokenizer.json lu par le moteur
+    model = AutoModel.from_pretrained(EMBEDDING_MODEL).eval()
+
+    sample = tokenizer(["Exemple de phrase pour l'exportation"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in MODEL_INPUTS}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in MODEL_INPUTS),
+            fp32_path,
+            input_names=list(MODEL_INPUTS),
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    logger.info(f"Modele exporte : {fp32_path}")
+    if not quantize:
+        return fp32_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = os.path.join(output_dir, "model_int8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    logger.info(f"Modele quantifie : {int8_path}")
+    return int8_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporte all-MiniLM-L6-v2 en ONNX (int8) pour EMBEDDING_BACKEND=onnx")
+    parser.add_argument("--output", default=settings.ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="Garder uniquement le modele float32")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    path = export_model(args.output, quantize=not args.no_quantize)
+    print(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Profileur par echantillonnage, activable en production sans redemarrage.
+
+Un thread releve la pile de tous les threads du processus (sys._current_frames)
+a intervalle regulier pendant la duree demandee. Aucun cout en dehors d'une
+capture ; pendant la capture, le cout est celui d'un releve de piles par intervalle.
+Resultat : fonctions les plus presentes, ou piles repliees ("folded",
+compatibles flamegraph.pl / speedscope).
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.core.config import settings
+
+# Sommets de pile d'un thread qui attend (pool de threads inoccupe, event loop
+# sans travail, connexion en attente) : exclus par defaut pour ne garder que le travail
+IDLE_FRAMES = (
+    "_worker (thread.py:",
+    "wait (threading.py:",
+    "select (selectors.py:",
+    "get (queue.py:",
+    "_connection_worker_thread (core.py:",
+)
+
+class ProfilerBusy(Exception):
+    pass
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def capture(self, seconds: float, interval: float = None, include_idle: bool = False) -> dict:
+        """Capture bloquante (a lancer dans un thread). Une seule capture a la fois."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("Une capture est deja en cours")
+        try:
+            return self._capture(seconds, interval or self.interval, include_idle)
+        finally:
+            self._lock.release()
+
+    def _capture(self, seconds: float, interval: float, include_idle: bool) -> dict:
+        own = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        samples = idle = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if not include_idle and _frame_label(frame).startswith(IDLE_FRAMES):
+                    idle += 1
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        return {
+            "seconds": seconds,
+            "interval_ms": interval * 1000,
+            "samples": samples,
+            "idle_stacks": idle,
+            "stacks": stacks,
+        }
+
+    @staticmethod
+    def folded(result: dict) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in result["stacks"].most_common()) + "\n"
+
+    @staticmethod
+    def top(result: dict, limit: int = 30) -> dict:
+        """Fonctions les plus echantillonnees : en propre (sommet de pile) et en cumule."""
+        own, inclusive = Counter(), Counter()
+        for stack, count in result["stacks"].items():
+            frames = stack.split(";")[1:]  # Sans le nom du thread
+            if frames:
+                own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        total = sum(result["stacks"].values()) or 1
+
+        def as_rows(counter):
+            return [
+                {"function": label, "samples": count, "share": round(count / total, 3)}
+                for label, count in counter.most_common(limit)
+            ]
+
+        return {
+            "seconds": result["seconds"],
+            "interval_ms": result["interval_ms"],
+            "samples": result["samples"],
+            "idle_stacks": result["idle_stacks"],
+            "self": as_rows(own),
+            "inclusive": as_rows(inclusive),
+        }
+
+# Singleton
+profiler = SamplingProfiler(interval=settings.PROFILER_INTERVAL_MS / 1000)
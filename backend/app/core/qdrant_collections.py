@@ -0,0 +1,376 @@
+"""
+Gestion de la collection Qdrant des documents.
+
+L'application utilise toujours le nom settings.QDRANT_COLLECTION ("documents"),
+qui est un alias vers une collection physique versionnee ("documents_<date>").
+Changer la configuration (HNSW, quantification, stockage disque) se fait par
+migration : nouvelle collection, copie des points, bascule atomique de l'alias.
+
+    python -m app.core.qdrant_collections status
+    python -m app.core.qdrant_collections migrate [--keep-old]
+
+Instantanes, statistiques par source et suppression en masse : voir check_qdrant.py.
+"""
+import argparse
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from app.core.config import settings
+from app.core.vector_db import METADATA_PAYLOAD_KEY
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 384
+
+def payload_indexes() -> Dict[str, models.PayloadSchemaType]:
+    """QDRANT_PAYLOAD_INDEXES = "source:keyword,faculty:keyword,uploaded_at:datetime"..."""
+    indexes = {}
+    for item in settings.QDRANT_PAYLOAD_INDEXES.split(","):
+        if not item.strip():
+            continue
+        field, _, schema = item.strip().partition(":")
+        indexes[f"{METADATA_PAYLOAD_KEY}.{field}"] = models.PayloadSchemaType(schema or "keyword")
+    return indexes
+
+def quantization_config():
+    if settings.QDRANT_QUANTIZATION == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,  # Vecteurs quantifies en RAM, originaux eventuellement sur disque
+            )
+        )
+    if settings.QDRANT_QUANTIZATION not in ("", "none"):
+        raise ValueError(f"QDRANT_QUANTIZATION inconnu : {settings.QDRANT_QUANTIZATION}")
+    return None
+
+def search_params(hnsw_ef: Optional[int] = None) -> models.SearchParams:
+    """Parametres de recherche par requete : ef HNSW et re-scoring sur vecteurs originaux."""
+    quantization = None
+    if settings.QDRANT_QUANTIZATION == "int8":
+        quantization = models.QuantizationSearchParams(
+            rescore=settings.QDRANT_QUANTIZATION_RESCORE,
+            oversampling=settings.QDRANT_QUANTIZATION_OVERSAMPLING,
+        )
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef or settings.QDRANT_HNSW_EF or None,
+        quantization=quantization,
+    )
+
+def create_physical_collection(client: QdrantClient, name: str):
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(
+            size=EMBEDDING_DIM, distance=models.Distance.COSINE, on_disk=settings.QDRANT_ON_DISK
+        ),
+        hnsw_config=models.HnswConfigDiff(
+            m=settings.QDRANT_HNSW_M,
+            ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+            on_disk=settings.QDRANT_ON_DISK,
+        ),
+        quantization_config=quantization_config(),
+        on_disk_payload=settings.QDRANT_ON_DISK,
+    )
+    ensure_payload_indexes(client, name)
+    logger.info(f"Collection Qdrant {name} creee")
+
+def ensure_payload_indexes(client: QdrantClient, collection: str) -> List[str]:
+    """
+    Cree les index de payload manquants, y compris sur une collection existante
+    (champ ajoute a QDRANT_PAYLOAD_INDEXES) : les filtres de recherche sur un
+    champ non indexe parcourent tous les points.
+    """
+    present = client.get_collection(collection).payload_schema or {}
+    created = []
+    for field, schema in payload_indexes().items():
+        if field not in present:
+            client.create_payload_index(collection_name=collection, field_name=field, field_schema=schema, wait=True)
+            created.append(field)
+    return created
+
+def resolve_alias(client: QdrantClient, alias: str) -> Optional[str]:
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+def new_collection_name(alias: str, client: Optional[QdrantClient] = None) -> str:
+    name = base = f"{alias}_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+    # Deux collections creees dans la meme seconde (instantane restaure puis reconstruction...)
+    suffix = 1
+    while client is not None and client.collection_exists(name):
+        suffix += 1
+        name = f"{base}_{suffix}"
+    return name
+
+def ensure_collection(client: QdrantClient, alias: Optional[str] = None):
+    """
+    Cree la collection (et son alias) si besoin. Une ancienne collection creee
+    directement sous le nom de l'alias reste utilisee telle quelle jusqu'a la
+    premiere migration. Les index de payload manquants sont ajoutes.
+    """
+    alias = alias or settings.QDRANT_COLLECTION
+    existing = resolve_alias(client, alias) or (alias if client.collection_exists(alias) else None)
+    if existing:
+        created = ensure_payload_indexes(client, existing)
+        if created:
+            logger.info(f"Index de payload ajoutes a {existing} : {', '.join(created)}")
+        return
+    name = new_collection_name(alias)
+    create_physical_collection(client, name)
+    client.update_collection_aliases(change_aliases_operations=[
+        models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=name, alias_name=alias))
+    ])
+
+def _copy_points(client: QdrantClient, source: str, target: str, batch_size: int) -> int:
+    copied, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[models.PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                wait=True,
+            )
+            copied += len(points)
+        if offset is None:
+            return copied
+
+def _sync_points(client: QdrantClient, source: str, target: str, batch_size: int) -> Tuple[int, int]:
+    """
+    Aligne target sur source : recopie les points absents ou dont le payload
+    differe (perimetre modifie pendant la copie), supprime ceux qui n'existent
+    plus dans source. Retourne (points recopies, points supprimes).
+    """
+    source_ids, copied, offset = set(), 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source, limit=batch_size, offset=offset, with_payload=True, with_vectors=False
+        )
+        source_ids.update(p.id for p in points)
+        if points:
+            current = {p.id: p.payload for p in client.retrieve(target, ids=[p.id for p in points], with_payload=True)}
+            stale = [p.id for p in points if current.get(p.id) != p.payload]
+            if stale:
+                fresh = client.retrieve(source, ids=stale, with_payload=True, with_vectors=True)
+                client.upsert(
+                    collection_name=target,
+                    points=[models.PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in fresh],
+                    wait=True,
+                )
+                copied += len(fresh)
+        if offset is None:
+            break
+
+    deleted, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=target, limit=batch_size, offset=offset, with_payload=False, with_vectors=False
+        )
+        gone = [p.id for p in points if p.id not in source_ids]
+        if gone:
+            client.delete(collection_name=target, points_selector=models.PointIdsList(points=gone), wait=True)
+            deleted += len(gone)
+        if offset is None:
+            return copied, deleted
+
+def _catch_up(client: QdrantClient, source: str, target: str, batch_size: int, max_passes: int = 5) -> dict:
+    """Passes de _sync_points jusqu'a ce qu'une passe ne trouve plus d'ecart (ou max_passes)."""
+    result = {"passes": 0, "copied": 0, "deleted": 0}
+    while result["passes"] < max_passes:
+        copied, deleted = _sync_points(client, source, target, batch_size)
+        result["passes"] += 1
+        result["copied"] += copied
+        result["deleted"] += deleted
+        if not copied and not deleted:
+            break
+    return result
+
+def migrate_collection(
+    client: QdrantClient, alias: Optional[str] = None, keep_old: bool = False, batch_size: int = 256
+) -> dict:
+    """
+    Migre vers une collection construite avec la configuration courante :
+    les lectures continuent sur l'ancienne collection pendant la copie. Avant
+    la bascule atomique de l'alias, des passes de rattrapage alignent la
+    nouvelle collection sur l'ancienne (points ajoutes, payloads modifies,
+    points supprimes entre-temps) jusqu'a ne plus trouver d'ecart : seules
+    les ecritures des quelques millisecondes precedant la bascule peuvent
+    encore manquer.
+    """
+    alias = alias or settings.QDRANT_COLLECTION
+    old = resolve_alias(client, alias)
+    legacy = old is None and client.collection_exists(alias)
+    if legacy:
+        old = alias
+    new = new_collection_name(alias, client)
+
+    create_physical_collection(client, new)
+    copied = _copy_points(client, old, new, batch_size) if old else 0
+    caught_up = _catch_up(client, old, new, batch_size) if old else None
+
+    if legacy:
+        # Collection creee avant les alias : elle porte le nom de l'alias et doit
+        # etre supprimee avant de creer celui-ci (coupure de quelques millisecondes).
+        if keep_old:
+            logger.warning(f"L'ancienne collection {old} porte le nom de l'alias : elle ne peut pas etre conservee")
+        client.delete_collection(old)
+        client.update_collection_aliases(change_aliases_operations=[
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=new, alias_name=alias))
+        ])
+    else:
+        operations = []
+        if old:
+            operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+        operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=new, alias_name=alias)))
+        client.update_collection_aliases(change_aliases_operations=operations)
+        if old and not keep_old:
+            client.delete_collection(old)
+
+    result = {"alias": alias, "from": old, "to": new, "copied": copied, "caught_up": caught_up}
+    logger.info(f"Migration de la collection terminee : {result}")
+    return result
+
+def physical_collection(client: QdrantClient, alias: Optional[str] = None) -> Optional[str]:
+    """Collection designee par l'alias (ou collection anterieure aux alias portant ce nom)."""
+    alias = alias or settings.QDRANT_COLLECTION
+    return resolve_alias(client, alias) or (alias if client.collection_exists(alias) else None)
+
+def collection_status(client: QdrantClient, alias: Optional[str] = None) -> dict:
+    alias = alias or settings.QDRANT_COLLECTION
+    name = physical_collection(client, alias)
+    if name is None:
+        return {"alias": alias, "collection": None}
+    info = client.get_collection(name)
+    return {
+        "alias": alias,
+        "collection": name,
+        "points": info.points_count,
+        "indexed_vectors": info.indexed_vectors_count,
+        "status": str(info.status),
+        "vectors": info.config.params.vectors.model_dump(mode="json") if info.config.params.vectors else None,
+        "hnsw": info.config.hnsw_config.model_dump(mode="json"),
+        "quantization": info.config.quantization_config.model_dump(mode="json") if info.config.quantization_config else None,
+        "payload_indexes": sorted(info.payload_schema),
+    }
+
+# --- Instantanes ---
+
+def snapshot_location(collection: str, snapshot: str) -> str:
+    """URL d'un instantane du serveur, utilisable par recover_snapshot."""
+    return f"{settings.QDRANT_URL.rstrip('/')}/collections/{collection}/snapshots/{snapshot}"
+
+def create_snapshot(client: QdrantClient, alias: Optional[str] = None) -> dict:
+    name = physical_collection(client, alias)
+    if name is None:
+        raise ValueError(f"Collection introuvable : {alias or settings.QDRANT_COLLECTION}")
+    snapshot = client.create_snapshot(collection_name=name, wait=True)
+    logger.info(f"Instantane {snapshot.name} de {name} cree")
+    return {"collection": name, "snapshot": snapshot.name, "size": snapshot.size, "created_at": snapshot.creation_time}
+
+def list_snapshots(client: QdrantClient, alias: Optional[str] = None) -> List[dict]:
+    """Instantanes de toutes les collections physiques de l'alias (y compris les anciennes conservees)."""
+    alias = alias or settings.QDRANT_COLLECTION
+    snapshots = []
+    for collection in client.get_collections().collections:
+        if collection.name != alias and not collection.name.startswith(f"{alias}_"):
+            continue
+        for snapshot in client.list_snapshots(collection.name):
+            snapshots.append({
+                "collection": collection.name,
+                "snapshot": snapshot.name,
+                "size": snapshot.size,
+                "created_at": snapshot.creation_time,
+            })
+    return sorted(snapshots, key=lambda item: item["created_at"] or "")
+
+def restore_snapshot(client: QdrantClient, location: str, alias: Optional[str] = None, drop_old: bool = False) -> dict:
+    """
+    Restaure un instantane dans une nouvelle collection physique puis bascule
+    l'alias atomiquement, comme une migration : les lectures ne voient jamais
+    une collection a moitie restauree. L'ancienne collection est conservee
+    sauf drop_old.
+    """
+    alias = alias or settings.QDRANT_COLLECTION
+    old = resolve_alias(client, alias)
+    if old is None and client.collection_exists(alias):
+        raise ValueError(f"{alias} est une collection sans alias : lancer d'abord la migration")
+    new = new_collection_name(alias, client)
+
+    client.recover_snapshot(collection_name=new, location=location, wait=True)
+    operations = []
+    if old:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=new, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    if old and drop_old:
+        client.delete_collection(old)
+
+    result = {"alias": alias, "from": old, "to": new, "location": location, "old_dropped": bool(old and drop_old)}
+    logger.info(f"Instantane restaure : {result}")
+    return result
+
+# --- Points par source ---
+
+def source_point_counts(client: QdrantClient, alias: Optional[str] = None, batch_size: int = 1000) -> Counter:
+    """Nombre de points par source (None : points sans source), en parcourant la collection."""
+    key = f"{METADATA_PAYLOAD_KEY}.source"
+    counts, offset = Counter(), None
+    while True:
+        points, offset = client.scroll(
+            collection_name=alias or settings.QDRANT_COLLECTION,
+            limit=batch_size,
+            offset=offset,
+            with_payload=[key],
+            with_vectors=False,
+        )
+        for point in points:
+            counts[((point.payload or {}).get(METADATA_PAYLOAD_KEY) or {}).get("source")] += 1
+        if offset is None:
+            return counts
+
+def delete_sources(client: QdrantClient, sources: Iterable[str], alias: Optional[str] = None, batch_size: int = 100) -> int:
+    """Supprime tous les points des sources donnees (par lots de sources) ; retourne le nombre de points supprimes."""
+    collection = alias or settings.QDRANT_COLLECTION
+    sources = list(sources)
+    deleted = 0
+    for start in range(0, len(sources), batch_size):
+        selection = models.Filter(must=[
+            models.FieldCondition(
+                key=f"{METADATA_PAYLOAD_KEY}.source", match=models.MatchAny(any=sources[start:start + batch_size])
+            )
+        ])
+        deleted += client.count(collection_name=collection, count_filter=selection, exact=True).count
+        client.delete(collection_name=collection, points_selector=models.FilterSelector(filter=selection), wait=True)
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description="Gestion de la collection Qdrant des documents")
+    parser.add_argument("command", choices=["status", "migrate"])
+    parser.add_argument("--keep-old", action="store_true", help="Conserver l'ancienne collection apres migration")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    client = QdrantClient(url=settings.QDRANT_URL)
+    if args.command == "migrate":
+        result = migrate_collection(client, keep_old=args.keep_old, batch_size=args.batch_size)
+    else:
+        result = collection_status(client)
+    print(json.dumps(result, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
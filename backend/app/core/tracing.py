@@ -0,0 +1,162 @@
+"""
+Traces par requete : duree de chaque etape (embedding, recherche, LLM, base...).
+
+Chaque etape alimente l'histogramme app_stage_duration_seconds{stage} et, si
+une trace est en cours (requete HTTP, message WebSocket), la trace elle-meme :
+detail renvoye dans l'en-tete Server-Timing et journalise pour les requetes lentes.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = metrics.histogram(
+    "app_stage_duration_seconds", "Duree des etapes (RAG, ingestion, auth, base)", ["stage"]
+)
+STAGE_ERRORS = metrics.counter("app_stage_errors_total", "Etapes terminees en erreur", ["stage"])
+HTTP_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Duree des requetes HTTP", ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = 0
+metrics.gauge("http_requests_in_flight", "Requetes HTTP en cours", lambda: HTTP_IN_FLIGHT)
+
+# Objet mutable partage : les taches filles (call_next, producteurs) completent la meme trace
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.attributes: Dict[str, object] = {}
+
+    def add(self, stage: str, duration: float):
+        self.spans.append((stage, duration))
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stage, duration in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + duration
+        return totals
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage.replace('.', '-')};dur={duration * 1000:.1f}" for stage, duration in self.totals().items())
+
+    def describe(self) -> str:
+        stages = " ".join(f"{stage}={duration * 1000:.0f}ms" for stage, duration in self.totals().items())
+        attributes = " ".join(f"{key}={value}" for key, value in self.attributes.items())
+        return f"{self.name} {self.elapsed * 1000:.0f}ms : {stages} {attributes}".rstrip()
+
+def start_trace(name: str) -> Trace:
+    trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+def record(stage: str, duration: float, error: bool = False):
+    STAGE_SECONDS.observe(duration, stage=stage)
+    if error:
+        STAGE_ERRORS.inc(stage=stage)
+    trace = _current.get()
+    if trace is not None:
+        trace.add(stage, duration)
+
+def annotate(**attributes):
+    """Attributs de la trace en cours (nombre de chunks, tokens...)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, error)
+
+def traced(stage: str):
+    """Decorateur : toute la fonction (synchrone ou coroutine) est une etape."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def finish_trace(trace: Trace):
+    """Journalise le detail d'une requete lente."""
+    if settings.TRACE_SLOW_REQUEST_MS and trace.elapsed * 1000 >= settings.TRACE_SLOW_REQUEST_MS:
+        logger.warning(f"Requete lente : {trace.describe()}")
+
+class RequestMetricsMiddleware:
+    """
+    Middleware ASGI : une trace par requete HTTP, duree par route et statut,
+    detail des etapes dans l'en-tete Server-Timing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global HTTP_IN_FLIGHT
+        trace = start_trace(f"{scope['method']} {scope['path']}")
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace.spans:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        HTTP_IN_FLIGHT += 1
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_IN_FLIGHT -= 1
+            # Gabarit de la route ("/chat/history") : cardinalite bornee
+            route = scope.get("route")
+            HTTP_SECONDS.observe(
+                trace.elapsed,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+            finish_trace(trace)
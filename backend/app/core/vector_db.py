@@ -1,22 +1,75 @@
-from langchain_qdrant import QdrantVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance
+"""
+Ressources vectorielles (client Qdrant, modele d'embeddings, vector store LangChain).
+Le modele d'embeddings est celui de EMBEDDING_BACKEND (PyTorch ou ONNX).
+Rien n'est charge a l'import : chaque ressource est creee au premier appel de
+son getter (ou pendant le prechauffage lance par le lifespan de l'application).
+"""
+import threading
+
 from app.core.config import settings
 
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+COLLECTION_NAME = settings.QDRANT_COLLECTION
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Format de payload de QdrantVectorStore
+CONTENT_PAYLOAD_KEY = "page_content"
+METADATA_PAYLOAD_KEY = "metadata"
+
+_lock = threading.Lock()
+_client = None
+_embeddings = None
+_vector_store = None
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from qdrant_client import QdrantClient
+                from app.core.qdrant_collections import ensure_collection
+
+                if settings.QDRANT_URL == ":memory:":
+                    # Qdrant local en memoire, dans le processus (tests et benchmarks hors ligne)
+                    client = QdrantClient(location=":memory:")
+                else:
+                    client = QdrantClient(url=settings.QDRANT_URL)
+                # Create collection (alias + versioned collection) if not exists
+                ensure_collection(client)
+                _client = client
+    return _client
+
+def get_embeddings():
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                _embeddings = build_embeddings(settings.EMBEDDING_BACKEND)
+    return _embeddings
+
+def build_embeddings(backend: str):
+    """Modele d'embeddings selon EMBEDDING_BACKEND (memes vecteurs, 384 dimensions)."""
+    if backend == "onnx":
+        from app.core.onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings.from_settings()
+    if backend == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
 
-client = QdrantClient(url=settings.QDRANT_URL)
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    raise ValueError(f"EMBEDDING_BACKEND inconnu : {backend}")
 
-# Create collection if not exists
-if not client.collection_exists("documents"):
-    client.create_collection(
-        collection_name="documents",
-        vectors_config=VectorParams(size=384, distance=Distance.COSINE)
-    )
+def get_vector_store():
+    global _vector_store
+    if _vector_store is None:
+        client, embeddings = get_client(), get_embeddings()
+        with _lock:
+            if _vector_store is None:
+                from langchain_qdrant import QdrantVectorStore
 
-vector_store = QdrantVectorStore(
-    client=client,
-    collection_name="documents",
-    embedding=embeddings
-)
\ No newline at end of file
+                _vector_store = QdrantVectorStore(
+                    client=client,
+                    collection_name=COLLECTION_NAME,
+                    embedding=embeddings,
+                    content_payload_key=CONTENT_PAYLOAD_KEY,
+                    metadata_payload_key=METADATA_PAYLOAD_KEY,
+                )
+    return _vector_store
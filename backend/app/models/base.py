@@ -1,5 +1,10 @@
 from sqlmodel import SQLModel, Field
 from typing import Optional
+from datetime import datetime, timezone
+
+def utc_now() -> datetime:
+    """Heure UTC sans fuseau : les colonnes datetime sont des TIMESTAMP sans fuseau."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 # Exemple de modèle simple pour tester la création de table
 class HealthCheck(SQLModel, table=True):
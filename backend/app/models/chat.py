@@ -1,16 +1,38 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Column, Index, Text
 from typing import Optional, TYPE_CHECKING
 from datetime import datetime
+from app.models.base import utc_now
 
 if TYPE_CHECKING:
     from app.models.user import User
 
+class Conversation(SQLModel, table=True):
+    """Fil de discussion : les derniers echanges et un resume des plus anciens servent de memoire."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    title: Optional[str] = None
+    # Resume glissant des echanges jusqu'a summarized_until_id (inclus)
+    summary: str = Field(default="", sa_column=Column(Text, nullable=False, server_default=""))
+    summarized_until_id: int = Field(default=0)
+    created_at: datetime = Field(default_factory=utc_now)
+    updated_at: datetime = Field(default_factory=utc_now)
+
 class ChatHistory(SQLModel, table=True):
+    # Pagination de l'historique d'un utilisateur, du plus recent au plus ancien
+    __table_args__ = (
+        Index("ix_chathistory_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_chathistory_conversation_id_id", "conversation_id", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
+    conversation_id: Optional[int] = Field(default=None, foreign_key="conversation.id")
     question: str
     answer: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Nombre de tokens du prompt envoye au LLM (0 : reponse servie par le cache)
+    prompt_tokens: Optional[int] = None
+    created_at: datetime = Field(default_factory=utc_now)
 
     # Relationship
-    user: "User" = Relationship(back_populates="chats")
\ No newline at end of file
+    user: "User" = Relationship(back_populates="chats")
@@ -0,0 +1,48 @@
+from sqlmodel import SQLModel, Field, Column, JSON
+from typing import Dict, Optional, List
+from datetime import datetime
+from app.models.base import utc_now
+
+class IngestionJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    filename: str
+    spool_path: str
+    status: str = Field(default="pending", index=True)  # pending, running, done, failed
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+    error: Optional[str] = None
+    # Perimetre du document (faculte, public, annee universitaire), "all" si absent
+    faculty: Optional[str] = None
+    audience: Optional[str] = None
+    academic_year: Optional[str] = None
+
+    # Progression
+    total_pages: int = Field(default=0)
+    pages: int = Field(default=0)
+    chunks: int = Field(default=0)
+    vectors: int = Field(default=0)
+    skipped_chunks: int = Field(default=0)
+    deleted_vectors: int = Field(default=0)
+
+    created_at: datetime = Field(default_factory=utc_now)
+    available_at: datetime = Field(default_factory=utc_now)  # Report apres un echec
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    updated_at: datetime = Field(default_factory=utc_now)  # Sert aussi de heartbeat
+
+class Document(SQLModel, table=True):
+    """Registre des documents indexes : permet la deduplication et la reindexation incrementale."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    source: str = Field(unique=True, index=True)
+    file_hash: str = Field(index=True)
+    page_count: int = Field(default=0)
+    chunk_count: int = Field(default=0)
+    page_hashes: List[str] = Field(default_factory=list, sa_column=Column(JSON))
+    chunk_hashes: List[str] = Field(default_factory=list, sa_column=Column(JSON))  # Hash du texte seul
+    # Hash des metadonnees de position (page, titre) de chaque chunk ; None = registre anterieur
+    chunk_layouts: Optional[List[str]] = Field(default=None, sa_column=Column(JSON))
+    # Faculte, public et annee copies dans le payload de chaque chunk ; None = anterieur au perimetre
+    scope: Optional[Dict[str, str]] = Field(default=None, sa_column=Column(JSON))
+
+    created_at: datetime = Field(default_factory=utc_now)
+    updated_at: datetime = Field(default_factory=utc_now)
@@ -10,6 +10,9 @@ class User(SQLModel, table=True):
     hashed_password: str
     full_name: str
     role: str = Field(default="student")  # student, teacher, admin
+    # Perimetre de recherche (voir retrieval_scope) ; absent = non restreint sur ce champ
+    faculty: Optional[str] = None
+    academic_year: Optional[str] = None  # ex. "2025-2026"
 
     # Relationship to chats
     chats: List["ChatHistory"] = Relationship(back_populates="user")
\ No newline at end of file
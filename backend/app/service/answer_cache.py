@@ -0,0 +1,230 @@
+import logging
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Cle exacte : minuscules, sans accents, ponctuation finale et espaces superflus retires."""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.split()).rstrip(" ?!.")
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    answer: str
+    sources: List[str]
+    vector: Optional[np.ndarray]
+    scope: str = ""
+    created_at: float = field(default_factory=time.monotonic)
+    size: int = 0
+
+
+class AnswerCache:
+    """
+    Cache de reponses a deux niveaux place devant RAGService :
+    - niveau exact, indexe par la question normalisee ;
+    - niveau semantique, qui sert les quasi-doublons dont l'embedding
+      depasse le seuil de similarite cosinus.
+    Les reponses sont cloisonnees par perimetre de recherche (cle `scope`) :
+    une reponse construite sur les documents d'une faculte n'est jamais
+    servie a un utilisateur d'une autre.
+    Eviction LRU + TTL, borne en nombre d'entrees et en memoire.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 0.92,
+        enabled: bool = True,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.enabled = enabled
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # Matrice des embeddings reconstruite paresseusement apres chaque modification
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._matrix_scopes: Optional[np.ndarray] = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Incremente a chaque invalidation : une reponse calculee avant
+        # l'indexation de nouveaux documents ne doit pas etre mise en cache
+        self.generation = 0
+
+    # --- Lecture ---
+
+    def get_exact(self, question: str, scope: str = "") -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        key = self._key(question, scope)
+        entry = self._entries.get(key)
+        if entry is None or self._expired(entry):
+            if entry is not None:
+                self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.exact_hits += 1
+        return entry
+
+    def get_semantic(self, vector, scope: str = "") -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        query = self._to_unit(vector)
+        matrix = self._get_matrix()
+        if query is None or matrix is None:
+            self.misses += 1
+            return None
+
+        scores = np.where(self._matrix_scopes == scope, matrix @ query, -np.inf)
+        best = int(np.argmax(scores))
+        key = self._matrix_keys[best]
+        entry = self._entries.get(key)
+        if scores[best] < self.similarity_threshold or entry is None or self._expired(entry):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.semantic_hits += 1
+        logger.debug(f"Cache semantique : '{entry.question}' (score {scores[best]:.3f})")
+        return entry
+
+    # --- Ecriture ---
+
+    def put(
+        self,
+        question: str,
+        answer: str,
+        sources: List[str],
+        vector=None,
+        generation: Optional[int] = None,
+        scope: str = "",
+    ):
+        if not self.enabled:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        key = self._key(question, scope)
+        unit = self._to_unit(vector)
+        entry = CacheEntry(question=question, answer=answer, sources=list(sources), vector=unit, scope=scope)
+        entry.size = (
+            len(question.encode("utf-8"))
+            + len(answer.encode("utf-8"))
+            + sum(len(s.encode("utf-8")) for s in sources)
+            + (unit.nbytes if unit is not None else 0)
+        )
+        if entry.size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._matrix = None
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self):
+        """Vide le cache (appele quand de nouveaux documents sont indexes)."""
+        if self._entries:
+            logger.info(f"Invalidation du cache de reponses ({len(self._entries)} entrees)")
+        self._entries.clear()
+        self._bytes = 0
+        self._matrix = None
+        self._matrix_keys = []
+        self._matrix_scopes = None
+        self.invalidations += 1
+        self.generation += 1
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "similarity_threshold": self.similarity_threshold,
+        }
+
+    # --- Interne ---
+
+    @staticmethod
+    def _key(question: str, scope: str) -> str:
+        key = normalize_question(question)
+        return f"{scope}\x1f{key}" if scope else key
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            self._matrix = None
+
+    def _to_unit(self, vector) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm > 0 else None
+
+    def _get_matrix(self) -> Optional[np.ndarray]:
+        if self._matrix is None:
+            keys = [k for k, e in self._entries.items() if e.vector is not None]
+            if not keys:
+                return None
+            self._matrix_keys = keys
+            self._matrix = np.stack([self._entries[k].vector for k in keys])
+            self._matrix_scopes = np.array([self._entries[k].scope for k in keys], dtype=object)
+        return self._matrix
+
+
+# Singleton
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=settings.ANSWER_CACHE_MAX_BYTES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    enabled=settings.ANSWER_CACHE_ENABLED,
+)
+
+metrics.gauge(
+    "answer_cache_lookups_total", "Consultations du cache de reponses par resultat",
+    lambda: {
+        "exact_hit": answer_cache.exact_hits,
+        "semantic_hit": answer_cache.semantic_hits,
+        "miss": answer_cache.misses,
+    },
+    ["result"], kind="counter",
+)
+metrics.gauge("answer_cache_entries", "Reponses en cache", lambda: len(answer_cache._entries))
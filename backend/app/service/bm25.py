@@ -0,0 +1,128 @@
+"""
+Index inverse BM25 en memoire, complementaire de la recherche vectorielle :
+il retrouve les termes exacts (codes de cours, numeros de salle, articles)
+que les embeddings ont tendance a manquer.
+Seuls les postings et les longueurs sont gardes ; le texte reste dans Qdrant.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Mots composes (INF-101, L2, 12.3) gardes entiers en plus de leurs parties
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+STOPWORDS = {
+    "a", "au", "aux", "avec", "ce", "ces", "cette", "dans", "de", "des", "du", "en", "est", "et",
+    "il", "elle", "je", "la", "le", "les", "leur", "lui", "ma", "mais", "me", "mes", "mon", "ne",
+    "nous", "on", "ou", "par", "pas", "pour", "qu", "que", "qui", "sa", "se", "ses", "son", "sont",
+    "sur", "ta", "te", "tes", "ton", "tu", "un", "une", "vos", "votre", "vous", "l", "d", "j", "c",
+    "n", "s", "t", "y", "quel", "quelle", "quels", "quelles", "comment", "the", "of", "and", "to",
+}
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = []
+    for match in TOKEN_PATTERN.findall(text):
+        if match not in STOPWORDS:
+            tokens.append(match)
+        parts = re.split(r"[-./]", match)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in STOPWORDS)
+    return tokens
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._doc_terms: Dict[str, List[str]] = {}
+        self._sources: Dict[str, Optional[str]] = {}
+        # Perimetre (faculte, public, annee) par source : commun a tous les chunks d'un document
+        self._scopes: Dict[Optional[str], dict] = {}
+        self._total_length = 0
+        # Version du corpus (nombre de documents, derniere modification) refletee par l'index
+        self.corpus_version = None
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id: str, text: str, source: Optional[str] = None, scope: Optional[dict] = None):
+        if doc_id in self._lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self._postings[term][doc_id] = frequency
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = list(terms)
+        self._lengths[doc_id] = length
+        self._sources[doc_id] = source
+        if scope is not None:
+            self._scopes[source] = scope
+        self._total_length += length
+
+    def remove(self, doc_id: str):
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._sources.pop(doc_id, None)
+        self._total_length -= length
+        for term in self._doc_terms.pop(doc_id, []):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def replace_with(self, other: "BM25Index"):
+        """Remplace le contenu par celui d'un index reconstruit a part."""
+        self._postings = other._postings
+        self._lengths = other._lengths
+        self._doc_terms = other._doc_terms
+        self._sources = other._sources
+        self._scopes = other._scopes
+        self._total_length = other._total_length
+
+    def remove_source(self, source: str):
+        for doc_id in [d for d, s in self._sources.items() if s == source]:
+            self.remove(doc_id)
+        self._scopes.pop(source, None)
+
+    def set_scope(self, source: str, scope: dict):
+        self._scopes[source] = scope
+
+    def search(
+        self, query: str, k: int = 20, where: Optional[Callable[[dict], bool]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        where (optionnel) recoit le perimetre de la source d'un chunk et
+        l'ecarte s'il retourne False, avant la selection des k meilleurs.
+        """
+        if not self._lengths:
+            return []
+        count = len(self._lengths)
+        average = self._total_length / count
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        if where is not None:
+            allowed: Dict[Optional[str], bool] = {}
+            for doc_id in list(scores):
+                source = self._sources.get(doc_id)
+                if source not in allowed:
+                    allowed[source] = where(self._scopes.get(source) or {})
+                if not allowed[source]:
+                    del scores[doc_id]
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+# Singleton
+bm25_index = BM25Index()
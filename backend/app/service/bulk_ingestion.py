@@ -0,0 +1,225 @@
+"""
+Ingestion en masse d'arborescences de PDF (corpus d'un semestre) via IngestionService.
+
+- Plusieurs fichiers traites en parallele (jobs) ; chacun passe par le pipeline
+  habituel (extraction multi-processus, embeddings par lots, upserts bornes).
+- Point de reprise : chaque fichier termine est ajoute a un fichier JSONL
+  (source, taille, date de modification, resultat, durees). Une execution
+  interrompue reprend la ou elle s'est arretee ; les fichiers modifies depuis
+  et les echecs sont retraites. Ce fichier sert aussi de rapport par fichier.
+- Progression sur la sortie d'erreur : fichiers, pages, debit, temps restant estime.
+
+Les sources sont les chemins relatifs a la racine ("L1/algo/cours1.pdf") :
+deux fichiers de meme nom dans des dossiers differents restent distincts.
+Tous les fichiers d'une execution recoivent le meme perimetre (faculte, public,
+annee) ; le changer retraite les fichiers, sans re-encoder ceux inchanges.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.service.ingestion import ingestion_service
+from app.service.retrieval_scope import document_scope
+
+logger = logging.getLogger(__name__)
+
+def find_pdfs(roots: List[str], prefix: str = "", flat: bool = False) -> List[Tuple[str, str]]:
+    """(chemin, source) de tous les PDF des arborescences, dans un ordre stable."""
+    files = []
+    for root in roots:
+        root = os.path.abspath(root)
+        if os.path.isfile(root):
+            files.append((root, prefix + os.path.basename(root)))
+            continue
+        for directory, subdirectories, names in os.walk(root):
+            subdirectories.sort()
+            for name in sorted(names):
+                if not name.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(directory, name)
+                relative = name if flat else os.path.relpath(path, root).replace(os.sep, "/")
+                files.append((path, prefix + relative))
+    return files
+
+def file_signature(path: str) -> dict:
+    info = os.stat(path)
+    return {"size": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+class Checkpoint:
+    """Journal JSONL en ajout seul : la derniere ligne d'une source fait foi."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Derniere ligne tronquee par un arret brutal
+                    self.entries[entry["source"]] = entry
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done(self, source: str, signature: dict, scope: Optional[dict] = None) -> bool:
+        entry = self.entries.get(source)
+        return (
+            entry is not None
+            and entry["status"] != "failed"
+            and entry["size"] == signature["size"]
+            and entry["mtime_ns"] == signature["mtime_ns"]
+            and entry.get("scope", document_scope()) == (scope or document_scope())
+        )
+
+    def record(self, entry: dict):
+        self.entries[entry["source"]] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+class Progress:
+    """Ligne de progression (reecrite sur un terminal, journalisee periodiquement sinon)."""
+
+    def __init__(self, total_files: int, total_bytes: int, stream=sys.stderr, log_interval: float = 10):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self.log_interval = log_interval
+        self.started = time.monotonic()
+        self.files = self.failed = self.bytes = 0
+        self.pages: Dict[str, int] = {}
+        self._last_log = 0.0
+
+    def update(self, force: bool = False):
+        now = time.monotonic()
+        if not self.interactive and not force and now - self._last_log < self.log_interval:
+            return
+        self._last_log = now
+        elapsed = now - self.started
+        share = self.bytes / self.total_bytes if self.total_bytes else 1.0
+        eta = elapsed * (1 - share) / share if share else None
+        pages = sum(self.pages.values())
+        width = 30
+        bar = "#" * int(share * width) + "-" * (width - int(share * width))
+        line = (
+            f"[{bar}] {share * 100:5.1f}% {self.files}/{self.total_files} fichiers"
+            f" ({self.failed} echecs) {pages} pages {pages / elapsed if elapsed else 0:.1f} p/s"
+            f" restant {_duration(eta)}"
+        )
+        if self.interactive:
+            self.stream.write("\r" + line)
+            self.stream.flush()
+        else:
+            logger.info(line)
+
+    def finish(self):
+        self.update(force=True)
+        if self.interactive:
+            self.stream.write("\n")
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+def _status(stats: dict) -> str:
+    if stats.get("duplicate_of"):
+        return "duplicate"
+    if stats.get("skipped"):
+        return "rescoped" if stats.get("rescoped") else "unchanged"
+    return "indexed" if stats["chunks"] else "empty"
+
+async def _ingest_file(path: str, source: str, signature: dict, scope: dict, checkpoint: Checkpoint, progress: Progress):
+    """Indexe un fichier ; son resultat (ou son echec) est ajoute au point de reprise et retourne."""
+    async def on_progress(stats):
+        progress.pages[source] = stats["pages"]
+        progress.update()
+
+    entry = {"source": source, "path": path, **signature, "scope": scope}
+    start = time.perf_counter()
+    try:
+        stats = await ingestion_service.process_pdf_path(path, source, on_progress=on_progress, scope=scope)
+        entry.update(
+            status=_status(stats),
+            pages=stats["pages"],
+            chunks=stats["chunks"],
+            vectors=stats["vectors"],
+            deleted_vectors=stats["deleted_vectors"],
+        )
+        if stats.get("duplicate_of"):
+            entry["duplicate_of"] = stats["duplicate_of"]
+    except Exception as e:
+        entry.update(status="failed", error=str(e))
+        progress.failed += 1
+    entry["elapsed_s"] = round(time.perf_counter() - start, 3)
+    checkpoint.record(entry)
+    progress.files += 1
+    progress.bytes += signature["size"]
+    progress.update()
+    return entry
+
+def _report(files: int, skipped: int, results: List[dict], elapsed: float, checkpoint: Checkpoint) -> dict:
+    by_status: Dict[str, int] = {}
+    for entry in results:
+        by_status[entry["status"]] = by_status.get(entry["status"], 0) + 1
+    pages = sum(entry.get("pages", 0) for entry in results)
+    slowest = sorted(results, key=lambda entry: entry["elapsed_s"], reverse=True)[:10]
+    return {
+        "files": files,
+        "already_done": skipped,
+        "processed": len(results),
+        "by_status": by_status,
+        "pages": pages,
+        "chunks": sum(entry.get("chunks", 0) for entry in results),
+        "vectors": sum(entry.get("vectors", 0) for entry in results),
+        "elapsed_s": round(elapsed, 2),
+        "pages_per_s": round(pages / elapsed, 1) if elapsed else None,
+        "slowest": [
+            {"source": entry["source"], "elapsed_s": entry["elapsed_s"], "pages": entry.get("pages", 0)}
+            for entry in slowest
+        ],
+        "failed": [{"source": entry["source"], "error": entry["error"]} for entry in results if entry["status"] == "failed"],
+        "checkpoint": checkpoint.path,
+    }
+
+async def bulk_ingest(
+    files: List[Tuple[str, str]],
+    checkpoint: Checkpoint,
+    jobs: int = None,
+    progress_stream=sys.stderr,
+    scope: Optional[dict] = None,
+) -> dict:
+    """Indexe les fichiers (chemin, source) ; retourne le rapport (totaux, plus lents, echecs)."""
+    scope = scope or document_scope()
+    pending = [
+        (path, source, signature)
+        for path, source, signature in ((path, source, file_signature(path)) for path, source in files)
+        if not checkpoint.done(source, signature, scope)
+    ]
+
+    progress = Progress(len(pending), sum(signature["size"] for _, _, signature in pending), progress_stream)
+    queue = iter(pending)
+    results: List[dict] = []
+    started = time.perf_counter()
+
+    async def worker():
+        # Un iterateur partage : chaque worker prend le fichier suivant des qu'il est libre
+        for path, source, signature in queue:
+            results.append(await _ingest_file(path, source, signature, scope, checkpoint, progress))
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, jobs or settings.INGESTION_WORKER_CONCURRENCY))))
+    finally:
+        progress.finish()
+    return _report(len(files), len(files) - len(pending), results, time.perf_counter() - started, checkpoint)
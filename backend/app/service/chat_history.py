@@ -0,0 +1,95 @@
+"""
+Lecture paginee de l'historique des conversations.
+
+Pagination par curseur (keyset) sur (created_at, id), servie par l'index
+(user_id, created_at, id) : le cout d'une page ne depend pas de la
+profondeur de l'historique, contrairement a OFFSET.
+"""
+import base64
+import hashlib
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models.chat import ChatHistory
+
+PREVIEW_CHARS = 160
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(entry_created_at: datetime, entry_id: int) -> str:
+    raw = f"{entry_created_at.isoformat()}|{entry_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, entry_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except Exception:
+        raise InvalidCursor(f"Curseur invalide : {cursor}")
+
+async def history_etag(session: AsyncSession, user_id: int, *variant) -> str:
+    """
+    Version de l'historique (dernier echange et nombre d'echanges) : l'historique
+    n'est qu'ajoute, ce couple change des qu'un echange est ecrit ou supprime.
+    """
+    statement = select(func.max(ChatHistory.id), func.count()).where(ChatHistory.user_id == user_id)
+    last_id, count = (await session.execute(statement)).one()
+    key = "|".join(str(part) for part in (user_id, last_id, count, *variant))
+    return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+async def fetch_history_page(
+    session: AsyncSession,
+    user_id: int,
+    limit: int,
+    before: Optional[str] = None,
+    summary: bool = False,
+    conversation_id: Optional[int] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Les `limit` echanges precedant le curseur `before` (les plus recents sans
+    curseur), dans l'ordre chronologique, et le curseur de la page precedente ;
+    eventuellement limites a une conversation.
+    En mode resume, seul un apercu de la reponse est lu en base.
+    """
+    if summary:
+        columns = (
+            ChatHistory.id,
+            ChatHistory.question,
+            func.substr(ChatHistory.answer, 1, PREVIEW_CHARS).label("answer_preview"),
+            ChatHistory.created_at,
+        )
+    else:
+        columns = (
+            ChatHistory.id,
+            ChatHistory.user_id,
+            ChatHistory.conversation_id,
+            ChatHistory.question,
+            ChatHistory.answer,
+            ChatHistory.prompt_tokens,
+            ChatHistory.created_at,
+        )
+
+    statement = select(*columns).where(ChatHistory.user_id == user_id)
+    if conversation_id is not None:
+        statement = statement.where(ChatHistory.conversation_id == conversation_id)
+    if before:
+        created_at, entry_id = decode_cursor(before)
+        statement = statement.where(or_(
+            ChatHistory.created_at < created_at,
+            and_(ChatHistory.created_at == created_at, ChatHistory.id < entry_id),
+        ))
+    statement = statement.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc()).limit(limit + 1)
+
+    rows = [dict(row._mapping) for row in (await session.execute(statement)).all()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    rows.reverse()
+    return rows, next_cursor
@@ -0,0 +1,537 @@
+"""
+Copie locale des chunks indexes (texte, metadonnees, vecteurs float32).
+
+Les chunks et leurs vecteurs ne vivaient que dans Qdrant : changer la
+configuration de la collection ou reindexer obligeait a re-extraire et
+re-encoder tout le corpus. IngestionService ecrit desormais chaque point ici
+aussi, ce qui permet :
+- de reconstruire une collection a partir du disque, a la vitesse des upserts
+  en masse (rebuild_collection) ;
+- une recherche exacte (exhaustive) sans Qdrant, en secours ou pour les tests
+  (CHUNK_STORE_SEARCH).
+
+Format (CHUNK_STORE_DIR), en ajout seul :
+- vectors.f32 : vecteurs float32 bout a bout, lus par memory-mapping ;
+- chunks.jsonl : journal des operations ; "put" (ID, ligne du vecteur, texte,
+  metadonnees), "delete" (IDs), "delete_sources" (sources), "update_sources"
+  (metadonnees modifiees pour des sources : perimetre d'un document). Rejoue a
+  l'ouverture, puis lu au fil de l'eau (un autre processus peut ecrire) ;
+- store.lock : verrou (flock) partage entre processus (API, worker, CLI) :
+  exclusif pour les ecritures, partage pour les lectures.
+Le vecteur est ecrit avant la ligne du journal : une ligne lue designe
+toujours un vecteur complet. compact() recopie les seuls points vivants.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.vector_db import CONTENT_PAYLOAD_KEY, METADATA_PAYLOAD_KEY
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 384
+
+class StoredPoint:
+    """Point relu du store ; memes attributs que les points Qdrant utilises par la recherche."""
+    __slots__ = ("id", "payload", "score", "vector")
+
+    def __init__(self, id: str, payload: dict, score: Optional[float] = None, vector=None):
+        self.id = id
+        self.payload = payload
+        self.score = score
+        self.vector = vector
+
+class ChunkStore:
+    def __init__(self, directory: str, dim: int = EMBEDDING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.log_path = os.path.join(directory, "chunks.jsonl")
+        self.lock_path = os.path.join(directory, "store.lock")
+
+        self._lock = threading.RLock()
+        # ID -> (ligne du vecteur, position et taille de l'enregistrement dans le journal, source)
+        self._live: Dict[str, Tuple[int, int, int, Optional[str]]] = {}
+        self._sources: Dict[str, set] = {}
+        # Source -> [(position dans le journal, metadonnees)] : s'appliquent aux "put" anterieurs
+        self._updates: Dict[str, List[Tuple[int, dict]]] = {}
+        self._offset = 0
+        self._inode = None
+        self._log_fd = None
+        self._lock_file = None
+        self._matrix = None  # (IDs, vecteurs normalises) pour la recherche exacte
+
+    # --- Ecriture ---
+
+    def append(self, points: Iterable) -> int:
+        """Ajoute des points (id, vector, payload) ; un ID deja present est remplace."""
+        points = list(points)
+        if not points:
+            return 0
+        vectors = np.asarray([point.vector for point in points], dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimension {vectors.shape[1]} au lieu de {self.dim}")
+        with self._writing():
+            first_row = self._vector_bytes() // self.row_bytes
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(first_row * self.row_bytes)  # Ligne partielle d'une ecriture interrompue
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_log([
+                {
+                    "op": "put",
+                    "id": str(point.id),
+                    "row": first_row + i,
+                    "source": (point.payload.get(METADATA_PAYLOAD_KEY) or {}).get("source"),
+                    CONTENT_PAYLOAD_KEY: point.payload.get(CONTENT_PAYLOAD_KEY, ""),
+                    METADATA_PAYLOAD_KEY: point.payload.get(METADATA_PAYLOAD_KEY) or {},
+                }
+                for i, point in enumerate(points)
+            ])
+        return len(points)
+
+    def delete(self, ids: Iterable) -> None:
+        ids = [str(point_id) for point_id in ids]
+        if ids:
+            with self._writing():
+                self._write_log([{"op": "delete", "ids": ids}])
+
+    def delete_sources(self, sources: Iterable[str]) -> None:
+        sources = list(sources)
+        if sources:
+            with self._writing():
+                self._write_log([{"op": "delete_sources", "sources": sources}])
+
+    def update_sources(self, sources: Iterable[str], metadata: dict) -> None:
+        """Modifie des metadonnees de tous les points de ces sources, sans reecrire textes ni vecteurs."""
+        sources = list(sources)
+        if sources:
+            with self._writing():
+                self._write_log([{"op": "update_sources", "sources": sources, METADATA_PAYLOAD_KEY: metadata}])
+
+    def update_metadata(self, metadata_by_id: Dict[str, dict]) -> int:
+        """Remplace les metadonnees de points existants : texte et vecteur recopies, sans re-encodage."""
+        points = self.get(metadata_by_id, with_vectors=True)
+        for point in points:
+            point.payload[METADATA_PAYLOAD_KEY] = metadata_by_id[point.id]
+        return self.append(points)
+
+    def compact(self) -> dict:
+        """Recopie les points vivants dans de nouveaux fichiers (place des points supprimes ou remplaces)."""
+        with self._writing():
+            before = self._vector_bytes()
+            vectors_tmp, log_tmp = self.vectors_path + ".tmp", self.log_path + ".tmp"
+            matrix = self._vectors()
+            with open(vectors_tmp, "wb") as vectors_file, open(log_tmp, "wb") as log_file:
+                for row, (old_row, offset, length, source) in enumerate(sorted(self._live.values())):
+                    vectors_file.write(matrix[old_row].tobytes())
+                    record = self._record(offset, length)
+                    record["row"] = row
+                    record[METADATA_PAYLOAD_KEY] = self._point_payload(offset, length, source)[METADATA_PAYLOAD_KEY]
+                    log_file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                for f in (vectors_file, log_file):
+                    f.flush()
+                    os.fsync(f.fileno())
+            # Lecteurs bloques par le verrou exclusif ; ils relisent ensuite le nouveau journal (autre inode)
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(log_tmp, self.log_path)
+            self._reset()
+            self._refresh()
+            after = os.path.getsize(self.vectors_path)
+        logger.info(f"Store de chunks compacte : {len(self._live)} points, {before - after} octets liberes")
+        return {"points": len(self._live), "freed_bytes": before - after}
+
+    # --- Lecture ---
+
+    def __len__(self) -> int:
+        with self._reading():
+            return len(self._live)
+
+    def position(self) -> Tuple[int, int]:
+        """Marque du journal (inode, position), pour relire ensuite les operations posterieures."""
+        with self._reading():
+            return self._inode, self._offset
+
+    def ids(self) -> List[str]:
+        with self._reading():
+            return list(self._live)
+
+    def get(self, ids: Iterable, with_vectors: bool = False) -> List[StoredPoint]:
+        with self._reading():
+            matrix = self._vectors() if with_vectors else None
+            points = []
+            for point_id in ids:
+                entry = self._live.get(str(point_id))
+                if entry is None:
+                    continue
+                row, offset, length, source = entry
+                points.append(StoredPoint(
+                    str(point_id),
+                    self._point_payload(offset, length, source),
+                    vector=np.array(matrix[row]) if with_vectors else None,
+                ))
+            return points
+
+    def iter_points(self, batch_size: int = 1024) -> Iterator[List[StoredPoint]]:
+        """Points vivants avec leurs vecteurs, par lots, dans l'ordre du fichier (lecture sequentielle)."""
+        with self._reading():
+            entries = sorted(self._live.items(), key=lambda item: item[1][0])
+            inode = self._inode
+        for start in range(0, len(entries), batch_size):
+            with self._reading():
+                if self._inode != inode:
+                    raise RuntimeError("Store de chunks compacte pendant la lecture")
+                matrix = self._vectors()
+                batch = [
+                    StoredPoint(point_id, self._point_payload(offset, length, source), vector=np.array(matrix[row]))
+                    for point_id, (row, offset, length, source) in entries[start:start + batch_size]
+                ]
+            yield batch
+
+    def changes_since(self, position: Tuple[int, int]) -> List[Tuple[dict, Optional[np.ndarray]]]:
+        """Operations ecrites apres la marque `position`, avec le vecteur des "put" (rattrapage)."""
+        inode, offset = position
+        with self._reading():
+            if self._inode != inode:
+                raise RuntimeError("Store de chunks compacte depuis la marque : rattrapage impossible")
+            matrix = self._vectors()
+            changes = []
+            with open(self.log_path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line)
+                    changes.append((record, np.array(matrix[record["row"]]) if record["op"] == "put" else None))
+            return changes
+
+    def search(
+        self,
+        vector,
+        limit: int,
+        sources: Optional[List[str]] = None,
+        where: Optional[Callable[[dict], bool]] = None,
+    ) -> List[StoredPoint]:
+        """
+        Recherche exacte par similarite cosinus sur tous les points vivants.
+        where (optionnel) filtre sur les metadonnees : les points sont examines
+        par score decroissant jusqu'a en retenir `limit`.
+        """
+        with self._reading():
+            if self._matrix is None:
+                ids = list(self._live)
+                rows = np.fromiter((self._live[point_id][0] for point_id in ids), dtype=np.int64, count=len(ids))
+                matrix = np.array(self._vectors()[rows]) if len(ids) else np.zeros((0, self.dim), dtype=np.float32)
+                matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+                self._matrix = (ids, matrix)
+            ids, matrix = self._matrix
+            query = np.asarray(vector, dtype=np.float32)
+            scores = matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+            if sources is not None:
+                allowed = set().union(*(self._sources.get(source, set()) for source in sources))
+                mask = np.fromiter((point_id in allowed for point_id in ids), dtype=bool, count=len(ids))
+                scores = np.where(mask, scores, -np.inf)
+            limit = min(limit, len(ids))
+            if limit <= 0:
+                return []
+            if where is None:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+                top = top[np.argsort(-scores[top])]
+            else:
+                top = np.argsort(-scores)
+            points = []
+            for i in top:
+                if len(points) >= limit or not np.isfinite(scores[i]):
+                    break
+                payload = self._point_payload(*self._live[ids[i]][1:])
+                if where is None or where(payload[METADATA_PAYLOAD_KEY]):
+                    points.append(StoredPoint(ids[i], payload, score=float(scores[i])))
+            return points
+
+    def stats(self) -> dict:
+        with self._reading():
+            vectors_bytes = self._vector_bytes()
+            return {
+                "directory": self.directory,
+                "points": len(self._live),
+                "sources": len(self._sources),
+                "vector_rows": vectors_bytes // self.row_bytes,
+                "dead_rows": vectors_bytes // self.row_bytes - len(self._live),
+                "vectors_bytes": vectors_bytes,
+                "log_bytes": self._offset,
+            }
+
+    # --- Interne ---
+
+    @contextmanager
+    def _locked(self, mode: int):
+        """Threads du processus (RLock), puis autres processus (flock sur un descripteur unique)."""
+        with self._lock:
+            if self._lock_file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._lock_file = open(self.lock_path, "a")
+            fcntl.flock(self._lock_file, mode)
+            try:
+                self._refresh()  # Operations des autres processus
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _reading(self):
+        with self._locked(fcntl.LOCK_SH):
+            yield
+
+    @contextmanager
+    def _writing(self):
+        with self._locked(fcntl.LOCK_EX):
+            yield
+            self._refresh()
+
+    def _write_log(self, records: List[dict]):
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        with open(self.log_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _reset(self):
+        if self._log_fd is not None:
+            os.close(self._log_fd)
+        self._live, self._sources, self._updates = {}, {}, {}
+        self._offset, self._inode, self._log_fd, self._matrix = 0, None, None, None
+
+    def _refresh(self):
+        """Rejoue les operations ajoutees au journal depuis la derniere lecture."""
+        try:
+            info = os.stat(self.log_path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset()
+            return
+        if self._inode is not None and info.st_ino != self._inode:
+            self._reset()  # Journal remplace (compaction dans un autre processus)
+        self._inode = info.st_ino
+        if info.st_size <= self._offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Ligne en cours d'ecriture
+                self._apply(json.loads(line), self._offset, len(line))
+                self._offset += len(line)
+        self._matrix = None
+
+    def _apply(self, record: dict, offset: int, length: int):
+        op = record["op"]
+        if op == "put":
+            self._discard(record["id"])
+            self._live[record["id"]] = (record["row"], offset, length, record.get("source"))
+            self._sources.setdefault(record.get("source"), set()).add(record["id"])
+        elif op == "delete":
+            for point_id in record["ids"]:
+                self._discard(point_id)
+        elif op == "delete_sources":
+            for source in record["sources"]:
+                for point_id in self._sources.pop(source, set()):
+                    self._live.pop(point_id, None)
+                self._updates.pop(source, None)
+        elif op == "update_sources":
+            for source in record["sources"]:
+                self._updates.setdefault(source, []).append((offset, record[METADATA_PAYLOAD_KEY]))
+
+    def _discard(self, point_id: str):
+        entry = self._live.pop(point_id, None)
+        if entry is not None:
+            source = entry[3]
+            ids = self._sources.get(source)
+            if ids is not None:
+                ids.discard(point_id)
+                if not ids:
+                    del self._sources[source]
+
+    def _record(self, offset: int, length: int) -> dict:
+        if self._log_fd is None:
+            self._log_fd = os.open(self.log_path, os.O_RDONLY)
+        return json.loads(os.pread(self._log_fd, length, offset))
+
+    @staticmethod
+    def _payload(record: dict) -> dict:
+        return {
+            CONTENT_PAYLOAD_KEY: record.get(CONTENT_PAYLOAD_KEY, ""),
+            METADATA_PAYLOAD_KEY: record.get(METADATA_PAYLOAD_KEY) or {},
+        }
+
+    def _point_payload(self, offset: int, length: int, source: Optional[str]) -> dict:
+        """Payload d'un "put", avec les modifications de sa source ecrites apres lui."""
+        payload = self._payload(self._record(offset, length))
+        for update_offset, metadata in self._updates.get(source, ()):
+            if update_offset > offset:
+                payload[METADATA_PAYLOAD_KEY] = {**payload[METADATA_PAYLOAD_KEY], **metadata}
+        return payload
+
+    def _vector_bytes(self) -> int:
+        return os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+
+    def _vectors(self) -> np.ndarray:
+        rows = self._vector_bytes() // self.row_bytes
+        if rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+# --- Reconstruction d'une collection ---
+
+def rebuild_collection(
+    client,
+    store: ChunkStore,
+    alias: Optional[str] = None,
+    batch_size: int = 512,
+    parallel: int = 1,
+    keep_old: bool = True,
+    index_timeout: float = 600,
+    force: bool = False,
+) -> dict:
+    """
+    Nouvelle collection (configuration courante) remplie depuis le store, sans
+    extraction ni embeddings : indexation HNSW differee pendant l'envoi en masse,
+    puis retablie ; bascule de l'alias une fois l'index construit, et rattrapage
+    des operations ecrites dans le store pendant la reconstruction.
+
+    Le store n'est qu'une copie (une ecriture peut y echouer, un processus peut
+    avoir le sien) : sauf force, la reconstruction est refusee, avant l'envoi
+    puis avant la bascule, si le store a moins de points que la collection en
+    service. L'ancienne collection est conservee sauf keep_old=False.
+    """
+    from qdrant_client.http import models
+
+    from app.core.qdrant_collections import create_physical_collection, new_collection_name, resolve_alias
+
+    alias = alias or settings.QDRANT_COLLECTION
+    old = resolve_alias(client, alias)
+    if old is None and client.collection_exists(alias):
+        raise ValueError(f"{alias} est une collection sans alias : lancer d'abord la migration")
+    if not force:
+        check_store_complete(client, store, alias)
+    new = new_collection_name(alias, client)
+    create_physical_collection(client, new)
+    indexing_threshold = client.get_collection(new).config.optimizer_config.indexing_threshold
+    client.update_collection(new, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0))
+
+    started = time.perf_counter()
+    position = store.position()
+    uploaded = 0
+    for batch in store.iter_points(batch_size):
+        client.upload_points(
+            collection_name=new,
+            points=[models.PointStruct(id=p.id, vector=p.vector.tolist(), payload=p.payload) for p in batch],
+            batch_size=batch_size,
+            parallel=parallel,
+            wait=True,
+        )
+        uploaded += len(batch)
+    upload_s = time.perf_counter() - started
+
+    client.update_collection(new, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=indexing_threshold))
+    deadline = time.monotonic() + index_timeout
+    while client.get_collection(new).status != models.CollectionStatus.GREEN and time.monotonic() < deadline:
+        time.sleep(1)
+
+    if not force:
+        try:
+            check_store_complete(client, store, alias)
+        except ValueError:
+            client.delete_collection(new)
+            raise
+
+    operations = []
+    if old:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=new, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+
+    caught_up = replay_changes(client, store, new, position)
+    if old and not keep_old:
+        client.delete_collection(old)
+
+    result = {
+        "alias": alias,
+        "from": old,
+        "to": new,
+        "points": uploaded,
+        "caught_up": caught_up,
+        "upload_s": round(upload_s, 2),
+        "points_per_s": round(uploaded / upload_s, 1) if upload_s else None,
+        "elapsed_s": round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"Collection reconstruite depuis le store : {result}")
+    return result
+
+def check_store_complete(client, store: ChunkStore, alias: str):
+    """ValueError si la collection en service contient plus de points que le store."""
+    live = client.get_collection(alias).points_count if client.collection_exists(alias) else 0
+    stored = len(store)
+    if stored < (live or 0):
+        raise ValueError(
+            f"Store de chunks incomplet ({stored} points, {live} dans {alias}) : la reconstruction "
+            "supprimerait des documents ; lancer 'store backfill' (ou forcer)"
+        )
+
+def replay_changes(client, store: ChunkStore, collection: str, position: Tuple[int, int]) -> int:
+    """Applique a la collection les operations du store posterieures a `position`."""
+    from qdrant_client.http import models
+
+    applied = 0
+    for record, vector in store.changes_since(position):
+        if record["op"] == "put":
+            client.upsert(collection_name=collection, wait=True, points=[models.PointStruct(
+                id=record["id"], vector=vector.tolist(), payload=ChunkStore._payload(record)
+            )])
+        elif record["op"] == "delete":
+            client.delete(collection_name=collection, points_selector=models.PointIdsList(points=record["ids"]), wait=True)
+        elif record["op"] == "delete_sources":
+            selection = models.Filter(must=[
+                models.FieldCondition(key=f"{METADATA_PAYLOAD_KEY}.source", match=models.MatchAny(any=record["sources"]))
+            ])
+            client.delete(collection_name=collection, points_selector=models.FilterSelector(filter=selection), wait=True)
+        elif record["op"] == "update_sources":
+            client.set_payload(
+                collection_name=collection,
+                payload=record[METADATA_PAYLOAD_KEY],
+                key=METADATA_PAYLOAD_KEY,
+                points=models.Filter(must=[
+                    models.FieldCondition(key=f"{METADATA_PAYLOAD_KEY}.source", match=models.MatchAny(any=record["sources"]))
+                ]),
+                wait=True,
+            )
+        applied += 1
+    return applied
+
+def backfill_from_collection(client, store: ChunkStore, alias: Optional[str] = None, batch_size: int = 512) -> int:
+    """Alimente le store avec les points deja indexes (corpus anterieur au store)."""
+    known = set(store.ids())
+    added, offset = 0, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=alias or settings.QDRANT_COLLECTION,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        added += store.append(point for point in points if str(point.id) not in known)
+        if offset is None:
+            return added
+
+# Singleton
+chunk_store = ChunkStore(settings.CHUNK_STORE_DIR)
@@ -0,0 +1,277 @@
+"""
+Decoupage des documents en chunks avant indexation.
+
+Deux strategies interchangeables, toutes deux incrementales (le texte arrive
+page par page) :
+- "character" : fenetre fixe de caracteres avec recouvrement (ancien split_text) ;
+- "recursive" : paragraphes -> lignes -> phrases -> mots, taille mesuree en
+  tokens pour tenir dans la fenetre de 256 tokens de MiniLM.
+Chaque chunk garde en metadonnees sa page et le titre de section courant.
+"""
+import bisect
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;])\s+")
+HEADING_KEYWORDS = re.compile(r"^(chapitre|section|article|titre|partie|annexe)\s+\w+", re.IGNORECASE)
+
+
+@dataclass
+class Chunk:
+    text: str
+    metadata: dict = field(default_factory=dict)
+
+
+# --- Comptage des tokens ---
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def load_tokenizer():
+    """
+    Charge le tokenizer une seule fois (prechauffage de l'API, premier appel
+    ailleurs) ; False s'il est indisponible. Bloquant : hors de l'event loop.
+    """
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_MODEL)
+            except Exception as e:
+                logger.warning(f"Tokenizer {TOKENIZER_MODEL} indisponible, estimation des tokens : {e}")
+                _tokenizer = False
+    return _tokenizer
+
+def count_tokens(text: str) -> int:
+    """
+    Nombre de tokens WordPiece de MiniLM. Si le tokenizer n'est pas disponible,
+    estimation a partir du nombre de mots et de signes de ponctuation.
+    """
+    if _tokenizer is None:
+        load_tokenizer()
+    if _tokenizer:
+        return len(_tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+    return estimate_tokens(text)
+
+def estimate_tokens(text: str) -> int:
+    words = re.findall(r"\w+|[^\w\s]", text)
+    return int(len(words) * 1.3 + 0.5)
+
+
+# --- Ancien decoupage par caracteres ---
+
+def split_text(text, chunk_size=1000, overlap=200):
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end]
+        chunks.append(chunk)
+        start = end - overlap
+        if start >= len(text):
+            break
+    return chunks
+
+class CharacterChunker:
+    """
+    Equivalent incremental de split_text : les chunks sont emis des qu'ils
+    sont complets. Seul le reliquat (moins de chunk_size caracteres) reste en memoire.
+    """
+
+    def __init__(self, chunk_size=1000, overlap=200):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self._buffer = ""
+        self._fresh = False  # Le buffer contient-il du texte pas encore emis ?
+        self._offset = 0  # Position du debut du buffer dans le document
+        self._page_offsets = []
+        self._pages = []
+
+    def feed(self, text, page=None) -> List[Chunk]:
+        if not text:
+            return []
+        if page is not None:
+            self._page_offsets.append(self._offset + len(self._buffer))
+            self._pages.append(page)
+        self._buffer += text
+        self._fresh = True
+        chunks = []
+        while len(self._buffer) >= self.chunk_size:
+            chunks.append(self._chunk(self._buffer[:self.chunk_size]))
+            step = self.chunk_size - self.overlap
+            self._buffer = self._buffer[step:]
+            self._offset += step
+            self._fresh = len(self._buffer) > self.overlap
+        return chunks
+
+    def flush(self) -> List[Chunk]:
+        chunks = [self._chunk(self._buffer)] if self._fresh and self._buffer.strip() else []
+        self._buffer = ""
+        self._fresh = False
+        return chunks
+
+    def _chunk(self, text) -> Chunk:
+        metadata = {}
+        index = bisect.bisect_right(self._page_offsets, self._offset) - 1
+        if index >= 0:
+            metadata["page"] = self._pages[index]
+        return Chunk(text=text, metadata=metadata)
+
+
+# --- Decoupage recursif par structure, en tokens ---
+
+def is_heading(line: str) -> bool:
+    """Heuristique : ligne courte sans ponctuation finale, ou "Article 12", "Chapitre II"..."""
+    line = line.strip()
+    if not line or len(line) > 80:
+        return False
+    if HEADING_KEYWORDS.match(line):
+        return True
+    return (
+        len(line) <= 60
+        and len(line.split()) <= 8
+        and line[0].isalpha()
+        and line[0].isupper()
+        and not line.endswith((".", ",", ";", ":", "!", "?"))
+    )
+
+def iter_blocks(text: str):
+    """Decoupe une page en (bloc, est_un_titre) : titres isoles et paragraphes."""
+    paragraph = []
+    for line in text.splitlines():
+        if not line.strip():
+            if paragraph:
+                yield "\n".join(paragraph), False
+                paragraph = []
+        elif is_heading(line):
+            if paragraph:
+                yield "\n".join(paragraph), False
+                paragraph = []
+            yield line.strip(), True
+        else:
+            paragraph.append(line.strip())
+    if paragraph:
+        yield "\n".join(paragraph), False
+
+class RecursiveTokenChunker:
+    """
+    Decoupe paragraphes, puis lignes, puis phrases, puis mots jusqu'a ce que
+    chaque morceau tienne dans max_tokens, puis regroupe les morceaux voisins.
+    Un nouveau titre ferme le chunk courant (s'il a atteint min_tokens) ;
+    le recouvrement reprend les derniers morceaux dans la limite de overlap_tokens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 200,
+        overlap_tokens: int = 20,
+        min_tokens: int = 50,
+        count: Optional[Callable[[str], int]] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.count = count or count_tokens
+
+        self._pieces = []  # (texte, tokens, page, separateur)
+        self._tokens = 0
+        self._fresh = False
+        self._heading = None
+        self._chunk_heading = None
+
+    def feed(self, text, page=None) -> List[Chunk]:
+        chunks = []
+        for block, heading in iter_blocks(text or ""):
+            if heading:
+                if self._fresh and self._tokens >= self.min_tokens:
+                    chunks.extend(self._emit(keep_overlap=False))
+                self._heading = block
+            pieces = self._split(block, 0)
+            for index, piece in enumerate(pieces):
+                tokens = self.count(piece)
+                if self._fresh and self._tokens + tokens > self.max_tokens:
+                    chunks.extend(self._emit(keep_overlap=True))
+                separator = "\n" if index == len(pieces) - 1 else " "
+                self._pieces.append((piece, tokens, page, separator))
+                self._tokens += tokens
+                if not self._fresh:
+                    self._fresh = True
+                    self._chunk_heading = self._heading
+        return chunks
+
+    def flush(self) -> List[Chunk]:
+        chunks = self._emit(keep_overlap=False) if self._fresh else []
+        self._pieces, self._tokens, self._fresh = [], 0, False
+        return chunks
+
+    def _split(self, text: str, level: int) -> List[str]:
+        text = text.strip()
+        if not text:
+            return []
+        if self.count(text) <= self.max_tokens:
+            return [text]
+        if level == 0:
+            parts = text.split("\n\n")
+        elif level == 1:
+            parts = text.split("\n")
+        elif level == 2:
+            parts = SENTENCE_BOUNDARY.split(text)
+        else:
+            return self._split_words(text)
+        pieces = []
+        for part in parts:
+            pieces.extend(self._split(part, level + 1))
+        return pieces
+
+    def _split_words(self, text: str) -> List[str]:
+        pieces, current = [], []
+        for word in text.split():
+            if current and self.count(" ".join(current + [word])) > self.max_tokens:
+                pieces.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    def _emit(self, keep_overlap: bool) -> List[Chunk]:
+        text = "".join(piece + separator for piece, _, _, separator in self._pieces).strip()
+        pages = [page for _, _, page, _ in self._pieces if page is not None]
+        metadata = {}
+        if pages:
+            metadata["page"] = pages[0]
+            if pages[-1] != pages[0]:
+                metadata["page_end"] = pages[-1]
+        if self._chunk_heading:
+            metadata["heading"] = self._chunk_heading
+
+        kept, kept_tokens = [], 0
+        if keep_overlap and self.overlap_tokens > 0:
+            for piece in reversed(self._pieces):
+                if kept_tokens + piece[1] > self.overlap_tokens:
+                    break
+                kept.insert(0, piece)
+                kept_tokens += piece[1]
+        self._pieces, self._tokens, self._fresh = kept, kept_tokens, False
+        return [Chunk(text=text, metadata=metadata)] if text else []
+
+
+CHUNKERS = {
+    "character": CharacterChunker,
+    "recursive": RecursiveTokenChunker,
+}
+
+def get_chunker(name: str, **params):
+    """Instancie une strategie de decoupage par son nom ("character" ou "recursive")."""
+    try:
+        return CHUNKERS[name](**params)
+    except KeyError:
+        raise ValueError(f"Strategie de decoupage inconnue : {name} (disponibles : {', '.join(CHUNKERS)})")
@@ -0,0 +1,171 @@
+"""
+Memoire des conversations : le prompt recoit un resume glissant des anciens
+echanges et les derniers echanges, dans un budget de tokens fixe, quelle que
+soit la longueur de la conversation.
+
+Les echanges sortis de la fenetre sont resumes en arriere-plan (un appel LLM
+de temps en temps, hors du chemin critique de la reponse).
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.models.base import utc_now
+from app.models.chat import ChatHistory, Conversation
+from app.service.chunking import count_tokens
+from app.service.history_writer import history_writer
+from app.service.rag_service import rag_service
+
+logger = logging.getLogger(__name__)
+
+# Nombre maximal d'echanges integres au resume en une passe
+SUMMARY_BATCH_TURNS = 20
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " [...]"
+
+def format_turn(question: str, answer: str) -> str:
+    return f"Étudiant : {question}\nAssistant : {answer}"
+
+@dataclass
+class ConversationContext:
+    conversation_id: int
+    summary: str = ""
+    turns: List[Tuple[str, str]] = field(default_factory=list)  # (question, reponse), du plus ancien au plus recent
+
+    def format(self) -> str:
+        parts = []
+        if self.summary:
+            parts.append(f"Résumé des échanges précédents : {self.summary}")
+        parts.extend(format_turn(question, answer) for question, answer in self.turns)
+        return "\n".join(parts)
+
+
+class ConversationMemory:
+    def __init__(self, window_turns: int = 4, history_token_budget: int = 600, summary_max_tokens: int = 250):
+        self.window_turns = window_turns
+        self.history_token_budget = history_token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self._summarizing = {}  # conversation_id -> tache de resume en cours
+
+    async def create(self, session: AsyncSession, user_id: int, title: Optional[str] = None) -> Conversation:
+        conversation = Conversation(user_id=user_id, title=title)
+        session.add(conversation)
+        await session.commit()
+        return conversation
+
+    async def get(self, session: AsyncSession, user_id: int, conversation_id: int) -> Optional[Conversation]:
+        conversation = await session.get(Conversation, conversation_id)
+        if conversation is None or conversation.user_id != user_id:
+            return None
+        return conversation
+
+    async def load(self, session: AsyncSession, conversation: Conversation) -> ConversationContext:
+        """Resume + derniers echanges dans le budget de tokens ; planifie le resume du debordement."""
+        # L'echange precedent peut encore etre dans la file d'ecriture differee
+        await history_writer.flush(conversation.id)
+        statement = (
+            select(ChatHistory.question, ChatHistory.answer)
+            .where(
+                ChatHistory.conversation_id == conversation.id,
+                ChatHistory.id > conversation.summarized_until_id,
+            )
+            .order_by(ChatHistory.id.desc())
+            .limit(self.window_turns + 1)
+        )
+        rows = (await session.execute(statement)).all()
+        if len(rows) > self.window_turns:
+            self.schedule_summary(conversation.id)
+
+        # Comptage des tokens hors de l'event loop
+        turns = await asyncio.to_thread(self._fit_turns, rows[:self.window_turns])
+        return ConversationContext(conversation.id, conversation.summary, turns)
+
+    def _fit_turns(self, rows) -> List[Tuple[str, str]]:
+        """Derniers echanges (du plus recent au plus ancien en entree) dans le budget de tokens."""
+        turns, used = [], 0
+        for question, answer in rows:
+            tokens = count_tokens(format_turn(question, answer))
+            if used + tokens > self.history_token_budget:
+                if not turns:
+                    # Le dernier echange est toujours present, quitte a etre tronque
+                    turns.append((question, truncate_to_tokens(answer, self.history_token_budget // 2)))
+                break
+            turns.append((question, answer))
+            used += tokens
+        turns.reverse()
+        return turns
+
+    # --- Resume glissant ---
+
+    def schedule_summary(self, conversation_id: int):
+        task = self._summarizing.get(conversation_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.get_running_loop().create_task(self.summarize(conversation_id))
+        self._summarizing[conversation_id] = task
+        task.add_done_callback(lambda _: self._summarizing.pop(conversation_id, None))
+
+    async def summarize(self, conversation_id: int):
+        """Integre au resume les echanges les plus anciens hors de la fenetre."""
+        try:
+            async with async_session_maker() as session:
+                conversation = await session.get(Conversation, conversation_id)
+                if conversation is None:
+                    return
+                statement = (
+                    select(ChatHistory.id, ChatHistory.question, ChatHistory.answer)
+                    .where(
+                        ChatHistory.conversation_id == conversation_id,
+                        ChatHistory.id > conversation.summarized_until_id,
+                    )
+                    .order_by(ChatHistory.id.desc())
+                )
+                rows = (await session.execute(statement)).all()[self.window_turns:]
+                if not rows:
+                    return
+                rows = list(reversed(rows))[:SUMMARY_BATCH_TURNS]
+                previous = conversation.summary
+                owner_id = conversation.user_id
+                last_id = rows[-1].id
+                await session.close()  # Pas de connexion reservee pendant l'appel LLM
+
+                turns = "\n".join(format_turn(row.question, row.answer) for row in rows)
+                summary = await rag_service.summarize(
+                    previous, turns, max_words=int(self.summary_max_tokens * 0.6), user_id=owner_id
+                )
+                summary = await asyncio.to_thread(truncate_to_tokens, summary, self.summary_max_tokens)
+
+                conversation = await session.get(Conversation, conversation_id)
+                if conversation is None or conversation.summarized_until_id >= last_id:
+                    return
+                conversation.summary = summary
+                conversation.summarized_until_id = last_id
+                conversation.updated_at = utc_now()
+                await session.commit()
+                logger.info(f"Conversation {conversation_id} : {len(rows)} echanges integres au resume")
+        except Exception as e:
+            logger.error(f"Echec du resume de la conversation {conversation_id} : {e}")
+
+# Singleton
+conversation_memory = ConversationMemory(
+    window_turns=settings.CONVERSATION_WINDOW_TURNS,
+    history_token_budget=settings.CONVERSATION_HISTORY_TOKEN_BUDGET,
+    summary_max_tokens=settings.CONVERSATION_SUMMARY_MAX_TOKENS,
+)
@@ -0,0 +1,87 @@
+import hashlib
+import uuid
+from typing import Dict, List, Optional
+
+from sqlmodel import delete, select
+
+from app.core.database import async_session_maker
+from app.models.base import utc_now
+from app.models.document import Document
+
+# Espace de noms fixe : un meme chunk d'un meme document garde toujours le meme ID Qdrant
+CHUNK_NAMESPACE = uuid.UUID("6f1c1f44-5b0a-4a53-9b43-2f4e7d0b9c21")
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_point_id(source: str, chunk_hash: str) -> str:
+    """ID de point deterministe, derive du hash du contenu du chunk."""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{source}:{chunk_hash}"))
+
+class DocumentRegistry:
+    async def get_by_source(self, source: str) -> Optional[Document]:
+        async with async_session_maker() as session:
+            result = await session.execute(select(Document).where(Document.source == source))
+            return result.scalars().first()
+
+    async def get_by_hash(self, file_hash: str) -> Optional[Document]:
+        async with async_session_maker() as session:
+            result = await session.execute(select(Document).where(Document.file_hash == file_hash))
+            return result.scalars().first()
+
+    async def save(
+        self,
+        source: str,
+        file_hash: str,
+        page_hashes: List[str],
+        chunk_hashes: List[str],
+        scope: Optional[Dict[str, str]] = None,
+        chunk_layouts: Optional[List[str]] = None,
+    ):
+        async with async_session_maker() as session:
+            result = await session.execute(select(Document).where(Document.source == source))
+            document = result.scalars().first() or Document(source=source, file_hash=file_hash)
+            document.file_hash = file_hash
+            document.page_hashes = page_hashes
+            document.chunk_hashes = chunk_hashes
+            document.chunk_layouts = chunk_layouts
+            document.page_count = len(page_hashes)
+            document.chunk_count = len(chunk_hashes)
+            document.scope = scope
+            document.updated_at = utc_now()
+            session.add(document)
+            await session.commit()
+
+    async def set_scope(self, source: str, scope: Dict[str, str]) -> bool:
+        """Nouveau perimetre ; updated_at change pour que les index BM25 des autres processus se rechargent."""
+        async with async_session_maker() as session:
+            result = await session.execute(select(Document).where(Document.source == source))
+            document = result.scalars().first()
+            if document is None:
+                return False
+            document.scope = scope
+            document.updated_at = utc_now()
+            session.add(document)
+            await session.commit()
+            return True
+
+    async def list_documents(self) -> List[Document]:
+        async with async_session_maker() as session:
+            result = await session.execute(select(Document).order_by(Document.source))
+            return list(result.scalars().all())
+
+    async def delete_sources(self, sources: List[str]) -> int:
+        """Oublie des documents : une nouvelle ingestion les reindexera entierement."""
+        async with async_session_maker() as session:
+            result = await session.execute(delete(Document).where(Document.source.in_(sources)))
+            await session.commit()
+            return result.rowcount
+
+document_registry = DocumentRegistry()
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.core.metrics import SIZE_BUCKETS, metrics
+from app.core.tracing import span
+from app.models.base import utc_now
+from app.models.chat import ChatHistory, Conversation
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = metrics.histogram("history_batch_size", "Echanges par ecriture de l'historique", buckets=SIZE_BUCKETS)
+
+class HistoryWriter:
+    """
+    Ecriture differee de l'historique des conversations : les echanges sont
+    mis en file et inseres par lots (tous les batch_size echanges ou toutes les
+    flush_interval_ms), hors du chemin critique de la reponse.
+    File pleine : submit() attend qu'une place se libere (contre-pression).
+    A l'arret, stop() vide la file avant de rendre la main.
+    flush(conversation_id) ecrit sans attendre les echanges en attente d'une
+    conversation (la memoire de conversation relit l'historique en base).
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval_ms: float = 200,
+        max_queue: int = 10000,
+        max_attempts: int = 5,
+        drain_timeout: float = 15,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_attempts = max_attempts
+        self.drain_timeout = drain_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_ready = asyncio.Event()
+        self._flushed = asyncio.Condition()
+        self._pending: Dict[int, int] = {}  # conversation_id -> echanges en file ou en cours d'ecriture
+        self._urgent = False
+        self._task = None
+
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.backpressure_waits = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Ecrit les echanges encore en file puis arrete le flusher."""
+        if self._task is None:
+            return
+        self._batch_ready.set()
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Historique : {self._queue.qsize()} echanges non ecrits a l'arret")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(
+        self,
+        user_id: int,
+        question: str,
+        answer: str,
+        conversation_id: Optional[int] = None,
+        prompt_tokens: Optional[int] = None,
+    ):
+        entry = ChatHistory(
+            user_id=user_id,
+            question=question,
+            answer=answer,
+            conversation_id=conversation_id,
+            prompt_tokens=prompt_tokens,
+        )
+        if not self.running:
+            # Pas de flusher (script, worker) : ecriture directe
+            with span("history.write"):
+                await self._write([entry])
+            return
+        if self._queue.full():
+            self.backpressure_waits += 1
+        if conversation_id is not None:
+            self._pending[conversation_id] = self._pending.get(conversation_id, 0) + 1
+        await self._queue.put(entry)
+        self.submitted += 1
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0 or self._urgent:
+                    break
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self._urgent = False
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                await self._release(batch)
+
+    async def flush(self, conversation_id: int, timeout: float = 2.0):
+        """Attend que les echanges en attente de la conversation soient ecrits (ou perdus)."""
+        if not self._pending.get(conversation_id) or not self.running:
+            return
+        self._urgent = True
+        self._batch_ready.set()
+        try:
+            async with self._flushed:
+                await asyncio.wait_for(self._flushed.wait_for(lambda: not self._pending.get(conversation_id)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Historique de la conversation {conversation_id} non ecrit apres {timeout}s")
+
+    async def _release(self, batch: List[ChatHistory]):
+        for entry in batch:
+            if entry.conversation_id is None:
+                continue
+            remaining = self._pending.get(entry.conversation_id, 0) - 1
+            if remaining > 0:
+                self._pending[entry.conversation_id] = remaining
+            else:
+                self._pending.pop(entry.conversation_id, None)
+        async with self._flushed:
+            self._flushed.notify_all()
+
+    async def _flush(self, batch: List[ChatHistory]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                started = time.perf_counter()
+                with span("history.flush"):
+                    await self._write(batch)
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+                self.batches += 1
+                BATCH_SIZE.observe(len(batch))
+                return
+            except Exception as e:
+                logger.warning(f"Ecriture de l'historique echouee (tentative {attempt}/{self.max_attempts}) : {e}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(min(2 ** attempt * 0.1, 5))
+        self.dropped += len(batch)
+        logger.error(f"Historique : {len(batch)} echanges perdus apres {self.max_attempts} tentatives")
+
+    async def _write(self, entries: List[ChatHistory]):
+        # Nouvelles instances a chaque tentative : une session en echec ne les reutilise pas
+        rows = [
+            ChatHistory(
+                user_id=e.user_id,
+                conversation_id=e.conversation_id,
+                question=e.question,
+                answer=e.answer,
+                prompt_tokens=e.prompt_tokens,
+                created_at=e.created_at,
+            )
+            for e in entries
+        ]
+        conversation_ids = {e.conversation_id for e in entries if e.conversation_id is not None}
+        async with async_session_maker() as session:
+            session.add_all(rows)
+            if conversation_ids:
+                await session.execute(
+                    update(Conversation)
+                    .where(Conversation.id.in_(conversation_ids))
+                    .values(updated_at=utc_now())
+                )
+            await session.commit()
+        self.written += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "submitted": self.submitted,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+        }
+
+# Singleton
+history_writer = HistoryWriter(
+    batch_size=settings.HISTORY_BATCH_SIZE,
+    flush_interval_ms=settings.HISTORY_FLUSH_INTERVAL_MS,
+    max_queue=settings.HISTORY_QUEUE_SIZE,
+)
+
+metrics.gauge("history_queue_depth", "Echanges en attente d'ecriture", lambda: history_writer._queue.qsize())
+metrics.gauge(
+    "history_entries_total", "Echanges soumis, ecrits et perdus",
+    lambda: {"submitted": history_writer.submitted, "written": history_writer.written, "dropped": history_writer.dropped},
+    ["state"], kind="counter",
+)
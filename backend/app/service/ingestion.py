@@ -1,48 +1,431 @@
-from pypdf import PdfReader
-from app.core.vector_db import vector_store
+import asyncio
+import json
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tracing import record, span
+from app.core.vector_db import (
+    COLLECTION_NAME, CONTENT_PAYLOAD_KEY, METADATA_PAYLOAD_KEY, get_client, get_embeddings
+)
+from app.service.answer_cache import answer_cache
+from app.service.bm25 import bm25_index
+from app.service.chunk_store import chunk_store
+from app.service.document_registry import document_registry, chunk_point_id, file_sha256, text_hash
+from app.service.chunking import get_chunker
+from app.service.retrieval_scope import SCOPE_FIELDS, document_scope
+from app.service.pdf_extraction import count_pages, extract_pages
 
 logger = logging.getLogger(__name__)
 
-def split_text(text, chunk_size=1000, overlap=200):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start = end - overlap
-        if start >= len(text):
-            break
-    return chunks
+INGESTED = metrics.counter("ingest_items_total", "Pages, chunks et vecteurs ingeres", ["unit"])
+DOCUMENTS = metrics.counter("ingest_documents_total", "Documents traites par resultat", ["status"])
+# Points par requete de mise a jour des payloads (chunks deplaces)
+PAYLOAD_BATCH = 256
+STORE_ERRORS = metrics.counter(
+    "chunk_store_errors_total", "Ecritures du store de chunks en echec (store en retard sur Qdrant)", ["operation"]
+)
 
 class IngestionService:
     def __init__(self):
-        self.chunk_size = 1000
-        self.overlap = 200
+        self.chunker = settings.CHUNKER
+        self.page_batch_size = settings.INGESTION_PAGE_BATCH
+        self.embed_batch_size = settings.INGESTION_EMBED_BATCH
+        self.upsert_concurrency = settings.INGESTION_UPSERT_CONCURRENCY
+
+        # Pools crees a la demande : extraction PDF (CPU) et embeddings (hors event loop)
+        self._process_pool = None
+        self._embed_pool = None
+
+    def _new_chunker(self):
+        if self.chunker == "character":
+            return get_chunker("character", chunk_size=1000, overlap=200)
+        return get_chunker(
+            self.chunker,
+            max_tokens=settings.CHUNK_MAX_TOKENS,
+            overlap_tokens=settings.CHUNK_OVERLAP_TOKENS,
+            min_tokens=settings.CHUNK_MIN_TOKENS,
+        )
+
+    def _get_process_pool(self):
+        if self._process_pool is None:
+            # "spawn" : les processus n'heritent ni du modele ni des threads du serveur
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=settings.INGESTION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._process_pool
+
+    def _get_embed_pool(self):
+        if self._embed_pool is None:
+            self._embed_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-embed")
+        return self._embed_pool
+
+    def shutdown(self):
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._embed_pool is not None:
+            self._embed_pool.shutdown(wait=False, cancel_futures=True)
+            self._embed_pool = None
 
     async def process_pdf(self, file):
+        """
+        Indexe un fichier uploade : il est d'abord recopie sur disque pour que
+        les processus d'extraction puissent le relire page par page.
+        """
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as spool:
+                await asyncio.to_thread(shutil.copyfileobj, file.file, spool)
+            return await self.process_pdf_path(path, file.filename)
+        finally:
+            os.remove(path)
+
+    async def process_pdf_path(self, path, filename, on_progress=None, scope=None):
+        """
+        Pipeline d'ingestion en flux :
+        pages extraites par lots dans le pool de processus -> decoupage au fil de l'eau
+        -> embeddings par lots de taille fixe -> upserts Qdrant concurrents et bornes.
+        La memoire est bornee par la taille des lots, pas par celle du document.
+
+        Reindexation incrementale : les chunks deja presents (meme texte) ne sont
+        pas re-encodes, y compris s'ils ont change de page ou de titre (seul leur
+        payload est mis a jour), et les vecteurs des chunks disparus sont supprimes.
+        on_progress (optionnel) est une coroutine appelee avec les compteurs
+        apres chaque lot ecrit dans Qdrant.
+
+        scope : faculte, public et annee universitaire (document_scope), copies
+        dans le payload de chaque chunk ; par defaut le document est commun a
+        tous. Un fichier inchange dont seul le perimetre change n'est pas
+        re-encode : le payload de ses points est modifie en place.
+        """
+        start_time = time.perf_counter()
+        stats = {
+            "total_pages": 0, "pages": 0, "chunks": 0, "vectors": 0,
+            "skipped_chunks": 0, "deleted_vectors": 0,
+        }
+
+        scope = scope or document_scope()
+
         try:
-            # Read PDF
-            reader = PdfReader(file.file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
+            file_hash = await asyncio.to_thread(file_sha256, path)
+            # Connexion a Qdrant (au premier usage) hors de l'event loop
+            await asyncio.to_thread(get_client)
+            existing = await document_registry.get_by_source(filename)
+            # Document anterieur au perimetre : ses points sans ces champs sont visibles de tous
+            previous_scope = (existing.scope or document_scope()) if existing else scope
+            if await self._skip_unchanged(filename, file_hash, scope, existing, previous_scope, stats):
+                return stats
 
-            if not text.strip():
-                logger.warning(f"No text extracted from {file.filename}")
-                return
+            if existing is None:
+                # Document jamais enregistre : purge d'eventuels points anterieurs au registre (IDs aleatoires)
+                await asyncio.to_thread(self._delete_source_points, filename)
+                bm25_index.remove_source(filename)
 
-            # Split text
-            chunks = split_text(text, self.chunk_size, self.overlap)
+            metadata = {"source": filename, "uploaded_at": datetime.now(timezone.utc).isoformat(), **scope}
+            plan = {
+                "previous": self._previous_chunks(existing),
+                "seen": set(),
+                "page_hashes": [],
+                "chunk_hashes": [],
+                "chunk_layouts": [],
+                "moved": [],  # (hash, metadonnees) des chunks inchanges dont la page ou le titre a change
+                "metadata": metadata,
+            }
+            await self._index_pages(path, metadata, stats, plan, on_progress)
 
-            # Add to vector store with metadata
-            metadatas = [{"source": file.filename} for _ in chunks]
-            vector_store.add_texts(chunks, metadatas=metadatas)
+            INGESTED.inc(stats["pages"], unit="pages")
+            INGESTED.inc(stats["chunks"], unit="chunks")
+            INGESTED.inc(stats["vectors"], unit="vectors")
+            if stats["chunks"] == 0:
+                logger.warning(f"No text extracted from {filename}")
+                DOCUMENTS.inc(status="empty")
+                if existing is not None:
+                    # Nouvelle version sans texte (scan, page blanche) : l'ancienne ne doit plus repondre
+                    await self._finalize(filename, file_hash, scope, previous_scope, stats, plan)
+                return stats
 
-            logger.info(f"Processed and indexed {len(chunks)} chunks from {file.filename}")
+            await self._finalize(filename, file_hash, scope, previous_scope, stats, plan)
+
+            stats["elapsed_s"] = round(time.perf_counter() - start_time, 2)
+            record("ingest.document", time.perf_counter() - start_time)
+            DOCUMENTS.inc(status="indexed")
+            logger.info(
+                f"Processed {stats['chunks']} chunks from {filename} ({stats['pages']} pages in {stats['elapsed_s']}s) : "
+                f"{stats['vectors']} indexed, {stats['skipped_chunks']} unchanged, {stats['deleted_vectors']} deleted"
+            )
+            return stats
         except Exception as e:
-            logger.error(f"Error processing PDF {file.filename}: {e}")
+            logger.error(f"Error processing PDF {filename}: {e}")
+            DOCUMENTS.inc(status="failed")
+            raise
+
+    async def _skip_unchanged(self, filename, file_hash, scope, existing, previous_scope, stats) -> bool:
+        """Fichier deja indexe (meme source ou meme contenu pour le meme perimetre) : rien a encoder."""
+        if existing and existing.file_hash == file_hash:
+            if previous_scope != scope:
+                await self.set_scope(filename, scope)
+                stats["rescoped"] = True
+            logger.info(f"{filename} inchange, indexation ignoree")
+            stats.update(skipped=True, skipped_chunks=existing.chunk_count)
+            DOCUMENTS.inc(status="unchanged")
+            return True
+        duplicate = await document_registry.get_by_hash(file_hash)
+        # Le meme fichier publie pour un autre perimetre est indexe une seconde fois
+        if duplicate and duplicate.source != filename and (duplicate.scope or document_scope()) == scope:
+            logger.info(f"{filename} est identique a {duplicate.source}, indexation ignoree")
+            stats.update(skipped=True, duplicate_of=duplicate.source, skipped_chunks=duplicate.chunk_count)
+            DOCUMENTS.inc(status="duplicate")
+            return True
+        return False
+
+    async def _index_pages(self, path, metadata, stats, plan, on_progress):
+        """
+        Extraction par lots, decoupage et envoi des lots de chunks a encoder.
+        En cas d'erreur, les lots encore en vol sont annules : rien n'est ecrit
+        dans Qdrant apres l'echec du document.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._get_process_pool()
+        with span("ingest.count_pages"):
+            page_count = await loop.run_in_executor(pool, count_pages, path)
+        stats["total_pages"] = page_count
+        if on_progress:
+            await on_progress(stats)
+
+        chunker = self._new_chunker()
+        semaphore = asyncio.Semaphore(self.upsert_concurrency)
+        tasks = []
+        batch = []
+
+        async def submit(chunks):
+            # Attend qu'un emplacement se libere : au plus upsert_concurrency lots en vol
+            await semaphore.acquire()
+            task = asyncio.create_task(self._embed_and_upsert(chunks, metadata, semaphore, stats, on_progress))
+            tasks.append(task)
+
+        # Plusieurs lots de pages extraits en parallele, consommes dans l'ordre
+        in_flight = deque()
+        next_page = 0
+        try:
+            while next_page < page_count or in_flight:
+                while next_page < page_count and len(in_flight) < settings.INGESTION_PROCESSES:
+                    in_flight.append(loop.run_in_executor(
+                        pool, extract_pages, path, next_page, next_page + self.page_batch_size
+                    ))
+                    next_page += self.page_batch_size
+                with span("ingest.extract_wait"):
+                    pages = await in_flight.popleft()
+                batch = await self._consume_pages(pages, chunker, batch, submit, stats, plan)
+
+            self._plan_chunks(chunker.flush(), batch, stats, plan)
+            if batch:
+                await submit(batch)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for pending in [*in_flight, *tasks]:
+                pending.cancel()
+            await asyncio.gather(*in_flight, *tasks, return_exceptions=True)
             raise
 
-ingestion_service = IngestionService()
\ No newline at end of file
+    async def _finalize(self, filename, file_hash, scope, previous_scope, stats, plan):
+        """Suppression des chunks disparus, perimetre des chunks inchanges, registre et cache."""
+        # Vecteurs des chunks qui n'existent plus dans la nouvelle version
+        stale = set(plan["previous"]) - plan["seen"]
+        if stale:
+            ids = [chunk_point_id(filename, h) for h in stale]
+            await asyncio.to_thread(self._delete_points, ids)
+            for point_id in ids:
+                bm25_index.remove(point_id)
+            stats["deleted_vectors"] = len(ids)
+
+        if plan["moved"]:
+            # Chunks inchanges mais deplaces (page, titre) : payload mis a jour, sans re-encodage
+            await asyncio.to_thread(self._set_chunk_metadata, filename, plan["metadata"], plan["moved"])
+            stats["moved_chunks"] = len(plan["moved"])
+
+        if previous_scope != scope and stats["skipped_chunks"]:
+            # Chunks inchanges, non reecrits : encore indexes avec l'ancien perimetre
+            await asyncio.to_thread(self._set_scope_payload, filename, scope)
+            bm25_index.set_scope(filename, scope)
+            stats["rescoped"] = True
+
+        await document_registry.save(
+            filename, file_hash, plan["page_hashes"], plan["chunk_hashes"], scope, plan["chunk_layouts"]
+        )
+
+        if stats["vectors"] or stats["deleted_vectors"] or stats.get("rescoped") or stats.get("moved_chunks"):
+            # Les reponses en cache peuvent etre obsoletes face aux nouveaux documents
+            answer_cache.invalidate()
+
+    async def _consume_pages(self, pages, chunker, batch, submit, stats, plan):
+        # Le decoupage (comptage des tokens) est fait hors de l'event loop
+        with span("ingest.chunk"):
+            chunks = await asyncio.to_thread(self._chunk_pages, pages, chunker)
+        for _, text in pages:
+            stats["pages"] += 1
+            plan["page_hashes"].append(text_hash(text))
+        self._plan_chunks(chunks, batch, stats, plan)
+        while len(batch) >= self.embed_batch_size:
+            await submit(batch[:self.embed_batch_size])
+            batch = batch[self.embed_batch_size:]
+        return batch
+
+    def _chunk_pages(self, pages, chunker):
+        chunks = []
+        for page_number, text in pages:
+            chunks.extend(chunker.feed(text, page_number))
+        return chunks
+
+    @staticmethod
+    def _previous_chunks(existing) -> dict:
+        """Hash du texte -> hash de la position des chunks de la version indexee."""
+        if existing is None:
+            return {}
+        # Registre anterieur aux positions : hash (texte + metadonnees) qui ne correspond plus a aucun chunk
+        layouts = existing.chunk_layouts or [None] * len(existing.chunk_hashes)
+        return dict(zip(existing.chunk_hashes, layouts))
+
+    def _plan_chunks(self, chunks, batch, stats, plan):
+        """
+        Ajoute au lot les chunks nouveaux ; les chunks deja indexes sont comptes
+        comme evites, et ceux dont seule la position (page, titre) a change notes a deplacer.
+        """
+        for chunk in chunks:
+            # Le hash (et l'ID du point) ne depend que du texte : inserer une page ne change pas les suivants
+            chunk_hash = text_hash(chunk.text)
+            if chunk_hash in plan["seen"]:
+                continue  # Doublon a l'interieur du document
+            layout = text_hash(json.dumps(chunk.metadata, sort_keys=True))
+            plan["seen"].add(chunk_hash)
+            plan["chunk_hashes"].append(chunk_hash)
+            plan["chunk_layouts"].append(layout)
+            stats["chunks"] += 1
+            if chunk_hash not in plan["previous"]:
+                batch.append((chunk_hash, chunk))
+                continue
+            stats["skipped_chunks"] += 1
+            if plan["previous"][chunk_hash] != layout:
+                plan["moved"].append((chunk_hash, chunk.metadata))
+
+    def _delete_points(self, ids):
+        from qdrant_client.http.models import PointIdsList
+
+        get_client().delete(collection_name=COLLECTION_NAME, points_selector=PointIdsList(points=ids), wait=True)
+        self._store(chunk_store.delete, ids)
+
+    def _set_chunk_metadata(self, source, metadata, moved):
+        """Metadonnees completes des points deplaces (Qdrant, store de chunks), vecteurs inchanges."""
+        from qdrant_client.http.models import SetPayload, SetPayloadOperation
+
+        payloads = {
+            chunk_point_id(source, chunk_hash): {**metadata, **chunk_metadata} for chunk_hash, chunk_metadata in moved
+        }
+        # Cle de premier niveau : l'objet des metadonnees est remplace (un titre disparu ne reste pas)
+        operations = [
+            SetPayloadOperation(set_payload=SetPayload(payload={METADATA_PAYLOAD_KEY: point_metadata}, points=[point_id]))
+            for point_id, point_metadata in payloads.items()
+        ]
+        for start in range(0, len(operations), PAYLOAD_BATCH):
+            get_client().batch_update_points(
+                collection_name=COLLECTION_NAME, update_operations=operations[start:start + PAYLOAD_BATCH], wait=True
+            )
+        self._store(chunk_store.update_metadata, payloads)
+
+    async def set_scope(self, source, scope) -> bool:
+        """
+        Change le perimetre d'un document deja indexe : payload des points
+        modifie en place (Qdrant, store de chunks), sans re-extraction ni embeddings.
+        """
+        if not await document_registry.set_scope(source, scope):
+            return False
+        await asyncio.to_thread(self._set_scope_payload, source, scope)
+        bm25_index.set_scope(source, scope)
+        answer_cache.invalidate()
+        logger.info(f"Perimetre de {source} : {scope}")
+        return True
+
+    def _set_scope_payload(self, source, scope):
+        from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+
+        get_client().set_payload(
+            collection_name=COLLECTION_NAME,
+            payload=scope,
+            key=METADATA_PAYLOAD_KEY,
+            points=Filter(must=[FieldCondition(key=f"{METADATA_PAYLOAD_KEY}.source", match=MatchValue(value=source))]),
+            wait=True,
+        )
+        self._store(chunk_store.update_sources, [source], scope)
+
+    def _delete_source_points(self, source):
+        from qdrant_client.http.models import FieldCondition, Filter, FilterSelector, MatchValue
+
+        get_client().delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=FilterSelector(filter=Filter(must=[
+                FieldCondition(key=f"{METADATA_PAYLOAD_KEY}.source", match=MatchValue(value=source))
+            ])),
+            wait=True,
+        )
+        self._store(chunk_store.delete_sources, [source])
+
+    def _store(self, operation, *args):
+        """
+        Copie locale des points (chunk_store) : un echec est journalise et compte
+        sans faire echouer l'ingestion ; rebuild refuse ensuite un store incomplet.
+        """
+        if not settings.CHUNK_STORE_ENABLED:
+            return
+        try:
+            operation(*args)
+        except Exception as e:
+            STORE_ERRORS.inc(operation=operation.__name__)
+            logger.error(f"Store de chunks non mis a jour ({operation.__name__}) : {e}")
+
+    def _embed(self, texts):
+        return get_embeddings().embed_documents(texts)
+
+    async def _embed_and_upsert(self, chunks, metadata, semaphore, stats, on_progress=None):
+        from qdrant_client.http.models import PointStruct
+
+        try:
+            loop = asyncio.get_running_loop()
+            texts = [chunk.text for _, chunk in chunks]
+            with span("ingest.embed"):
+                vectors = await loop.run_in_executor(self._get_embed_pool(), self._embed, texts)
+
+            # Meme format de payload que QdrantVectorStore.add_texts, avec un ID derive du contenu
+            points = [
+                PointStruct(
+                    id=chunk_point_id(metadata["source"], chunk_hash),
+                    vector=vector,
+                    payload={CONTENT_PAYLOAD_KEY: chunk.text, METADATA_PAYLOAD_KEY: {**metadata, **chunk.metadata}},
+                )
+                for (chunk_hash, chunk), vector in zip(chunks, vectors)
+            ]
+            with span("ingest.upsert"):
+                await asyncio.to_thread(
+                    get_client().upsert, collection_name=COLLECTION_NAME, points=points, wait=True
+                )
+            with span("ingest.store"):
+                await asyncio.to_thread(self._store, chunk_store.append, points)
+            scope = {field: metadata[field] for field in SCOPE_FIELDS}
+            for point in points:
+                bm25_index.add(point.id, point.payload[CONTENT_PAYLOAD_KEY], metadata["source"], scope)
+            stats["vectors"] += len(points)
+            if on_progress:
+                await on_progress(stats)
+        finally:
+            semaphore.release()
+
+ingestion_service = IngestionService()
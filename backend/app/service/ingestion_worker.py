@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+from sqlalchemy import update
+from sqlmodel import select
+
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.models.base import utc_now
+from app.models.document import IngestionJob
+from app.service.ingestion import ingestion_service
+from app.service.retrieval_scope import document_scope
+
+logger = logging.getLogger(__name__)
+
+JOB_COUNTERS = ("total_pages", "pages", "chunks", "vectors", "skipped_chunks", "deleted_vectors")
+
+def remove_spool(path: str):
+    """Fichier uploade d'un job termine ou abandonne."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class IngestionWorker:
+    """
+    Consomme les jobs d'ingestion stockes en base.
+    Plusieurs workers (processus ou machines) peuvent tourner en parallele :
+    un job est reserve par un UPDATE conditionnel sur son statut. Un job en
+    cours signale sa vie par un heartbeat periodique ; chaque worker remet
+    regulierement en file les jobs dont le heartbeat s'est arrete.
+    """
+
+    def __init__(self, concurrency: int = 2, poll_interval: float = 2):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._running = set()
+        self._loop_task = None
+        self._last_recovery = 0.0
+
+    def notify(self):
+        """Reveille la boucle (nouveau job cree dans le meme processus)."""
+        self._wakeup.set()
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        # Les jobs interrompus repartent en file pour le prochain worker
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def run(self):
+        logger.info(f"Worker d'ingestion demarre (concurrence {self.concurrency})")
+        while True:
+            await self._recover_periodically()
+            await self._slots.acquire()
+            try:
+                job_id = await self.claim_next_job()
+            except Exception as e:
+                logger.error(f"Impossible de reserver un job d'ingestion : {e}")
+                job_id = None
+            if job_id is None:
+                self._slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            task = asyncio.create_task(self._run_job(job_id))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _recover_periodically(self):
+        """recover_stale_jobs au demarrage puis toutes les INGESTION_JOB_STALE_SECONDS / 2."""
+        now = time.monotonic()
+        if self._last_recovery and now - self._last_recovery < settings.INGESTION_JOB_STALE_SECONDS / 2:
+            return
+        self._last_recovery = now
+        try:
+            await self.recover_stale_jobs()
+        except Exception as e:
+            logger.error(f"Impossible de remettre en file les jobs orphelins : {e}")
+
+    async def recover_stale_jobs(self):
+        """Remet en file les jobs 'running' abandonnes par un worker arrete brutalement."""
+        threshold = utc_now() - timedelta(seconds=settings.INGESTION_JOB_STALE_SECONDS)
+        async with async_session_maker() as session:
+            result = await session.execute(
+                update(IngestionJob)
+                .where(IngestionJob.status == "running", IngestionJob.updated_at < threshold)
+                .values(status="pending", available_at=utc_now())
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.warning(f"{result.rowcount} job(s) d'ingestion orphelin(s) remis en file")
+
+    async def claim_next_job(self):
+        now = utc_now()
+        async with async_session_maker() as session:
+            statement = (
+                select(IngestionJob.id)
+                .where(IngestionJob.status == "pending", IngestionJob.available_at <= now)
+                .order_by(IngestionJob.created_at)
+                .limit(1)
+            )
+            job_id = (await session.execute(statement)).scalar()
+            if job_id is None:
+                return None
+
+            result = await session.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.status == "pending")
+                .values(
+                    status="running",
+                    attempts=IngestionJob.attempts + 1,
+                    started_at=now,
+                    updated_at=now,
+                    error=None,
+                )
+            )
+            await session.commit()
+            # Un autre worker a pu reserver le job entre temps
+            return job_id if result.rowcount == 1 else None
+
+    async def _run_job(self, job_id: int):
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        spool_path = None
+        try:
+            async with async_session_maker() as session:
+                job = await session.get(IngestionJob, job_id)
+                filename, spool_path = job.filename, job.spool_path
+                scope = document_scope(job.faculty, job.audience, job.academic_year)
+
+            logger.info(f"Job d'ingestion {job_id} : traitement de {filename}")
+            stats = await ingestion_service.process_pdf_path(
+                spool_path, filename, on_progress=self._progress_reporter(job_id), scope=scope
+            )
+            await self._update(job_id, status="done", finished_at=utc_now(), **self._counters(stats))
+            remove_spool(spool_path)
+        except asyncio.CancelledError:
+            await self._update(job_id, status="pending", available_at=utc_now())
+            raise
+        except Exception as e:
+            if await self._fail(job_id, e) and spool_path:
+                remove_spool(spool_path)
+        finally:
+            heartbeat.cancel()
+            self._slots.release()
+
+    async def _heartbeat(self, job_id: int):
+        """updated_at rafraichi a intervalle fixe, meme pendant une longue extraction sans progression."""
+        while True:
+            await asyncio.sleep(settings.INGESTION_HEARTBEAT_SECONDS)
+            try:
+                await self._update(job_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat du job d'ingestion {job_id} impossible : {e}")
+
+    async def _fail(self, job_id: int, error: Exception) -> bool:
+        """Nouvel essai differe, ou abandon definitif (retourne True)."""
+        async with async_session_maker() as session:
+            job = await session.get(IngestionJob, job_id)
+            job.error = str(error)[:2000]
+            job.updated_at = utc_now()
+            if job.attempts < job.max_attempts:
+                # Nouvel essai avec un delai croissant
+                delay = settings.INGESTION_JOB_RETRY_DELAY_SECONDS * job.attempts
+                job.status = "pending"
+                job.available_at = utc_now() + timedelta(seconds=delay)
+                logger.warning(f"Job d'ingestion {job_id} en echec ({error}), nouvel essai dans {delay}s")
+            else:
+                job.status = "failed"
+                job.finished_at = utc_now()
+                logger.error(f"Job d'ingestion {job_id} abandonne apres {job.attempts} essais : {error}")
+            session.add(job)
+            await session.commit()
+            return job.status == "failed"
+
+    def _progress_reporter(self, job_id: int):
+        # Ecritures limitees a une par seconde pour ne pas charger la base
+        last_write = 0.0
+
+        async def report(stats):
+            nonlocal last_write
+            now = time.monotonic()
+            if now - last_write < 1:
+                return
+            last_write = now
+            await self._update(job_id, **self._counters(stats))
+
+        return report
+
+    def _counters(self, stats: dict) -> dict:
+        return {key: stats[key] for key in JOB_COUNTERS if key in stats}
+
+    async def _update(self, job_id: int, **values):
+        values.setdefault("updated_at", utc_now())
+        async with async_session_maker() as session:
+            await session.execute(update(IngestionJob).where(IngestionJob.id == job_id).values(**values))
+            await session.commit()
+
+# Singleton
+ingestion_worker = IngestionWorker(
+    concurrency=settings.INGESTION_WORKER_CONCURRENCY,
+    poll_interval=settings.INGESTION_POLL_INTERVAL_SECONDS,
+)
@@ -0,0 +1,316 @@
+"""
+Fournisseurs de LLM et bascule automatique.
+
+- "groq" : ChatGroq (reseau et cle d'API requis) ;
+- "local" : remplacant deterministe, sans reseau, qui simule la latence et le
+  streaming token par token (tests de charge hors ligne, secours).
+
+Les fournisseurs sont essayes dans l'ordre de LLM_PROVIDERS. Chaque fournisseur
+a son delai maximal (premier token, puis entre deux tokens) ; ses derniers appels
+(erreurs, delais depasses, latence) decident de sa mise a l'ecart temporaire.
+La bascule n'a lieu qu'avant le premier token : une reponse deja commencee
+n'est pas melangee avec celle d'un autre fournisseur.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class ProviderUnavailable(Exception):
+    """Aucun fournisseur n'a pu repondre."""
+
+def parse_timeouts(spec: str) -> Dict[str, float]:
+    """"groq:20,local:5" -> {"groq": 20.0, "local": 5.0}"""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition(":")
+        timeouts[name.strip()] = float(value)
+    return timeouts
+
+class CircuitBreaker:
+    """
+    Mise a l'ecart d'un fournisseur d'apres ses derniers appels :
+    ferme (disponible) -> ouvert (a l'ecart pendant cooldown) -> essai (un seul appel).
+    """
+
+    def __init__(self, name: str, window: int = 20, cooldown: float = 30):
+        self.name = name
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)  # True = succes
+        self._open_until = 0.0
+        self._probing = False
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    @property
+    def state(self) -> str:
+        if time.monotonic() < self._open_until:
+            return "open"
+        return "probing" if self._probing else "closed"
+
+    def allow(self) -> bool:
+        """Ferme : disponible. Ouvert : a l'ecart jusqu'a la fin du delai, puis un seul appel d'essai."""
+        if time.monotonic() >= self._open_until:
+            return not self._probing
+        return False
+
+    def begin(self):
+        """Debut d'un appel ; apres une mise a l'ecart, le premier appel sert d'essai."""
+        if self._open_until and time.monotonic() >= self._open_until:
+            self._open_until = 0.0
+            self._probing = True
+
+    def record(self, ok: bool):
+        self._outcomes.append(ok)
+        if self._probing:
+            self._probing = False
+            if not ok:
+                self._open(self.cooldown)
+            return
+        if not ok and len(self._outcomes) >= 5 and self.error_rate >= settings.LLM_PROVIDER_MAX_ERROR_RATE:
+            self._open(self.cooldown)
+
+    def abandon(self):
+        """Essai interrompu sans resultat (client parti) : un prochain appel refera l'essai."""
+        if self._probing:
+            self._probing = False
+            self._open_until = time.monotonic()
+
+    def _open(self, duration: float):
+        if time.monotonic() >= self._open_until:
+            logger.warning(f"Fournisseur LLM {self.name} mis a l'ecart {duration:.0f}s (taux d'erreur {self.error_rate:.0%})")
+        self._open_until = time.monotonic() + duration
+        self._outcomes.clear()
+
+class LLMProvider:
+    name = "base"
+
+    def __init__(self, timeout: float, window: int = 20, cooldown: float = 30):
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(self.name, window=window, cooldown=cooldown)
+        self._latencies = deque(maxlen=100)  # Delai du premier token (s)
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def setup(self):
+        """Initialisation couteuse (imports, client) ; appelee une fois au prechauffage."""
+
+    async def astream(self, messages) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield
+
+    # --- Sante ---
+
+    def available(self) -> bool:
+        return self.breaker.allow()
+
+    def record(self, ok: bool, first_token_s: Optional[float] = None):
+        if first_token_s is not None:
+            self._latencies.append(first_token_s)
+        self.breaker.record(ok)
+
+    def begin(self):
+        self.calls += 1
+        self.breaker.begin()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+        return {
+            "state": self.breaker.state,
+            "timeout_s": self.timeout,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "recent_error_rate": round(self.breaker.error_rate, 3),
+            "first_token_p50_ms": percentile(0.5),
+            "first_token_p95_ms": percentile(0.95),
+        }
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.llm = None
+        self._lock = threading.Lock()
+
+    def setup(self):
+        with self._lock:
+            if self.llm is not None:
+                return
+            from langchain_groq import ChatGroq
+
+            self.llm = ChatGroq(
+                temperature=0,
+                model_name=settings.GROQ_MODEL,
+                groq_api_key=settings.GROQ_API_KEY,
+                request_timeout=self.timeout,
+            )
+
+    async def astream(self, messages) -> AsyncIterator[str]:
+        if self.llm is None:
+            await asyncio.to_thread(self.setup)
+        async for chunk in self.llm.astream(messages):
+            yield getattr(chunk, "content", chunk)
+
+class LocalProvider(LLMProvider):
+    """
+    Remplacant deterministe : meme prompt, meme reponse (mots tires du prompt),
+    apres LOCAL_LLM_LATENCY_MS puis un token toutes les LOCAL_LLM_TOKEN_MS.
+    """
+    name = "local"
+
+    def __init__(self, *args, latency_ms: float = 300, token_ms: float = 15, answer_tokens: int = 60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.answer_tokens = answer_tokens
+
+    def answer(self, prompt: str) -> List[str]:
+        words = prompt.split() or ["..."]
+        rng = random.Random(hashlib.sha1(prompt.encode()).digest())
+        return [rng.choice(words) + " " for _ in range(self.answer_tokens)]
+
+    async def astream(self, messages) -> AsyncIterator[str]:
+        prompt = messages if isinstance(messages, str) else messages.to_string()
+        await asyncio.sleep(self.latency)
+        for index, token in enumerate(self.answer(prompt)):
+            if index and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
+
+PROVIDERS = {"groq": GroqProvider, "local": LocalProvider}
+
+class LLMRouter:
+    """Chaine de fournisseurs, essayes dans l'ordre, les fournisseurs defaillants en dernier."""
+
+    def __init__(self, providers: List[LLMProvider]):
+        if not providers:
+            raise ValueError("LLM_PROVIDERS est vide")
+        self.providers = providers
+        self.failovers = 0
+
+    def setup(self):
+        for provider in self.providers:
+            try:
+                provider.setup()
+            except Exception as e:
+                logger.error(f"Fournisseur LLM {provider.name} inutilisable : {e}")
+                provider.record(False)
+
+    def _candidates(self) -> List[LLMProvider]:
+        # Les fournisseurs a l'ecart restent un dernier recours si tous le sont
+        available = [p for p in self.providers if p.available()]
+        return available + [p for p in self.providers if p not in available]
+
+    async def astream(self, messages) -> AsyncIterator[str]:
+        """Tokens de la reponse du premier fournisseur qui repond a temps."""
+        errors = []
+        for attempt, provider in enumerate(self._candidates()):
+            if attempt:
+                self.failovers += 1
+            state = {"emitted": False}
+            try:
+                # Ferme l'appel des que le client s'en va (fin de l'essai, flux du fournisseur)
+                async with aclosing(self._stream(provider, messages, state)) as tokens:
+                    async for token in tokens:
+                        yield token
+                return
+            except Exception as e:
+                if state["emitted"]:
+                    # Reponse deja commencee : pas de bascule
+                    raise
+                logger.warning(f"Fournisseur LLM {provider.name} en echec ({e}), bascule")
+                errors.append(f"{provider.name}: {e}")
+        raise ProviderUnavailable("; ".join(errors))
+
+    async def _stream(self, provider: LLMProvider, messages, state: dict) -> AsyncIterator[str]:
+        """Un appel a un fournisseur, borne par son delai ; le resultat alimente son disjoncteur."""
+        provider.begin()
+        started = time.perf_counter()
+        stream = provider.astream(messages).__aiter__()
+        try:
+            while True:
+                try:
+                    token = await asyncio.wait_for(stream.__anext__(), provider.timeout)
+                except StopAsyncIteration:
+                    break
+                if not state["emitted"]:
+                    state["emitted"] = True
+                    provider.record(True, time.perf_counter() - started)
+                yield token
+            if not state["emitted"]:
+                provider.record(True, time.perf_counter() - started)
+        except Exception as e:
+            provider.errors += 1
+            provider.record(False)
+            if isinstance(e, asyncio.TimeoutError):
+                provider.timeouts += 1
+                raise TimeoutError(f"pas de token en {provider.timeout}s") from e
+            raise
+        finally:
+            provider.breaker.abandon()
+            await stream.aclose()
+
+    async def ainvoke(self, messages) -> str:
+        return "".join([token async for token in self.astream(messages)])
+
+    def stats(self) -> dict:
+        return {
+            "chain": [provider.name for provider in self.providers],
+            "failovers": self.failovers,
+            "providers": {provider.name: provider.stats() for provider in self.providers},
+        }
+
+def build_router() -> LLMRouter:
+    timeouts = parse_timeouts(settings.LLM_PROVIDER_TIMEOUTS)
+    providers = []
+    for name in filter(None, (part.strip() for part in settings.LLM_PROVIDERS.split(","))):
+        if name not in PROVIDERS:
+            raise ValueError(f"Fournisseur LLM inconnu : {name} ({', '.join(PROVIDERS)})")
+        options = {"timeout": timeouts.get(name, 30), "cooldown": settings.LLM_PROVIDER_COOLDOWN_SECONDS}
+        if name == "local":
+            options.update(
+                latency_ms=settings.LOCAL_LLM_LATENCY_MS,
+                token_ms=settings.LOCAL_LLM_TOKEN_MS,
+                answer_tokens=settings.LOCAL_LLM_ANSWER_TOKENS,
+            )
+        providers.append(PROVIDERS[name](**options))
+    return LLMRouter(providers)
+
+# Singleton
+llm_router = build_router()
+
+metrics.gauge(
+    "llm_provider_calls_total", "Appels par fournisseur LLM",
+    lambda: {provider.name: provider.calls for provider in llm_router.providers}, ["provider"], kind="counter",
+)
+metrics.gauge(
+    "llm_provider_errors_total", "Echecs par fournisseur LLM (delais depasses compris)",
+    lambda: {provider.name: provider.errors for provider in llm_router.providers}, ["provider"], kind="counter",
+)
+metrics.gauge(
+    "llm_provider_available", "1 si le fournisseur LLM n'est pas mis a l'ecart",
+    lambda: {provider.name: int(provider.available()) for provider in llm_router.providers}, ["provider"],
+)
+metrics.gauge("llm_failovers_total", "Bascules vers un fournisseur de secours", lambda: llm_router.failovers, kind="counter")
@@ -0,0 +1,402 @@
+"""
+Ordonnancement des appels au LLM (Groq) :
+- concurrence bornee globalement et par utilisateur ;
+- file d'attente equitable (tourniquet entre utilisateurs) : un etudiant qui
+  enchaine les questions ne passe pas devant les autres ;
+- seaux a jetons (requetes et tokens par minute) calques sur les quotas du
+  fournisseur, preleves une fois la place accordee, donc dans l'ordre du
+  tourniquet : quand le quota est le goulot, il reste partage equitablement,
+  et un appel refuse par la file ne consomme pas de quota. Les seaux servent
+  leurs attentes dans l'ordre d'arrivee et sont propres au processus : le
+  quota est divise par LLM_PROCESS_COUNT (workers uvicorn + worker d'ingestion) ;
+- voie de fond (reformulation, resumes) : places et part du quota reservees,
+  servie seulement quand aucune reponse eligible n'attend ;
+- coalescence (single-flight) : les generations identiques en cours sont partagees.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.tracing import record
+
+logger = logging.getLogger(__name__)
+
+class LLMOverloaded(Exception):
+    """File d'attente pleine ou attente trop longue : le client doit reessayer plus tard."""
+
+class TokenBucket:
+    """
+    Seau a jetons : `per_minute` jetons par minute, rafale maximale d'une minute. 0 = illimite.
+    Les prelevements sont servis dans l'ordre d'arrivee (asyncio.Lock est equitable).
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+        self._turn = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    async def _wait_turn(self, timeout: Optional[float]):
+        if timeout is None or not self._turn.locked():
+            await self._turn.acquire()
+            return
+        if timeout <= 0:
+            raise LLMOverloaded("Quota du fournisseur LLM atteint")
+        try:
+            await asyncio.wait_for(self._turn.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise LLMOverloaded("Quota du fournisseur LLM atteint")
+
+    async def take(self, amount: float, timeout: Optional[float] = None) -> float:
+        """
+        Preleve `amount` jetons, en attendant si besoin ; retourne le temps attendu.
+        LLMOverloaded si l'attente depasserait `timeout` (aucun jeton preleve).
+        """
+        if self.per_minute <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        await self._wait_turn(timeout)
+        try:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return time.monotonic() - started
+                delay = (amount - self.tokens) * 60 / self.per_minute
+                if timeout is not None and time.monotonic() - started + delay > timeout:
+                    raise LLMOverloaded("Quota du fournisseur LLM atteint")
+                await asyncio.sleep(delay)
+        finally:
+            self._turn.release()
+
+    def refund(self, amount: float):
+        """Rend des jetons preleves pour un appel qui n'aura pas lieu."""
+        if self.per_minute <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+class Flight:
+    """Generation partagee : les tokens produits sont rejoues a chaque abonne."""
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        per_user_concurrency: int = 1,
+        max_queue: int = 200,
+        queue_timeout: float = 30,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        completion_tokens: int = 300,
+        background_concurrency: int = 2,
+        background_share: float = 0.2,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.completion_tokens = completion_tokens
+        self.background_concurrency = background_concurrency
+        # Quota partage entre les reponses et la voie de fond : la somme reste celle du fournisseur
+        # (part nulle : la voie de fond puise dans les seaux des reponses)
+        answer_share = 1 - background_share if background_share > 0 else 1
+        self.request_bucket = TokenBucket(requests_per_minute * answer_share)
+        self.token_bucket = TokenBucket(tokens_per_minute * answer_share)
+        self.background_request_bucket = (
+            TokenBucket(requests_per_minute * background_share) if background_share > 0 else self.request_bucket
+        )
+        self.background_token_bucket = (
+            TokenBucket(tokens_per_minute * background_share) if background_share > 0 else self.token_bucket
+        )
+
+        self._active = 0
+        self._active_by_user: Dict[Optional[int], int] = defaultdict(int)
+        self._background_active = 0
+        # Attentes par utilisateur, dans l'ordre du tourniquet
+        self._waiters: "OrderedDict[Optional[int], Deque[asyncio.Future]]" = OrderedDict()
+        self._background: Deque[asyncio.Future] = deque()  # Voie de fond, premier arrive premier servi
+        self._flights: Dict[str, Flight] = {}
+
+        self.completed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.waits = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+        self.rate_limited_s = 0.0
+
+    # --- Concurrence et file equitable ---
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values()) + len(self._background)
+
+    def _eligible(self, user_id) -> bool:
+        return self._active < self.max_concurrency and self._active_by_user[user_id] < self.per_user_concurrency
+
+    def _eligible_background(self) -> bool:
+        """Place libre dans la voie de fond, et aucune reponse en attente ne pourrait la prendre."""
+        return (
+            self._active < self.max_concurrency
+            and self._background_active < self.background_concurrency
+            and not any(self._eligible(user_id) for user_id in self._waiters)
+        )
+
+    def _grant(self, user_id, background: bool = False):
+        self._active += 1
+        if background:
+            self._background_active += 1
+        else:
+            self._active_by_user[user_id] += 1
+
+    async def acquire(self, user_id: Optional[int], background: bool = False):
+        if self._eligible_background() if background else self._eligible(user_id):
+            self._grant(user_id, background)
+            record("llm.queue_wait", 0.0)
+            return
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise LLMOverloaded("File d'attente du LLM pleine")
+
+        future = asyncio.get_running_loop().create_future()
+        if background:
+            self._background.append(future)
+        else:
+            self._waiters.setdefault(user_id, deque()).append(future)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release(user_id, background)  # Place accordee entre-temps : on la rend
+            else:
+                future.cancel()
+                self._discard_waiter(user_id, future, background)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise LLMOverloaded("Attente du LLM trop longue")
+            raise
+        waited = time.perf_counter() - started
+        record("llm.queue_wait", waited)
+        self.waits += 1
+        self.wait_total_s += waited
+        self.wait_max_s = max(self.wait_max_s, waited)
+
+    def release(self, user_id: Optional[int], background: bool = False):
+        self._active -= 1
+        if background:
+            self._background_active -= 1
+        else:
+            self._active_by_user[user_id] -= 1
+            if not self._active_by_user[user_id]:
+                del self._active_by_user[user_id]
+        self._dispatch()
+
+    def _discard_waiter(self, user_id, future, background: bool = False):
+        if background:
+            if future in self._background:
+                self._background.remove(future)
+            return
+        waiters = self._waiters.get(user_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[user_id]
+
+    def _dispatch(self):
+        """Attribue les places libres en tournant entre les utilisateurs en attente."""
+        progress = True
+        while progress and self._active < self.max_concurrency and self._waiters:
+            progress = False
+            for user_id in list(self._waiters):
+                if self._active >= self.max_concurrency:
+                    return
+                if not self._eligible(user_id):
+                    continue
+                waiters = self._waiters.pop(user_id)
+                future = waiters.popleft()
+                if waiters:
+                    self._waiters[user_id] = waiters  # Fin du tourniquet
+                if future.cancelled():
+                    progress = True
+                    continue
+                self._grant(user_id)
+                future.set_result(None)
+                progress = True
+        self._dispatch_background()
+
+    def _dispatch_background(self):
+        """Places restantes a la voie de fond, une fois les reponses servies."""
+        while self._background and self._eligible_background():
+            future = self._background.popleft()
+            if future.cancelled():
+                continue
+            self._grant(None, background=True)
+            future.set_result(None)
+
+    async def _throttle(self, prompt_tokens: int, background: bool, timeout: float):
+        """Quotas du fournisseur, preleves place accordee ; rien n'est preleve si l'un des deux manque."""
+        requests, tokens = (
+            (self.background_request_bucket, self.background_token_bucket) if background
+            else (self.request_bucket, self.token_bucket)
+        )
+        try:
+            throttled = await requests.take(1, timeout)
+            try:
+                throttled += await tokens.take(prompt_tokens + self.completion_tokens, max(timeout - throttled, 0))
+            except BaseException:
+                requests.refund(1)
+                raise
+        except LLMOverloaded:
+            self.rejected += 1
+            raise
+        if throttled:
+            self.rate_limited_s += throttled
+            record("llm.rate_limit", throttled)
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int], prompt_tokens: int = 0, background: bool = False):
+        """
+        Place d'execution pour un appel LLM, quotas du fournisseur compris ;
+        file et quotas partagent le meme delai queue_timeout.
+        background : reformulation, resumes (voie de fond, moins prioritaire).
+        """
+        started = time.perf_counter()
+        await self.acquire(user_id, background)
+        try:
+            await self._throttle(prompt_tokens, background, self.queue_timeout - (time.perf_counter() - started))
+        except BaseException:
+            self.release(user_id, background)
+            raise
+        try:
+            yield
+        finally:
+            self.completed += 1
+            self.release(user_id, background)
+
+    # --- Coalescence des generations identiques ---
+
+    async def stream(
+        self,
+        key: Optional[str],
+        user_id: Optional[int],
+        prompt_tokens: int,
+        factory: Callable[[], AsyncIterator[str]],
+    ) -> AsyncIterator[str]:
+        """
+        Tokens d'une generation. Avec une cle, une generation identique deja en
+        cours est partagee au lieu d'etre relancee (sans cle : toujours une nouvelle).
+        """
+        flight = self._flights.get(key) if key else None
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            flight = Flight()
+            flight.task = asyncio.get_running_loop().create_task(
+                self._produce(key, flight, user_id, prompt_tokens, factory)
+            )
+            if key:
+                self._flights[key] = flight
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.tokens):
+                    yield flight.tokens[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: index < len(flight.tokens) or flight.done)
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                # Plus personne n'attend cette generation (clients deconnectes)
+                flight.task.cancel()
+
+    async def _produce(self, key, flight: Flight, user_id, prompt_tokens, factory):
+        try:
+            async with self.slot(user_id, prompt_tokens):
+                async for token in factory():
+                    if not token:
+                        continue
+                    flight.tokens.append(token)
+                    async with flight.changed:
+                        flight.changed.notify_all()
+        except BaseException as e:
+            flight.error = e if not isinstance(e, asyncio.CancelledError) else LLMOverloaded("Generation annulee")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            flight.done = True
+            if key and self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "waiting_users": len(self._waiters),
+            "background_active": self._background_active,
+            "background_queue_depth": len(self._background),
+            "in_flight_generations": len(self._flights),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "wait_avg_ms": round(self.wait_total_s / self.waits * 1000, 1) if self.waits else 0.0,
+            "wait_max_ms": round(self.wait_max_s * 1000, 1),
+            "rate_limited_s": round(self.rate_limited_s, 2),
+        }
+
+# Singleton
+llm_scheduler = LLMScheduler(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    per_user_concurrency=settings.LLM_PER_USER_CONCURRENCY,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+    completion_tokens=settings.LLM_COMPLETION_TOKENS_ESTIMATE,
+    background_concurrency=settings.LLM_BACKGROUND_CONCURRENCY,
+    background_share=settings.LLM_BACKGROUND_QUOTA_SHARE,
+    # Quotas du fournisseur partages entre tous les processus qui appellent le LLM
+    requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE / max(settings.LLM_PROCESS_COUNT, 1),
+    tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE / max(settings.LLM_PROCESS_COUNT, 1),
+)
+
+metrics.gauge("llm_queue_depth", "Appels LLM en attente d'une place", lambda: llm_scheduler.queue_depth)
+metrics.gauge("llm_active_calls", "Appels LLM en cours", lambda: llm_scheduler._active)
+metrics.gauge(
+    "llm_scheduler_events_total", "Appels LLM termines, refuses (surcharge) et coalesces",
+    lambda: {
+        "completed": llm_scheduler.completed,
+        "rejected": llm_scheduler.rejected,
+        "coalesced": llm_scheduler.coalesced,
+    },
+    ["event"], kind="counter",
+)
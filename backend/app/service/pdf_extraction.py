@@ -0,0 +1,23 @@
+"""
+Extraction de texte executee dans les processus du pool d'ingestion.
+Ce module ne doit importer que pypdf : il est recharge dans chaque processus.
+pypdf n'est importe qu'a l'appel, pour ne pas ralentir le demarrage de l'API.
+"""
+from typing import List, Tuple
+
+
+def count_pages(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extrait le texte des pages [start, end) ; retourne des couples (numero de page, texte)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = []
+    for index in range(start, min(end, len(reader.pages))):
+        pages.append((index + 1, reader.pages[index].extract_text() or ""))
+    return pages
@@ -0,0 +1,114 @@
+"""
+Diffusion de messages entre processus de l'API (plusieurs workers uvicorn).
+
+- "memory" : un seul processus (developpement, tests) ;
+- "postgres" : LISTEN/NOTIFY sur la base existante (asyncpg), sans service
+  supplementaire. Charge utile limitee a ~8 Ko par message.
+
+Chaque abonne recoit aussi ses propres publications : la livraison locale
+passe par le meme chemin que celle des autres workers.
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, List
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+class PubSubBackend:
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.published = 0
+        self.received = 0
+        self._handlers: List[Handler] = []
+
+    def subscribe(self, handler: Handler):
+        self._handlers.append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, message: dict):
+        raise NotImplementedError
+
+    async def _dispatch(self, message: dict):
+        self.received += 1
+        for handler in self._handlers:
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error(f"Erreur de traitement d'un message pub/sub : {e}")
+
+class InMemoryPubSub(PubSubBackend):
+    async def publish(self, message: dict):
+        self.published += 1
+        await self._dispatch(message)
+
+class PostgresPubSub(PubSubBackend):
+    def __init__(self, channel: str, dsn: str):
+        super().__init__(channel)
+        self.dsn = dsn
+        self._listener = None  # Connexion dediee a LISTEN
+        self._publisher = None
+        self._lock = asyncio.Lock()
+        self._stopping = False
+
+    async def start(self):
+        import asyncpg
+
+        self._stopping = False
+        self._listener = await asyncpg.connect(self.dsn)
+        self._listener.add_termination_listener(self._on_terminated)
+        await self._listener.add_listener(self.channel, self._on_notify)
+        logger.info(f"Pub/sub PostgreSQL a l'ecoute du canal {self.channel}")
+
+    def _on_terminated(self, connection):
+        if not self._stopping:
+            logger.warning("Connexion LISTEN perdue, reconnexion")
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._stopping:
+            try:
+                await self.start()
+                return
+            except Exception as e:
+                logger.error(f"Reconnexion du pub/sub impossible ({e}), nouvel essai dans {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def stop(self):
+        self._stopping = True
+        for connection in (self._listener, self._publisher):
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        self._listener = self._publisher = None
+
+    async def publish(self, message: dict):
+        import asyncpg
+
+        async with self._lock:
+            if self._publisher is None or self._publisher.is_closed():
+                self._publisher = await asyncpg.connect(self.dsn)
+            await self._publisher.execute("SELECT pg_notify($1, $2)", self.channel, json.dumps(message))
+        self.published += 1
+
+    def _on_notify(self, connection, pid, channel, payload):
+        asyncio.get_running_loop().create_task(self._dispatch(json.loads(payload)))
+
+def build_pubsub(channel: str) -> PubSubBackend:
+    if settings.WS_PUBSUB_BACKEND == "memory":
+        return InMemoryPubSub(channel)
+    if settings.WS_PUBSUB_BACKEND == "postgres":
+        # DSN asyncpg : sans le suffixe de driver SQLAlchemy
+        dsn = settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        return PostgresPubSub(channel, dsn)
+    raise ValueError(f"WS_PUBSUB_BACKEND inconnu : {settings.WS_PUBSUB_BACKEND} (memory, postgres)")
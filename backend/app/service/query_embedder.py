@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbedder:
+    """
+    Calcule les embeddings des questions hors de la boucle asyncio.
+    - Micro-batching : les questions qui arrivent dans la meme fenetre
+      (max_wait_ms) sont regroupees en un seul appel embed_documents.
+    - Pool de threads borne : le modele ne bloque jamais l'event loop.
+    - LRU : les questions repetees ne sont pas re-encodees.
+    `embeddings` est une fonction sans argument qui retourne le modele :
+    il n'est charge qu'au premier calcul, dans un thread du pool.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5,
+        max_workers: int = 2,
+        cache_size: int = 2048,
+    ):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query-embed")
+
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle = None
+        self._batches = set()  # Lots en cours : l'event loop ne garde qu'une reference faible aux taches
+
+        self.cache_hits = 0
+        self.batches = 0
+        self.embedded_texts = 0
+
+    async def embed(self, text: str) -> List[float]:
+        key = text.strip()
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return vector
+
+        # Une question identique deja en attente partage le meme calcul
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {
+            "cache_size": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "batches": self.batches,
+            "embedded_texts": self.embedded_texts,
+            "avg_batch_size": round(self.embedded_texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Interne ---
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings().embed_documents(texts)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: Dict[str, asyncio.Future]):
+        texts = list(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self._executor, self._embed, texts)
+        except Exception as e:
+            logger.error(f"Erreur lors du calcul des embeddings ({len(texts)} questions) : {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.embedded_texts += len(texts)
+        for text, vector in zip(texts, vectors):
+            self._remember(text, vector)
+            future = batch[text]
+            if not future.done():
+                future.set_result(vector)
+
+    def _remember(self, key: str, vector: List[float]):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+def build_query_embedder(embeddings) -> QueryEmbedder:
+    return QueryEmbedder(
+        embeddings,
+        max_batch_size=settings.EMBEDDING_BATCH_SIZE,
+        max_wait_ms=settings.EMBEDDING_BATCH_WAIT_MS,
+        max_workers=settings.EMBEDDING_THREADS,
+        cache_size=settings.EMBEDDING_CACHE_SIZE,
+    )
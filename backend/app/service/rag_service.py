@@ -1,37 +1,79 @@
+import asyncio
 import logging
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_qdrant import QdrantVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
-from app.core.vector_db import vector_store
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Optional
+from app.core.vector_db import get_embeddings
 from app.core.config import settings
+from app.core.metrics import SIZE_BUCKETS, metrics
+from app.core.tracing import annotate, record, span, traced
+from app.service.answer_cache import answer_cache, normalize_question
+from app.service.query_embedder import build_query_embedder
+from app.service.chunking import count_tokens
+from app.service.llm_providers import llm_router
+from app.service.llm_scheduler import llm_scheduler
+from app.service.retrieval import hybrid_retriever, pack_context
+from app.service.retrieval_scope import UNRESTRICTED, RetrievalScope
+
+if TYPE_CHECKING:
+    from app.service.conversation import ConversationContext
 
 logger = logging.getLogger(__name__)
 
+RAG_REQUESTS = metrics.counter("rag_requests_total", "Questions traitees", ["mode", "cached"])
+RETRIEVED_CHUNKS = metrics.histogram(
+    "rag_retrieved_chunks", "Chunks par question (candidats de la recherche, retenus dans le contexte)",
+    ["kind"], SIZE_BUCKETS,
+)
+PROMPT_TOKENS = metrics.histogram("rag_prompt_tokens", "Tokens du prompt de generation", buckets=SIZE_BUCKETS)
+COMPLETION_TOKENS = metrics.histogram("rag_completion_tokens", "Tokens de la reponse generee", buckets=SIZE_BUCKETS)
+
+@dataclass
+class TurnResult:
+    answer: str
+    sources: List[str] = field(default_factory=list)
+    cached: bool = False
+    prompt_tokens: int = 0
+    standalone_question: Optional[str] = None  # Question reformulee pour la recherche
+    completion_tokens: int = 0
+
 class RAGService:
     def __init__(self):
-        # Utiliser le vector_store global
-        self.vector_store = vector_store
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 4} # On récupère les 4 meilleurs morceaux
-        )
-
-        # 3. Initialiser le LLM (Groq avec Gemma)
-        self.llm = ChatGroq(
-            temperature=0,
-            model_name="llama-3.3-70b-versatile",
-            groq_api_key=settings.GROQ_API_KEY
-        )
-
-        # 4. Le Prompt (Les instructions données au bot)
-        self.prompt_template = ChatPromptTemplate.from_template("""
+        # Embeddings des questions : pool de threads borne + micro-batching + LRU
+        # (le modele est charge au premier usage ou pendant le prechauffage)
+        self.query_embedder = build_query_embedder(get_embeddings)
+        self.k = settings.RETRIEVAL_K # Au plus 4 morceaux dans le prompt
+        # Recherche hybride : vecteurs Qdrant + BM25, fusion RRF, re-classement optionnel
+        self.retriever = hybrid_retriever
+
+        # LLM : chaine de fournisseurs avec bascule (Groq, remplacant local...)
+        self.llm = llm_router
+        # Prompts construits par setup() (imports LangChain différés)
+        self.prompt_template = None
+        self.rewrite_template = None
+        self.summary_template = None
+        self._setup_lock = threading.Lock()
+
+    def setup(self):
+        """Construit les fournisseurs LLM et les prompts (une seule fois)."""
+        with self._setup_lock:
+            if self.prompt_template is not None:
+                return
+            from langchain_core.prompts import ChatPromptTemplate
+
+            # 3. Initialiser les fournisseurs LLM (Groq, puis les secours de LLM_PROVIDERS)
+            self.llm.setup()
+
+            # 4. Le Prompt (Les instructions données au bot)
+            self.prompt_template = ChatPromptTemplate.from_template("""
         Tu es un assistant universitaire utile et précis.
         Utilise impérativement les éléments de contexte suivants pour répondre à la question de l'étudiant.
         Si tu ne trouves pas la réponse dans le contexte, dis poliment que tu ne sais pas.
         
+        Historique de la conversation (vide pour une premiere question) :
+        {history}
+
         Contexte (Extraits des documents officiels) :
         {context}
         
@@ -40,31 +82,267 @@ class RAGService:
         Réponse :
         """)
 
+            # 5. Reformulation des relances ("et pour la L2 ?") en questions autonomes
+            self.rewrite_template = ChatPromptTemplate.from_template("""
+        Voici une conversation entre un étudiant et l'assistant universitaire, puis une nouvelle question.
+        Reformule la nouvelle question pour qu'elle soit compréhensible sans la conversation
+        (précise le sujet, la filière, l'année...). Si elle l'est déjà, recopie-la telle quelle.
+        Réponds uniquement par la question reformulée.
+
+        Conversation :
+        {history}
+
+        Nouvelle question : {question}
+
+        Question reformulée :
+        """)
+
+            # 6. Resume glissant des echanges sortis de la fenetre de la conversation
+            self.summary_template = ChatPromptTemplate.from_template("""
+        Mets à jour le résumé d'une conversation entre un étudiant et l'assistant universitaire.
+        Conserve les faits utiles pour la suite (filière, année, sujets abordés, réponses données),
+        en {max_words} mots au plus.
+
+        Résumé actuel :
+        {summary}
+
+        Nouveaux échanges :
+        {turns}
+
+        Nouveau résumé :
+        """)
+
+    async def ensure_setup(self):
+        if self.prompt_template is None:
+            await asyncio.to_thread(self.setup)
+
+    async def rewrite_question(
+        self,
+        question: str,
+        history: Optional["ConversationContext"],
+        user_id: Optional[int] = None,
+    ) -> str:
+        """Question autonome pour la recherche et le cache (inchangee sans historique)."""
+        if not settings.QUERY_REWRITE_ENABLED or history is None or not history.turns:
+            return question
+        await self.ensure_setup()
+        prompt = self.rewrite_template.format_prompt(history=history.format(), question=question)
+        try:
+            with span("rag.rewrite"):
+                prompt_tokens = await asyncio.to_thread(count_tokens, prompt.to_string())
+                async with llm_scheduler.slot(user_id, prompt_tokens, background=True):
+                    rewritten = await self.llm.ainvoke(prompt)
+        except Exception as e:
+            logger.warning(f"Reformulation de la question impossible : {e}")
+            return question
+        rewritten = rewritten.strip().strip('"')
+        return rewritten or question
+
+    async def summarize(self, summary: str, turns: str, max_words: int, user_id: Optional[int] = None) -> str:
+        await self.ensure_setup()
+        prompt = self.summary_template.format_prompt(summary=summary or "(aucun)", turns=turns, max_words=max_words)
+        prompt_tokens = await asyncio.to_thread(count_tokens, prompt.to_string())
+        async with llm_scheduler.slot(user_id, prompt_tokens, background=True):
+            result = await self.llm.ainvoke(prompt)
+        return result.strip()
+
+    def select_docs(self, docs):
+        """Garde les meilleurs documents non redondants dans le budget de tokens du contexte."""
+        return pack_context(docs, settings.CONTEXT_TOKEN_BUDGET, self.k)
+
     def format_docs(self, docs):
         """Formate les documents récupérés pour les insérer dans le prompt."""
         return "\n\n".join(doc.page_content for doc in docs)
 
+    def extract_sources(self, docs):
+        """Liste des sources distinctes des documents, dans l'ordre de pertinence."""
+        sources = []
+        for doc in docs:
+            source = doc.metadata.get("source")
+            if source and source not in sources:
+                sources.append(source)
+        return sources
+
+    async def _lookup(self, question: str, scope: RetrievalScope = UNRESTRICTED):
+        """
+        Consulte le cache de reponses (partition du perimetre) puis, en cas
+        d'echec, recupere le contexte parmi les documents du perimetre.
+        L'embedding de la question sert a la fois au cache semantique et a Qdrant.
+        Retourne (entree_cache, docs, vecteur, generation_cache).
+        """
+        # Documents indexes par le worker d'ingestion : cache vide meme si toutes les questions y sont
+        self.retriever.schedule_refresh()
+        with span("rag.cache"):
+            cached = answer_cache.get_exact(question, scope.key)
+        if cached:
+            return cached, None, None, None
+
+        generation = answer_cache.generation
+        with span("rag.embed"):
+            vector = await self.query_embedder.embed(question)
+        with span("rag.cache"):
+            cached = answer_cache.get_semantic(vector, scope.key)
+        if cached:
+            return cached, None, None, None
+
+        with span("rag.retrieval"):
+            candidates = await self.retriever.search(question, vector, scope=scope)
+        with span("rag.context"):
+            docs = await asyncio.to_thread(self.select_docs, candidates)
+        RETRIEVED_CHUNKS.observe(len(candidates), kind="candidates")
+        RETRIEVED_CHUNKS.observe(len(docs), kind="context")
+        annotate(candidates=len(candidates), chunks=len(docs))
+        return None, docs, vector, generation
+
+    @traced("rag.prompt")
+    def _generation_inputs(self, question: str, docs, history: Optional["ConversationContext"]):
+        """Entrees du prompt et son nombre de tokens ; tokenisation bloquante, appelee via asyncio.to_thread."""
+        inputs = {
+            "context": self.format_docs(docs),
+            "question": question,
+            "history": history.format() if history is not None else "",
+        }
+        prompt_tokens = count_tokens(self.prompt_template.format(**inputs))
+        return inputs, prompt_tokens
+
+    async def _record_generation(
+        self, mode: str, started: float, first_token_at: Optional[float], answer: str, prompt_tokens: int
+    ) -> int:
+        """Duree de la generation, delai du premier token et tokens de la question traitee."""
+        record("rag.generation", time.perf_counter() - started)
+        if first_token_at is not None:
+            record("rag.first_token", first_token_at - started)
+        completion_tokens = await asyncio.to_thread(count_tokens, answer)
+        PROMPT_TOKENS.observe(prompt_tokens)
+        COMPLETION_TOKENS.observe(completion_tokens)
+        RAG_REQUESTS.inc(mode=mode, cached="false")
+        annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return completion_tokens
+
+    def _generate(self, inputs: dict, prompt_tokens: int, standalone: str, user_id: Optional[int]):
+        """
+        Tokens de la reponse, via l'ordonnanceur LLM. Sans historique, la
+        reponse ne depend que de la question et du contexte : une generation
+        identique deja en cours est partagee.
+        """
+        key = None
+        if settings.LLM_COALESCE_ENABLED and not inputs["history"]:
+            key = normalize_question(standalone) + "|" + str(hash(inputs["context"]))
+        prompt = self.prompt_template.format_prompt(**inputs)
+        return llm_scheduler.stream(key, user_id, prompt_tokens, lambda: self.llm.astream(prompt))
+
     async def get_answer(self, question: str):
         """
-        Exécute la chaîne RAG complète.
+        Exécute la chaîne RAG complète (avec cache de réponses).
+        """
+        return (await self.answer_turn(question)).answer
+
+    async def answer_turn(
+        self,
+        question: str,
+        history: Optional["ConversationContext"] = None,
+        user_id: Optional[int] = None,
+        scope: RetrievalScope = UNRESTRICTED,
+    ) -> TurnResult:
+        """
+        Repond a une question, eventuellement dans une conversation : la
+        relance est reformulee pour la recherche et le cache, l'historique
+        (resume + derniers echanges) est ajoute au prompt.
+        Les appels LLM passent par l'ordonnanceur (file equitable par `user_id`) ;
+        scope (scope_for_user) restreint la recherche aux documents de l'utilisateur.
         """
         logger.info(f"Traitement de la question : {question}")
-        
-        # Création de la chaîne LangChain (LCEL)
-        rag_chain = (
-            {"context": self.retriever | self.format_docs, "question": RunnablePassthrough()}
-            | self.prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
-
-        # Invocation
+
         try:
-            response = await rag_chain.ainvoke(question)
-            return response
+            standalone = await self.rewrite_question(question, history, user_id)
+            cached, docs, vector, generation = await self._lookup(standalone, scope)
+            if cached:
+                RAG_REQUESTS.inc(mode="sync", cached="true")
+                return TurnResult(cached.answer, cached.sources, True, 0, standalone)
+
+            await self.ensure_setup()
+            inputs, prompt_tokens = await asyncio.to_thread(self._generation_inputs, question, docs, history)
+            parts = []
+            started, first_token_at = time.perf_counter(), None
+            async for token in self._generate(inputs, prompt_tokens, standalone, user_id):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(token)
+            response = "".join(parts)
         except Exception as e:
             logger.error(f"Erreur lors de la génération RAG : {e}")
             raise e
 
+        completion_tokens = await self._record_generation("sync", started, first_token_at, response, prompt_tokens)
+        sources = self.extract_sources(docs)
+        answer_cache.put(standalone, response, sources, vector, generation, scope.key)
+        return TurnResult(response, sources, False, prompt_tokens, standalone, completion_tokens)
+
+    async def stream_answer(
+        self,
+        question: str,
+        history: Optional["ConversationContext"] = None,
+        user_id: Optional[int] = None,
+        scope: RetrievalScope = UNRESTRICTED,
+    ):
+        """
+        Variante streaming de answer_turn.
+        Produit des evenements {"type": "token"} au fil de la generation,
+        puis un evenement final {"type": "end"} avec la reponse complete,
+        les sources, le nombre de tokens du prompt et le temps de traitement.
+        """
+        logger.info(f"Traitement (streaming) de la question : {question}")
+        start = time.perf_counter()
+
+        try:
+            standalone = await self.rewrite_question(question, history, user_id)
+            cached, docs, vector, generation = await self._lookup(standalone, scope)
+            if cached:
+                RAG_REQUESTS.inc(mode="stream", cached="true")
+                yield {"type": "token", "content": cached.answer}
+                yield {
+                    "type": "end",
+                    "answer": cached.answer,
+                    "sources": cached.sources,
+                    "cached": True,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "standalone_question": standalone,
+                    "first_token_ms": round((time.perf_counter() - start) * 1000, 1),
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+                }
+                return
+
+            await self.ensure_setup()
+            inputs, prompt_tokens = await asyncio.to_thread(self._generation_inputs, question, docs, history)
+            parts = []
+            first_token_ms = None
+            started, first_token_at = time.perf_counter(), None
+            async for token in self._generate(inputs, prompt_tokens, standalone, user_id):
+                if first_token_ms is None:
+                    first_token_at = time.perf_counter()
+                    first_token_ms = round((first_token_at - start) * 1000, 1)
+                parts.append(token)
+                yield {"type": "token", "content": token}
+        except Exception as e:
+            logger.error(f"Erreur lors de la génération RAG (streaming) : {e}")
+            raise e
+
+        answer = "".join(parts)
+        completion_tokens = await self._record_generation("stream", started, first_token_at, answer, prompt_tokens)
+        sources = self.extract_sources(docs)
+        answer_cache.put(standalone, answer, sources, vector, generation, scope.key)
+        yield {
+            "type": "end",
+            "answer": answer,
+            "sources": sources,
+            "cached": False,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "standalone_question": standalone,
+            "first_token_ms": first_token_ms,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
 # Singleton
 rag_service = RAGService()
\ No newline at end of file
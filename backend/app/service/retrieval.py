@@ -0,0 +1,261 @@
+"""
+Recherche hybride pour le RAG :
+- recherche vectorielle Qdrant + index BM25 en memoire, fusionnes par
+  Reciprocal Rank Fusion (RRF) ; recherche exacte dans le store de chunks
+  si Qdrant est indisponible ou pour les tests (CHUNK_STORE_SEARCH) ;
+- restriction au perimetre de l'utilisateur (retrieval_scope) : filtre de
+  payload applique par Qdrant pendant la recherche, meme regle pour BM25 ;
+- re-classement optionnel par un cross-encoder sur CPU ;
+- assemblage du contexte dans un budget de tokens, sans chunks redondants.
+"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.core.vector_db import COLLECTION_NAME, CONTENT_PAYLOAD_KEY, METADATA_PAYLOAD_KEY, get_client
+from app.models.document import Document
+from app.service.answer_cache import answer_cache
+from app.service.bm25 import BM25Index, bm25_index, tokenize
+from app.service.chunk_store import chunk_store
+from app.service.chunking import count_tokens
+from app.service.retrieval_scope import SCOPE_FIELDS, RetrievalScope, scope_filters
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document as LangchainDocument
+
+logger = logging.getLogger(__name__)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fusionne plusieurs classements : score = somme des 1 / (k + rang)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def pack_context(docs, budget_tokens: int, max_docs: int, redundancy: float = 0.8, count=count_tokens):
+    """
+    Remplit le prompt avec les meilleurs chunks (dans l'ordre de pertinence)
+    sans depasser budget_tokens ; un chunk dont le vocabulaire recouvre
+    a plus de `redundancy` celui d'un chunk deja retenu est ignore.
+    """
+    selected, used, vocabularies = [], 0, []
+    for doc in docs:
+        if len(selected) >= max_docs:
+            break
+        terms = set(tokenize(doc.page_content))
+        if any(
+            terms and other and len(terms & other) / min(len(terms), len(other)) >= redundancy
+            for other in vocabularies
+        ):
+            continue
+        tokens = count(doc.page_content)
+        if used + tokens > budget_tokens:
+            continue  # Un chunk plus court peut encore tenir
+        selected.append(doc)
+        vocabularies.append(terms)
+        used += tokens
+    return selected
+
+class CrossEncoderReranker:
+    """Re-classement par cross-encoder (sentence-transformers), charge a la premiere utilisation."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+
+    def _score(self, question: str, texts: List[str]):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model.predict([(question, text) for text in texts])
+
+    async def rerank(self, question: str, docs: List["LangchainDocument"]) -> List["LangchainDocument"]:
+        if not docs:
+            return docs
+        scores = await asyncio.to_thread(self._score, question, [doc.page_content for doc in docs])
+        ranked = sorted(zip(docs, scores), key=lambda item: item[1], reverse=True)
+        return [doc for doc, _ in ranked]
+
+class HybridRetriever:
+    def __init__(
+        self,
+        index: BM25Index,
+        fetch_k: int = 20,
+        candidates: int = 10,
+        rrf_k: int = 60,
+        hybrid: bool = True,
+        reranker: Optional[CrossEncoderReranker] = None,
+        refresh_seconds: float = 60,
+        hnsw_ef: Optional[int] = None,
+    ):
+        self.index = index
+        self.fetch_k = fetch_k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.hybrid = hybrid
+        self.reranker = reranker
+        self.refresh_seconds = refresh_seconds
+        self.hnsw_ef = hnsw_ef
+        self._last_check = 0.0
+        self._refresh_task = None
+        self.corpus_version = None  # (nombre de documents, derniere modification) deja vu
+
+    async def search(
+        self,
+        question: str,
+        vector,
+        hnsw_ef: Optional[int] = None,
+        scope: Optional[RetrievalScope] = None,
+    ) -> List["LangchainDocument"]:
+        """
+        Candidats classes par pertinence (vecteurs + BM25, puis cross-encoder).
+        hnsw_ef permet d'echanger precision contre latence pour une requete donnee ;
+        scope restreint les candidats aux documents visibles de l'utilisateur.
+        """
+        self.schedule_refresh()
+
+        where = scope.allows if scope is not None and scope.conditions else None
+        vector_hits = await asyncio.to_thread(
+            self._vector_search, vector, hnsw_ef or self.hnsw_ef, scope_filters.get(scope), where
+        )
+        payloads = {str(point.id): point.payload for point in vector_hits}
+        rankings = [list(payloads)]
+        if self.hybrid:
+            rankings.append([doc_id for doc_id, _ in self.index.search(question, self.fetch_k, where)])
+        fused = reciprocal_rank_fusion(rankings, self.rrf_k)[:self.candidates]
+
+        # Chunks trouves uniquement par BM25 : payload relu dans Qdrant
+        missing = [doc_id for doc_id in fused if doc_id not in payloads]
+        if missing:
+            points = await asyncio.to_thread(self._retrieve, missing)
+            payloads.update({str(point.id): point.payload for point in points})
+
+        docs = [self._to_document(doc_id, payloads[doc_id]) for doc_id in fused if doc_id in payloads]
+        if self.reranker:
+            docs = await self.reranker.rerank(question, docs)
+        return docs
+
+    def _vector_search(self, vector, hnsw_ef=None, query_filter=None, where=None):
+        """query_filter : filtre Qdrant du perimetre ; where : meme regle pour le store de chunks."""
+        from app.core.qdrant_collections import search_params
+
+        if settings.CHUNK_STORE_SEARCH == "exact":
+            return chunk_store.search(vector, self.fetch_k, where=where)
+        try:
+            return get_client().query_points(
+                collection_name=COLLECTION_NAME,
+                query=vector,
+                query_filter=query_filter,
+                limit=self.fetch_k,
+                search_params=search_params(hnsw_ef),
+                with_payload=True,
+            ).points
+        except Exception as e:
+            if not self._store_fallback():
+                raise
+            logger.warning(f"Qdrant indisponible ({e}), recherche exacte dans le store de chunks")
+            return chunk_store.search(vector, self.fetch_k, where=where)
+
+    def _retrieve(self, ids):
+        if settings.CHUNK_STORE_SEARCH == "exact":
+            return chunk_store.get(ids)
+        try:
+            return get_client().retrieve(collection_name=COLLECTION_NAME, ids=ids, with_payload=True)
+        except Exception:
+            if not self._store_fallback():
+                raise
+            return chunk_store.get(ids)
+
+    def _store_fallback(self) -> bool:
+        return settings.CHUNK_STORE_SEARCH == "fallback" and len(chunk_store) > 0
+
+    def _to_document(self, doc_id: str, payload: dict) -> "LangchainDocument":
+        from langchain_core.documents import Document as LangchainDocument
+
+        metadata = dict(payload.get(METADATA_PAYLOAD_KEY) or {})
+        metadata["_id"] = doc_id
+        return LangchainDocument(page_content=payload.get(CONTENT_PAYLOAD_KEY, ""), metadata=metadata)
+
+    # --- Synchronisation avec le corpus (index BM25, cache de reponses) ---
+
+    def schedule_refresh(self, force: bool = False):
+        """
+        Verifie periodiquement (sans bloquer la requete) si le corpus a change,
+        par exemple via le worker d'ingestion, un autre processus : le cache de
+        reponses de ce processus est alors vide, recherche hybride ou non.
+        """
+        now = time.monotonic()
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if not force and now - self._last_check < self.refresh_seconds:
+            return
+        self._last_check = now
+        self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+    async def refresh(self):
+        try:
+            # Nombre de documents et derniere modification : une suppression change le nombre
+            async with async_session_maker() as session:
+                row = (await session.execute(select(func.count(Document.id), func.max(Document.updated_at)))).one()
+            version = tuple(row)
+            if self.hybrid and (version[1] is None or version != self.index.corpus_version):
+                await self._reload_index(version)
+            # Apres le rechargement de l'index : le cache ne se remplit pas avec l'ancien corpus
+            if self.corpus_version is not None and version != self.corpus_version:
+                answer_cache.invalidate()
+            self.corpus_version = version
+        except Exception as e:
+            logger.error(f"Echec de la synchronisation avec le corpus : {e}")
+
+    async def _reload_index(self, version):
+        started = time.perf_counter()
+        fresh = await asyncio.to_thread(self._load_index)
+        self.index.replace_with(fresh)
+        self.index.corpus_version = version
+        logger.info(f"Index BM25 reconstruit : {len(fresh)} chunks en {time.perf_counter() - started:.2f}s")
+
+    def _load_index(self) -> BM25Index:
+        index = BM25Index(self.index.k1, self.index.b)
+        if settings.CHUNK_STORE_SEARCH == "exact":
+            for batch in chunk_store.iter_points():
+                for point in batch:
+                    self._index_point(index, point.id, point.payload)
+            return index
+        offset = None
+        while True:
+            points, offset = get_client().scroll(
+                collection_name=COLLECTION_NAME,
+                limit=1000,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for point in points:
+                self._index_point(index, str(point.id), point.payload)
+            if offset is None:
+                return index
+
+    @staticmethod
+    def _index_point(index: BM25Index, doc_id: str, payload: dict):
+        metadata = payload.get(METADATA_PAYLOAD_KEY) or {}
+        scope = {field: metadata[field] for field in SCOPE_FIELDS if field in metadata}
+        index.add(doc_id, payload.get(CONTENT_PAYLOAD_KEY, ""), metadata.get("source"), scope)
+
+# Singleton
+hybrid_retriever = HybridRetriever(
+    bm25_index,
+    fetch_k=settings.RETRIEVAL_FETCH_K,
+    candidates=settings.RETRIEVAL_CANDIDATES,
+    rrf_k=settings.RRF_K,
+    hybrid=settings.HYBRID_SEARCH_ENABLED,
+    reranker=CrossEncoderReranker(settings.RERANKER_MODEL) if settings.RERANKER_MODEL else None,
+    refresh_seconds=settings.BM25_REFRESH_SECONDS,
+    hnsw_ef=settings.QDRANT_HNSW_EF or None,
+)
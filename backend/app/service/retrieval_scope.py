@@ -0,0 +1,135 @@
+"""
+Perimetre de recherche d'un utilisateur.
+
+Chaque document est indexe avec sa faculte, son public ("student", "teacher")
+et son annee universitaire ; "all" le rend commun a tous sur ce champ. Ces
+metadonnees sont des champs indexes du payload Qdrant : la recherche d'un
+utilisateur est restreinte a son perimetre par un filtre applique pendant le
+parcours de l'index (et non apres coup sur les k premiers resultats), ce qui
+evite que des chunks d'autres facultes occupent les places du contexte.
+
+- etudiant : documents "student" ou "all" de sa faculte et de son annee ;
+- enseignant : en plus les documents "teacher" ;
+- administrateur : tout le corpus.
+Un utilisateur sans faculte (ou sans annee) n'est pas restreint sur ce champ,
+et les points indexes avant l'ajout du perimetre (champ absent) restent
+visibles de tous.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.vector_db import METADATA_PAYLOAD_KEY
+
+ALL = "all"
+SCOPE_FIELDS = ("faculty", "audience", "academic_year")
+AUDIENCES = ("student", "teacher")
+# Publics visibles par role ; un role inconnu est traite comme un etudiant
+ROLE_AUDIENCES = {"student": ("student",), "teacher": ("student", "teacher")}
+
+def normalize_value(value: Optional[str]) -> str:
+    """" Sciences  " -> "sciences" ; vide ou absent -> "all"."""
+    value = " ".join(str(value or "").split()).lower()
+    return value or ALL
+
+def document_scope(
+    faculty: Optional[str] = None, audience: Optional[str] = None, academic_year: Optional[str] = None
+) -> Dict[str, str]:
+    """Metadonnees de perimetre d'un document (upload, ingestion en masse)."""
+    scope = {
+        "faculty": normalize_value(faculty),
+        "audience": normalize_value(audience),
+        "academic_year": normalize_value(academic_year),
+    }
+    if scope["audience"] not in AUDIENCES + (ALL,):
+        raise ValueError(f"Public inconnu : {audience} (student, teacher ou all)")
+    return scope
+
+@dataclass(frozen=True)
+class RetrievalScope:
+    """Valeurs acceptees par champ ; un champ absent des conditions n'est pas filtre."""
+    conditions: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+
+    @property
+    def key(self) -> str:
+        """Cle stable du perimetre (cache des filtres, cache de reponses) ; "" = tout le corpus."""
+        return "|".join(f"{field}={','.join(values)}" for field, values in self.conditions)
+
+    def allows(self, metadata: dict) -> bool:
+        """Meme regle que le filtre Qdrant, pour les points lus ailleurs (BM25, store de chunks)."""
+        for field, values in self.conditions:
+            value = metadata.get(field)
+            if value is not None and value != ALL and value not in values:
+                return False
+        return True
+
+UNRESTRICTED = RetrievalScope()
+
+def scope_for_user(user) -> RetrievalScope:
+    if user is None or not settings.RETRIEVAL_SCOPE_ENABLED or user.role == "admin":
+        return UNRESTRICTED
+    conditions = []
+    if user.faculty:
+        conditions.append(("faculty", (normalize_value(user.faculty),)))
+    conditions.append(("audience", ROLE_AUDIENCES.get(user.role, ROLE_AUDIENCES["student"])))
+    if user.academic_year:
+        conditions.append(("academic_year", (normalize_value(user.academic_year),)))
+    return RetrievalScope(tuple(conditions))
+
+class ScopeFilterCache:
+    """
+    Filtres Qdrant par perimetre, construits une fois puis partages (LRU) :
+    les utilisateurs d'une meme faculte et d'une meme annee ont le meme filtre.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._filters: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: Optional[RetrievalScope]):
+        """Filtre du perimetre, ou None pour tout le corpus."""
+        if scope is None or not scope.conditions:
+            return None
+        key = scope.key
+        with self._lock:
+            query_filter = self._filters.get(key)
+            if query_filter is not None:
+                self._filters.move_to_end(key)
+                self.hits += 1
+                return query_filter
+            self.misses += 1
+        query_filter = build_filter(scope)
+        with self._lock:
+            self._filters[key] = query_filter
+            while len(self._filters) > self.max_entries:
+                self._filters.popitem(last=False)
+        return query_filter
+
+    def stats(self) -> dict:
+        return {"entries": len(self._filters), "hits": self.hits, "misses": self.misses}
+
+def build_filter(scope: RetrievalScope):
+    """Pour chaque champ : valeur acceptee, "all", ou champ absent (points anterieurs au perimetre)."""
+    from qdrant_client.http import models
+
+    return models.Filter(must=[
+        models.Filter(should=[
+            models.FieldCondition(key=f"{METADATA_PAYLOAD_KEY}.{field}", match=models.MatchAny(any=[*values, ALL])),
+            models.IsEmptyCondition(is_empty=models.PayloadField(key=f"{METADATA_PAYLOAD_KEY}.{field}")),
+        ])
+        for field, values in scope.conditions
+    ])
+
+# Singleton
+scope_filters = ScopeFilterCache(max_entries=settings.RETRIEVAL_SCOPE_FILTER_CACHE_SIZE)
+
+metrics.gauge(
+    "retrieval_scope_filter_lookups_total", "Consultations du cache des filtres de perimetre",
+    lambda: {"hit": scope_filters.hits, "miss": scope_filters.misses}, ["result"], kind="counter",
+)
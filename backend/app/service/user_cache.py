@@ -0,0 +1,93 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """
+    Cache LRU + TTL des utilisateurs authentifies, indexe par id.
+    Evite une requete SQL par appel authentifie ; les entrees sont des copies
+    detachees de toute session (sans le hash du mot de passe).
+    Toute modification ou suppression d'un User par l'ORM dans ce processus invalide
+    son entree ; entre processus, le TTL borne la duree d'une donnee perimee.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> Optional[User]:
+        if self.ttl_seconds <= 0:
+            return None
+        item = self._entries.get(user_id)
+        if item is None or time.monotonic() - item[0] > self.ttl_seconds:
+            if item is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return item[1]
+
+    def put(self, user: User) -> User:
+        """Met en cache une copie de l'utilisateur et la retourne."""
+        snapshot = User(
+            id=user.id, email=user.email, hashed_password="", full_name=user.full_name, role=user.role,
+            faculty=user.faculty, academic_year=user.academic_year,
+        )
+        if self.ttl_seconds <= 0 or user.id is None:
+            return snapshot
+        self._entries[user.id] = (time.monotonic(), snapshot)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Invalide un utilisateur, ou tout le cache si user_id est None."""
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+# Singleton
+user_cache = UserCache(
+    max_entries=settings.USER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.USER_CACHE_TTL_SECONDS,
+)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+metrics.gauge(
+    "user_cache_lookups_total", "Consultations du cache des utilisateurs (authentification)",
+    lambda: {"hit": user_cache.hits, "miss": user_cache.misses}, ["result"], kind="counter",
+)
@@ -1,30 +1,256 @@
-from typing import List
-from fastapi import WebSocket
+import asyncio
 import logging
+import os
+import time
+import uuid
+from typing import Dict, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.service.pubsub import PubSubBackend, build_pubsub
 
 logger = logging.getLogger(__name__)
 
+# Fermeture par le serveur : client trop lent, inactif (ou arret du serveur)
+CLOSE_SLOW_CONSUMER = 1013
+CLOSE_IDLE = 1001
+
+class Connection:
+    """
+    Une connexion WebSocket et sa file d'envoi : un seul task ecrit sur le
+    socket, dans l'ordre, avec un delai maximal par trame.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: Optional[int], json_mode: bool, queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.json_mode = json_mode  # Le client comprend les trames JSON (ping compris)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.sender: Optional[asyncio.Task] = None
+        self.closed = False
+
 class ConnectionManager:
-    def __init__(self):
-        # Liste des connexions actives
-        self.active_connections: List[WebSocket] = []
+    """
+    Registre des connexions WebSocket de ce processus, indexe par utilisateur.
+    Les diffusions (broadcast, send_to_user) passent par un backend pub/sub
+    pour atteindre les connexions ouvertes sur les autres workers.
+    """
+
+    def __init__(
+        self,
+        pubsub: PubSubBackend,
+        send_queue_size: int = 256,
+        send_timeout: float = 5,
+        heartbeat_seconds: float = 30,
+        idle_timeout: float = 0,
+    ):
+        self.pubsub = pubsub
+        self.send_queue_size = send_queue_size
+        self.send_timeout = send_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.idle_timeout = idle_timeout
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._by_socket: Dict[WebSocket, Connection] = {}
+        self._by_user: Dict[Optional[int], Set[Connection]] = {}
+        self._heartbeat_task = None
+        self.pubsub.subscribe(self._on_pubsub_message)
 
-    async def connect(self, websocket: WebSocket):
+        self.peak_connections = 0
+        self.total_connections = 0
+        self.sent = 0
+        self.send_timeouts = 0
+        self.evicted_slow = 0
+        self.evicted_idle = 0
+
+    @property
+    def active_connections(self):
+        return list(self._by_socket)
+
+    # --- Cycle de vie ---
+
+    async def start(self):
+        await self.pubsub.start()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        for connection in list(self._by_socket.values()):
+            await self._close(connection, CLOSE_IDLE)
+        await self.pubsub.stop()
+
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None, json_mode: bool = False):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = Connection(websocket, user_id, json_mode, self.send_queue_size)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        self._by_socket[websocket] = connection
+        self._by_user.setdefault(user_id, set()).add(connection)
+        self.total_connections += 1
+        self.peak_connections = max(self.peak_connections, len(self._by_socket))
         logger.info("Nouvelle connexion WebSocket établie.")
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self._by_socket.pop(websocket, None)
+        if connection is None:
+            return
+        connection.closed = True
+        connections = self._by_user.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._by_user[connection.user_id]
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
         logger.info("Connexion WebSocket fermée.")
 
+    def touch(self, websocket: WebSocket):
+        """Activite du client (message recu) : repousse l'eviction pour inactivite."""
+        connection = self._by_socket.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+
+    # --- Envoi a une connexion ---
+
     async def send_personal_message(self, message: str, websocket: WebSocket):
         """Envoie un message à un utilisateur spécifique"""
-        await websocket.send_text(message)
+        await self._enqueue(websocket, ("text", message))
+
+    async def send_personal_json(self, data: dict, websocket: WebSocket):
+        """Envoie une trame JSON (mode streaming) à un utilisateur spécifique"""
+        await self._enqueue(websocket, ("json", data))
+
+    async def _enqueue(self, websocket: WebSocket, frame):
+        connection = self._by_socket.get(websocket)
+        if connection is None or connection.closed:
+            # Connexion evincee ou fermee : la generation en cours s'arrete
+            raise WebSocketDisconnect(code=1001)
+        # Reponse a la requete du client : on attend une place (contre-pression
+        # sur la generation) plutot que de perdre des tokens, dans la limite de send_timeout
+        try:
+            await asyncio.wait_for(connection.queue.put(frame), self.send_timeout)
+        except asyncio.TimeoutError:
+            self.evicted_slow += 1
+            await self._close(connection, CLOSE_SLOW_CONSUMER)
+            raise WebSocketDisconnect(code=CLOSE_SLOW_CONSUMER)
+
+    # --- Diffusion (tous les workers) ---
 
     async def broadcast(self, message: str):
         """Envoie un message à tous les utilisateurs (utile pour des notifs globales)"""
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        await self.pubsub.publish({"user_id": None, "frame": ["text", message]})
+
+    async def send_to_user(self, user_id: int, data: dict):
+        """Trame JSON vers toutes les connexions d'un utilisateur, quel que soit le worker."""
+        await self.pubsub.publish({"user_id": user_id, "frame": ["json", data]})
+
+    async def _on_pubsub_message(self, message: dict):
+        frame = tuple(message["frame"])
+        if message.get("user_id") is None:
+            targets = list(self._by_socket.values())
+        else:
+            targets = list(self._by_user.get(message["user_id"], ()))
+        for connection in targets:
+            self._offer(connection, frame)
+
+    def _offer(self, connection: Connection, frame):
+        """Depot sans attente : un client dont la file est pleine est deconnecte."""
+        if connection.closed:
+            return
+        try:
+            connection.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            connection.closed = True
+            self.evicted_slow += 1
+            logger.warning(f"Client WebSocket trop lent (utilisateur {connection.user_id}), deconnexion")
+            asyncio.get_running_loop().create_task(self._close(connection, CLOSE_SLOW_CONSUMER))
+
+    # --- Taches internes ---
+
+    async def _send_loop(self, connection: Connection):
+        websocket = connection.websocket
+        while True:
+            kind, payload = await connection.queue.get()
+            send = websocket.send_json if kind == "json" else websocket.send_text
+            try:
+                await asyncio.wait_for(send(payload), self.send_timeout)
+                self.sent += 1
+            except asyncio.TimeoutError:
+                self.send_timeouts += 1
+                self.evicted_slow += 1
+                logger.warning(f"Envoi WebSocket expire (utilisateur {connection.user_id}), deconnexion")
+                await self._close(connection, CLOSE_SLOW_CONSUMER)
+                return
+            except Exception:
+                # Socket deja ferme : la boucle de reception fera le menage
+                self.disconnect(websocket)
+                return
+
+    async def _close(self, connection: Connection, code: int):
+        self.disconnect(connection.websocket)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+    def _is_idle(self, connection: Connection, now: float) -> bool:
+        """
+        Inactif au-dela de idle_timeout (0 = jamais). Seuls les clients JSON sont
+        concernes : les clients texte restent ouverts pendant la lecture d'une
+        reponse et ne savent pas se reconnecter.
+        """
+        return self.idle_timeout > 0 and connection.json_mode and now - connection.last_seen > self.idle_timeout
+
+    async def _heartbeat(self):
+        """Evince les connexions inactives ; ping applicatif pour les clients JSON."""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            now = time.monotonic()
+            for connection in list(self._by_socket.values()):
+                if self._is_idle(connection, now):
+                    self.evicted_idle += 1
+                    await self._close(connection, CLOSE_IDLE)
+                elif connection.json_mode:
+                    self._offer(connection, ("json", {"type": "ping"}))
+
+    def stats(self) -> dict:
+        return {
+            "worker": self.worker_id,
+            "connections": len(self._by_socket),
+            "users": len([user for user in self._by_user if user is not None]),
+            "peak_connections": self.peak_connections,
+            "total_connections": self.total_connections,
+            "queued_frames": sum(c.queue.qsize() for c in self._by_socket.values()),
+            "sent": self.sent,
+            "send_timeouts": self.send_timeouts,
+            "evicted_slow": self.evicted_slow,
+            "evicted_idle": self.evicted_idle,
+            "pubsub": {
+                "backend": type(self.pubsub).__name__,
+                "published": self.pubsub.published,
+                "received": self.pubsub.received,
+            },
+        }
+
+manager = ConnectionManager(
+    build_pubsub(settings.WS_PUBSUB_CHANNEL),
+    send_queue_size=settings.WS_SEND_QUEUE_SIZE,
+    send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+    heartbeat_seconds=settings.WS_HEARTBEAT_SECONDS,
+    idle_timeout=settings.WS_IDLE_TIMEOUT_SECONDS,
+)
 
-manager = ConnectionManager()
\ No newline at end of file
+metrics.gauge("ws_connections", "Connexions WebSocket ouvertes sur ce worker", lambda: len(manager._by_socket))
+metrics.gauge(
+    "ws_queued_frames", "Trames en attente d'envoi (toutes connexions)",
+    lambda: sum(c.queue.qsize() for c in manager._by_socket.values()),
+)
+metrics.gauge(
+    "ws_evictions_total", "Connexions WebSocket fermees par le serveur",
+    lambda: {"slow": manager.evicted_slow, "idle": manager.evicted_idle}, ["reason"], kind="counter",
+)
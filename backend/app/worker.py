@@ -0,0 +1,38 @@
+"""
+Worker d'ingestion autonome, a lancer a part de l'API pour la mettre a l'echelle :
+
+    python -m app.worker
+
+Dans ce mode, mettre INGESTION_WORKER_EMBEDDED=false cote API.
+"""
+import asyncio
+import logging
+import signal
+
+from app.core.database import init_db
+from app.service.ingestion import ingestion_service
+from app.service.ingestion_worker import ingestion_worker
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+async def main():
+    await init_db()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    ingestion_worker.start()
+    await stop_event.wait()
+
+    logger.info("Arret du worker d'ingestion...")
+    await ingestion_worker.stop()
+    ingestion_service.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
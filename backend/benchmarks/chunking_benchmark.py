@@ -0,0 +1,89 @@
+"""
+Compare les strategies de decoupage sur un texte (sample_content.txt par defaut) :
+nombre de chunks, taille d'index, temps d'ingestion (decoupage + embeddings)
+et taux de succes de la recherche (hit rate @k) sur le jeu de questions etiquetees.
+
+    python -m benchmarks.chunking_benchmark [--file chemin.txt] [--k 4]
+
+Resultat en JSON sur la sortie standard.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.service.chunking import get_chunker, count_tokens
+from benchmarks.dataset import LABELLED_QUESTIONS, SAMPLE_CONTENT_PATH, load_sample_content
+
+EMBEDDING_DIM = 384
+
+STRATEGIES = {
+    "character": {"chunk_size": 1000, "overlap": 200},
+    "recursive": {"max_tokens": 200, "overlap_tokens": 20, "min_tokens": 50},
+}
+
+def load_embeddings():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+def run_strategy(name, params, text, embeddings, question_vectors, k):
+    start = time.perf_counter()
+    chunker = get_chunker(name, **params)
+    chunks = chunker.feed(text, 1) + chunker.flush()
+    chunking_s = time.perf_counter() - start
+
+    texts = [chunk.text for chunk in chunks]
+    start = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    embedding_s = time.perf_counter() - start
+
+    # Recherche exacte cosinus (equivalent a Qdrant sur un petit corpus)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = question_vectors @ vectors.T
+    hits = 0
+    for row, item in zip(scores, LABELLED_QUESTIONS):
+        top = np.argsort(-row)[:k]
+        if any(item["expected"].lower() in texts[i].lower() for i in top):
+            hits += 1
+
+    tokens = [count_tokens(t) for t in texts]
+    return {
+        "chunks": len(chunks),
+        "avg_tokens": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+        "max_tokens": max(tokens) if tokens else 0,
+        "indexed_chars": sum(len(t) for t in texts),
+        "redundancy": round(sum(len(t) for t in texts) / max(len(text), 1) - 1, 3),
+        "index_bytes": len(chunks) * EMBEDDING_DIM * 4 + sum(len(t.encode("utf-8")) for t in texts),
+        "chunking_ms": round(chunking_s * 1000, 2),
+        "embedding_ms": round(embedding_s * 1000, 2),
+        "ingestion_ms": round((chunking_s + embedding_s) * 1000, 2),
+        f"hit_rate@{k}": round(hits / len(LABELLED_QUESTIONS), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=SAMPLE_CONTENT_PATH)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    text = load_sample_content(args.file)
+    embeddings = load_embeddings()
+    question_vectors = np.asarray(
+        embeddings.embed_documents([item["question"] for item in LABELLED_QUESTIONS]), dtype=np.float32
+    )
+    question_vectors /= np.linalg.norm(question_vectors, axis=1, keepdims=True)
+
+    results = {
+        "file": args.file,
+        "k": args.k,
+        "questions": len(LABELLED_QUESTIONS),
+        "strategies": {
+            name: run_strategy(name, params, text, embeddings, question_vectors, args.k)
+            for name, params in STRATEGIES.items()
+        },
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
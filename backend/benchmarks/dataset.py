@@ -0,0 +1,62 @@
+"""
+Jeu de questions etiquetees construit a partir de sample_content.txt.
+Une question est "trouvee" si l'un des chunks recuperes contient l'extrait attendu.
+"""
+import os
+import textwrap
+from typing import List
+
+SAMPLE_CONTENT_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "sample_content.txt")
+
+LABELLED_QUESTIONS = [
+    {"question": "Quel modèle d'embeddings est utilisé ?", "expected": "all-MiniLM-L6-v2"},
+    {"question": "Quelle base de données vectorielle utilise le système ?", "expected": "Qdrant"},
+    {"question": "Quelle est la base de données relationnelle ?", "expected": "PostgreSQL"},
+    {"question": "Avec quelle technologie le frontend est-il développé ?", "expected": "Flutter"},
+    {"question": "Quel endpoint permet d'uploader un PDF ?", "expected": "/api/v1/documents/upload"},
+    {"question": "Comment le document est-il traité après l'upload ?", "expected": "arrière-plan"},
+    {"question": "Quel framework est utilisé pour l'API backend ?", "expected": "FastAPI"},
+    {"question": "À quoi sert ce système RAG ?", "expected": "éducation universitaire"},
+]
+
+def load_sample_content(path: str = SAMPLE_CONTENT_PATH) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+def build_pdf(pages: List[str]) -> bytes:
+    """
+    PDF minimal (texte seul, Helvetica, une page par element) : les benchmarks
+    fabriquent leurs documents sans dependance supplementaire.
+    """
+    def escape(line: str) -> bytes:
+        raw = line.encode("cp1252", "replace")
+        return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Arbre des pages, connu une fois les pages numerotees
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for text in pages:
+        lines = [chunk for paragraph in text.splitlines() for chunk in textwrap.wrap(paragraph, 90) or [""]]
+        stream = b"BT /F1 10 Tf 14 TL 40 800 Td " + b" ".join(b"(" + escape(line) + b") Tj T*" for line in lines) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
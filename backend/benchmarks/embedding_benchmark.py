@@ -0,0 +1,189 @@
+"""
+Compare les moteurs d'embeddings (EMBEDDING_BACKEND) : concordance des
+vecteurs, debit, latence d'une question et memoire residente.
+
+Chaque moteur tourne dans un processus neuf (memoire et temps de chargement
+mesures sans interference), sur les memes textes : chunks de sample_content.txt
+et questions etiquetees. Le premier moteur sert de reference :
+
+- concordance : cosinus entre vecteurs de reference et vecteurs candidats
+  (moyenne, minimum, 1er centile) et accord des k plus proches chunks par question ;
+- debit : textes/s par taille de lot, latence p50/p95 d'une question seule ;
+- memoire : RSS apres chargement et pic du processus.
+
+    python -m benchmarks.embedding_benchmark [--backends huggingface,onnx] [--texts 512] [--min-cosine 0.99]
+
+Resultat en JSON ; code de sortie 1 si un moteur echoue ou si sa concordance
+moyenne est sous --min-cosine (le modele ONNX exporte ne peut alors pas
+remplacer l'actuel sans reindexer).
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+def rss_mb():
+    """Memoire residente courante (Linux), a defaut le pic du processus."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def load_texts(count):
+    from app.core.config import settings
+    from app.service.chunking import get_chunker
+    from benchmarks.dataset import LABELLED_QUESTIONS, load_sample_content
+
+    chunker = get_chunker(
+        "recursive",
+        max_tokens=settings.CHUNK_MAX_TOKENS,
+        overlap_tokens=settings.CHUNK_OVERLAP_TOKENS,
+        min_tokens=settings.CHUNK_MIN_TOKENS,
+    )
+    content = load_sample_content()
+    chunks = [chunk.text for chunk in chunker.feed(content, 1) + chunker.flush()]
+    # Chunks repetes et numerotes jusqu'au nombre demande : textes distincts, longueurs realistes
+    documents = [f"{chunks[i % len(chunks)]} ({i // len(chunks)})" for i in range(count)]
+    return documents, [item["question"] for item in LABELLED_QUESTIONS]
+
+# --- Processus de mesure (un par moteur) ---
+
+def measure(backend, args, output):
+    baseline_rss = rss_mb()
+    start = time.perf_counter()
+    from app.core.vector_db import build_embeddings
+
+    embeddings = build_embeddings(backend)
+    embeddings.embed_query("prechauffage")
+    load_s = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    documents, questions = load_texts(args.texts)
+    throughput = {}
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(documents), batch_size):
+            embeddings.embed_documents(documents[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        throughput[f"batch_{batch_size}"] = round(len(documents) / elapsed, 1)
+
+    latencies = []
+    for _ in range(args.query_rounds):
+        for question in questions:
+            start = time.perf_counter()
+            embeddings.embed_query(question)
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    np.save(os.path.join(output, f"{backend}-documents.npy"), np.asarray(embeddings.embed_documents(documents), dtype=np.float32))
+    np.save(os.path.join(output, f"{backend}-questions.npy"), np.asarray(embeddings.embed_documents(questions), dtype=np.float32))
+    return {
+        "load_s": round(load_s, 2),
+        "texts_per_s": throughput,
+        "query_latency": {
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000, 2),
+        },
+        "memory_mb": {
+            "baseline_rss": baseline_rss,
+            "loaded_rss": loaded_rss,
+            "model_rss": round(loaded_rss - baseline_rss, 1),
+            "peak_rss": peak_rss_mb(),
+        },
+    }
+
+def run_backend(backend, args, output):
+    command = [
+        sys.executable, "-m", "benchmarks.embedding_benchmark",
+        "--worker", backend, "--output", output,
+        "--texts", str(args.texts), "--query-rounds", str(args.query_rounds),
+        "--batch-sizes", ",".join(str(size) for size in args.batch_sizes),
+    ]
+    result = subprocess.run(
+        command, capture_output=True, text=True, cwd=os.path.join(os.path.dirname(__file__), "..")
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"code {result.returncode}"}
+    return json.loads(result.stdout)
+
+# --- Concordance ---
+
+def parity(output, reference, candidate, k):
+    load = lambda backend, kind: np.load(os.path.join(output, f"{backend}-{kind}.npy"))
+    ref_docs, cand_docs = load(reference, "documents"), load(candidate, "documents")
+    ref_questions, cand_questions = load(reference, "questions"), load(candidate, "questions")
+
+    normalize = lambda m: m / np.clip(np.linalg.norm(m, axis=1, keepdims=True), 1e-12, None)
+    cosines = np.sum(normalize(ref_docs) * normalize(cand_docs), axis=1)
+    question_cosines = np.sum(normalize(ref_questions) * normalize(cand_questions), axis=1)
+
+    # Les k plus proches chunks de chaque question, selon chaque moteur
+    top = lambda questions, docs: np.argsort(-(normalize(questions) @ normalize(docs).T), axis=1)[:, :k]
+    ref_top, cand_top = top(ref_questions, ref_docs), top(cand_questions, cand_docs)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]
+    return {
+        "document_cosine": {
+            "mean": round(float(cosines.mean()), 5),
+            "min": round(float(cosines.min()), 5),
+            "p1": round(float(np.percentile(cosines, 1)), 5),
+        },
+        "question_cosine_mean": round(float(question_cosines.mean()), 5),
+        f"top{k}_overlap": round(float(np.mean(overlap)), 3),
+        "top1_agreement": round(float(np.mean(ref_top[:, 0] == cand_top[:, 0])), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="huggingface,onnx", help="Le premier sert de reference")
+    parser.add_argument("--texts", type=int, default=512, help="Chunks encodes par moteur")
+    parser.add_argument("--batch-sizes", default="1,8,32,64")
+    parser.add_argument("--query-rounds", type=int, default=5)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args, args.output)))
+        return
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    with tempfile.TemporaryDirectory(prefix="embedding-bench-") as output:
+        results = {"texts": args.texts, "reference": backends[0], "backends": {}}
+        for backend in backends:
+            results["backends"][backend] = run_backend(backend, args, output)
+
+        # Un moteur en echec (dependance ou modele ONNX absent) : concordance non verifiee
+        ok = not any("error" in result for result in results["backends"].values())
+        for backend in backends[1:]:
+            if not ok:
+                break
+            agreement = parity(output, backends[0], backend, args.k)
+            agreement["parity_ok"] = agreement["document_cosine"]["mean"] >= args.min_cosine
+            ok = ok and agreement["parity_ok"]
+            results["backends"][backend]["parity"] = agreement
+
+    print(json.dumps(results, indent=2))
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
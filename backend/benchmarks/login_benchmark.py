@@ -0,0 +1,123 @@
+"""
+Vague de connexions simultanees (l'afflux de 8h) contre l'application en
+processus, avec une sonde qui interroge en parallele une route authentifiee
+(/chat/history) : sa latence montre si l'event loop reste disponible
+pendant que bcrypt travaille.
+
+    DATABASE_URL=sqlite+aiosqlite:///bench_auth.db \\
+        python -m benchmarks.login_benchmark [--users 50] [--logins 200] [--concurrency 50]
+
+Resultat en JSON sur la sortie standard.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from sqlmodel import select
+
+from app.api.main import app
+from app.core.config import settings
+from app.core.database import async_session_maker, init_db
+from app.core.security import create_user_token, get_password_hash_async
+from app.models.user import User
+from app.service.user_cache import user_cache
+
+PASSWORD = "benchmark-password"
+EMAIL_PATTERN = "bench-user-{}@example.com"
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 1),
+        "p95_ms": round(pick(0.95) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+async def create_users(count):
+    hashed = await get_password_hash_async(PASSWORD)
+    async with async_session_maker() as session:
+        existing = set((await session.execute(select(User.email))).scalars().all())
+        for i in range(count):
+            email = EMAIL_PATTERN.format(i)
+            if email not in existing:
+                session.add(User(email=email, hashed_password=hashed, full_name=f"Bench {i}"))
+        await session.commit()
+        return (await session.execute(select(User).where(User.email == EMAIL_PATTERN.format(0)))).scalars().first()
+
+async def login(client, email, latencies, failures):
+    start = time.perf_counter()
+    response = await client.post(
+        f"{settings.API_V1_STR}/auth/login", data={"username": email, "password": PASSWORD}
+    )
+    latencies.append(time.perf_counter() - start)
+    if response.status_code != 200:
+        failures.append(response.status_code)
+
+async def probe(client, token, stop, latencies, interval):
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"{settings.API_V1_STR}/chat/history", headers=headers)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+async def run(args):
+    await init_db()
+    probe_user = await create_users(args.users)
+    token = create_user_token(probe_user)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Sonde seule : latence de reference, cache utilisateurs chaud
+        baseline, stop = [], asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, token, stop, baseline, args.probe_interval))
+        await asyncio.sleep(1)
+        stop.set()
+        await probe_task
+
+        login_latencies, failures, during, stop = [], [], [], asyncio.Event()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(i):
+            async with semaphore:
+                await login(client, EMAIL_PATTERN.format(i % args.users), login_latencies, failures)
+
+        probe_task = asyncio.create_task(probe(client, token, stop, during, args.probe_interval))
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(args.logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+
+    return {
+        "users": args.users,
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "bcrypt_threads": settings.BCRYPT_THREADS,
+        "elapsed_s": round(elapsed, 2),
+        "logins_per_s": round(args.logins / elapsed, 1),
+        "login_failures": len(failures),
+        "login_latency": percentiles(login_latencies),
+        "probe_baseline": percentiles(baseline),
+        "probe_during_storm": percentiles(during),
+        "user_cache": user_cache.stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
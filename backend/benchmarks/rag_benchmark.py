@@ -0,0 +1,272 @@
+"""
+Benchmark de bout en bout du RAG, hors ligne : Qdrant en memoire dans le
+processus, fournisseur LLM "local" (latence et streaming simules), base SQLite
+temporaire. Seul le modele d'embeddings doit etre disponible localement.
+
+1. ingestion : PDF genere a partir de sample_content.txt -> pages/s, chunks/s ;
+2. recherche : latence et recall@k sur le jeu de questions etiquetees ;
+3. charge : utilisateurs simules concurrents sur /chat/query (HTTP) et sur
+   le WebSocket en streaming -> p50/p95/p99 (premier token et reponse complete).
+
+    python -m benchmarks.rag_benchmark [--pages 50] [--documents 2] [--users 20] [--questions 5]
+
+Le cache de reponses est desactive (sauf --answer-cache) : chaque question
+parcourt tout le pipeline. Resultat en JSON sur la sortie standard, a comparer
+d'un commit a l'autre.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+def configure(args):
+    """Environnement hors ligne, fixe avant le premier import de l'application (settings)."""
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    os.environ.update({
+        "QDRANT_URL": ":memory:",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_SPOOL_DIR": os.path.join(workdir, "uploads"),
+        "LLM_PROVIDERS": "local",
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "LLM_TOKENS_PER_MINUTE": "0",
+        "LOCAL_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "LOCAL_LLM_TOKEN_MS": str(args.llm_token_ms),
+        "INGESTION_WORKER_EMBEDDED": "false",
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+    })
+    for name, value in (("PROJECT_NAME", "rag-benchmark"), ("API_V1_STR", "/api/v1"), ("SECRET_KEY", "benchmark")):
+        os.environ.setdefault(name, value)
+    return workdir
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 1),
+        "p95_ms": round(pick(0.95) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+# --- 1. Ingestion ---
+
+async def bench_ingestion(args, workdir):
+    from app.core.database import init_db
+    from app.service.ingestion import ingestion_service
+    from benchmarks.dataset import build_pdf, load_sample_content
+
+    await init_db()
+    content = load_sample_content()
+    totals = {"pages": 0, "chunks": 0, "vectors": 0}
+    elapsed = 0.0
+    for document in range(args.documents):
+        pages = [f"Document {document} - page {page + 1}\n\n{content}" for page in range(args.pages)]
+        path = os.path.join(workdir, f"bench-{document}.pdf")
+        with open(path, "wb") as f:
+            f.write(build_pdf(pages))
+        start = time.perf_counter()
+        stats = await ingestion_service.process_pdf_path(path, f"bench-{document}.pdf")
+        elapsed += time.perf_counter() - start
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+    return {
+        **totals,
+        "documents": args.documents,
+        "elapsed_s": round(elapsed, 2),
+        "pages_per_s": round(totals["pages"] / elapsed, 1) if elapsed else None,
+        "chunks_per_s": round(totals["chunks"] / elapsed, 1) if elapsed else None,
+    }
+
+# --- 2. Recherche ---
+
+async def bench_retrieval(args):
+    from app.core.config import settings
+    from app.service.rag_service import rag_service
+    from benchmarks.dataset import LABELLED_QUESTIONS
+
+    await rag_service.retriever.refresh()  # Index BM25 a jour des documents ingeres
+    k = args.k or settings.RETRIEVAL_K
+    latencies, hits, context_hits, reciprocal_ranks = [], 0, 0, []
+    for _ in range(args.retrieval_rounds):
+        for item in LABELLED_QUESTIONS:
+            expected = item["expected"].lower()
+            start = time.perf_counter()
+            vector = await rag_service.query_embedder.embed(item["question"])
+            candidates = await rag_service.retriever.search(item["question"], vector)
+            docs = await asyncio.to_thread(rag_service.select_docs, candidates)
+            latencies.append(time.perf_counter() - start)
+
+            ranks = [i for i, doc in enumerate(candidates[:k]) if expected in doc.page_content.lower()]
+            hits += bool(ranks)
+            reciprocal_ranks.append(1 / (ranks[0] + 1) if ranks else 0.0)
+            context_hits += any(expected in doc.page_content.lower() for doc in docs)
+    total = len(LABELLED_QUESTIONS) * args.retrieval_rounds
+    return {
+        "questions": len(LABELLED_QUESTIONS),
+        "k": k,
+        f"recall@{k}": round(hits / total, 3),
+        "mrr": round(sum(reciprocal_ranks) / total, 3),
+        "context_hit_rate": round(context_hits / total, 3),
+        "latency": percentiles(latencies),
+    }
+
+# --- 3. Charge ---
+
+async def create_bench_users(count):
+    from app.core.database import async_session_maker
+    from app.core.security import create_user_token, get_password_hash_async
+    from app.models.user import User
+
+    hashed = await get_password_hash_async("benchmark-password")
+    async with async_session_maker() as session:
+        users = [
+            User(email=f"rag-bench-{i}@example.com", hashed_password=hashed, full_name=f"Bench {i}")
+            for i in range(count)
+        ]
+        session.add_all(users)
+        await session.commit()
+        return [create_user_token(user) for user in users]
+
+def user_questions(user, count):
+    from benchmarks.dataset import LABELLED_QUESTIONS
+
+    # Questions decalees d'un utilisateur a l'autre : des generations identiques
+    # simultanees existent, comme en periode d'examens
+    return [LABELLED_QUESTIONS[(user + i) % len(LABELLED_QUESTIONS)]["question"] for i in range(count)]
+
+async def bench_http(app, tokens, questions):
+    import httpx
+    from app.core.config import settings
+
+    latencies, errors = [], []
+
+    async def simulate(user, token):
+        headers = {"Authorization": f"Bearer {token}"}
+        for question in user_questions(user, questions):
+            start = time.perf_counter()
+            response = await client.post(
+                f"{settings.API_V1_STR}/chat/query", json={"question": question}, headers=headers, timeout=120
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(simulate(user, token) for user, token in enumerate(tokens)))
+        elapsed = time.perf_counter() - start
+    return {
+        "users": len(tokens),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency": percentiles(latencies),
+    }
+
+def bench_websocket(client, tokens, questions):
+    """Un thread par utilisateur (client WebSocket synchrone de Starlette)."""
+    from app.core.config import settings
+
+    first_tokens, totals, errors = [], [], []
+    lock = threading.Lock()
+
+    def simulate(user, token):
+        url = f"{settings.API_V1_STR}/chat/ws?token={token}&stream=true"
+        try:
+            with client.websocket_connect(url) as websocket:
+                for question in user_questions(user, questions):
+                    start = time.perf_counter()
+                    websocket.send_text(question)
+                    first = None
+                    while True:
+                        event = websocket.receive_json()
+                        if event["type"] == "token" and first is None:
+                            first = time.perf_counter() - start
+                        elif event["type"] in ("end", "error"):
+                            break
+                    with lock:
+                        if event["type"] == "error":
+                            errors.append(event.get("detail"))
+                        else:
+                            totals.append(time.perf_counter() - start)
+                            first_tokens.append(first)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=simulate, args=(user, token)) for user, token in enumerate(tokens)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "users": len(tokens),
+        "messages": len(totals),
+        "errors": len(errors),
+        "throughput_mps": round(len(totals) / elapsed, 2),
+        "first_token": percentiles([t for t in first_tokens if t is not None]),
+        "complete": percentiles(totals),
+    }
+
+def run(args):
+    workdir = configure(args)
+    from fastapi.testclient import TestClient
+    from app.api.main import app
+    from app.core.config import settings
+    from app.service.llm_scheduler import llm_scheduler
+
+    results = {
+        "config": {
+            "pages": args.pages,
+            "documents": args.documents,
+            "users": args.users,
+            "questions_per_user": args.questions,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_token_ms": args.llm_token_ms,
+            "answer_cache": args.answer_cache,
+            "chunker": settings.CHUNKER,
+            "hybrid_search": settings.HYBRID_SEARCH_ENABLED,
+            "retrieval_k": settings.RETRIEVAL_K,
+            "llm_max_concurrency": settings.LLM_MAX_CONCURRENCY,
+        },
+    }
+    # Tout le benchmark tourne dans l'event loop de l'application (lifespan compris)
+    with TestClient(app) as client:
+        results["ingestion"] = client.portal.call(bench_ingestion, args, workdir)
+        results["retrieval"] = client.portal.call(bench_retrieval, args)
+        tokens = client.portal.call(create_bench_users, args.users)
+        results["http_query"] = client.portal.call(bench_http, app, tokens, args.questions)
+        results["websocket_stream"] = bench_websocket(client, tokens, args.questions)
+        results["llm_scheduler"] = llm_scheduler.stats()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="Pages par document ingere")
+    parser.add_argument("--documents", type=int, default=2)
+    parser.add_argument("--k", type=int, default=0, help="k du recall@k (defaut : RETRIEVAL_K)")
+    parser.add_argument("--retrieval-rounds", type=int, default=3)
+    parser.add_argument("--users", type=int, default=20, help="Utilisateurs simules concurrents")
+    parser.add_argument("--questions", type=int, default=5, help="Questions par utilisateur")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-token-ms", type=float, default=15)
+    parser.add_argument("--answer-cache", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args)
+    json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Recherche restreinte au perimetre de l'utilisateur (retrieval_scope) contre
+recherche sur tout le corpus, sur un corpus de plusieurs facultes.
+
+Chaque faculte publie un document etudiant (reglement, salle d'examen,
+responsable...) et un document enseignant (corriges), pour chaque annee
+universitaire : les memes questions ont une reponse differente par faculte et
+par annee, comme dans un vrai corpus. Les documents passent par le pipeline
+d'ingestion avec leur perimetre ; --extra-points ajoute des points
+synthetiques (vecteurs aleatoires, perimetres repartis) pour mesurer l'effet
+de la taille du corpus.
+
+Pour chaque etudiant et enseignant simule (une faculte, l'annee courante) :
+- latence : recherche vectorielle seule et recherche hybride complete ;
+- precision : part des chunks du contexte visibles de l'utilisateur, chunks
+  hors perimetre (autre faculte, autre annee, documents enseignants pour un
+  etudiant) et taux de reponses attendues presentes dans le contexte ;
+- cache des filtres : construction d'un filtre Qdrant contre lecture du cache.
+
+    python -m benchmarks.scope_benchmark [--faculties 6] [--years 2] [--pages 10] [--extra-points 0]
+    python -m benchmarks.scope_benchmark --qdrant-url http://localhost:6333 --extra-points 200000
+
+Qdrant en memoire par defaut (filtres evalues en Python : les latences n'y
+sont pas representatives) ; avec --qdrant-url, une collection temporaire est
+creee puis supprimee. Resultat en JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+FACULTIES = ["sciences", "lettres", "droit", "medecine", "economie", "informatique", "langues", "arts"]
+YEARS = ["2025-2026", "2024-2025", "2023-2024"]
+# (question, phrase du document) : la reponse differe selon la faculte et l'annee
+TOPICS = [
+    ("Dans quelle salle ont lieu les examens ?", "Les examens de la faculte {faculty} ont lieu en salle {answer}."),
+    ("Qui est le responsable pedagogique ?", "Le responsable pedagogique de la faculte {faculty} est {answer}."),
+    ("Quelle est la date limite d'inscription ?", "La date limite d'inscription a la faculte {faculty} est le {answer}."),
+]
+TEACHER_TOPIC = (
+    "Ou trouver le corrige de l'examen final ?",
+    "Le corrige de l'examen final de la faculte {faculty} est {answer}.",
+)
+
+def configure(args):
+    """Environnement hors ligne, fixe avant le premier import de l'application (settings)."""
+    workdir = tempfile.mkdtemp(prefix="scope-bench-")
+    os.environ.update({
+        "QDRANT_URL": args.qdrant_url,
+        "QDRANT_COLLECTION": f"scope_benchmark_{os.getpid()}",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "CHUNK_STORE_DIR": os.path.join(workdir, "chunk_store"),
+        "INGESTION_WORKER_EMBEDDED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+        "RETRIEVAL_SCOPE_ENABLED": "true",
+    })
+    for name, value in (("PROJECT_NAME", "scope-benchmark"), ("API_V1_STR", "/api/v1"), ("SECRET_KEY", "benchmark")):
+        os.environ.setdefault(name, value)
+    return workdir
+
+def percentiles(values):
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "p50_ms": round(pick(0.5) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+def answer(topic: int, faculty: int, year: int) -> str:
+    """Reponse unique a une question pour une faculte et une annee, ex. "R3-2-1"."""
+    return f"R{topic}-{faculty}-{year}"
+
+# --- Corpus ---
+
+async def build_corpus(args, workdir, faculties, years):
+    from app.core.database import init_db
+    from app.service.ingestion import ingestion_service
+    from app.service.retrieval_scope import document_scope
+    from benchmarks.dataset import build_pdf, load_sample_content
+
+    await init_db()
+    content = load_sample_content()
+    chunks, started = 0, time.perf_counter()
+    for f, faculty in enumerate(faculties):
+        for y, year in enumerate(years):
+            for audience, topics in (("student", list(enumerate(TOPICS))), ("teacher", [(len(TOPICS), TEACHER_TOPIC)])):
+                facts = [sentence.format(faculty=faculty, answer=answer(t, f, y)) for t, (_, sentence) in topics]
+                # Pages de remplissage propres au document, puis une page par fait
+                pages = [f"Faculte {faculty} {year} - page {p + 1}\n\n{content}" for p in range(args.pages)]
+                pages += [f"Faculte {faculty} - annee {year}\n\n{fact}" for fact in facts]
+                source = f"{faculty}/{year}/{audience}.pdf"
+                path = os.path.join(workdir, source.replace("/", "-"))
+                with open(path, "wb") as fp:
+                    fp.write(build_pdf(pages))
+                stats = await ingestion_service.process_pdf_path(
+                    path, source, scope=document_scope(faculty, audience, year)
+                )
+                chunks += stats["chunks"]
+    ingestion_service.shutdown()
+    return {
+        "documents": len(faculties) * len(years) * 2,
+        "chunks": chunks,
+        "elapsed_s": round(time.perf_counter() - started, 2),
+    }
+
+def add_extra_points(count, faculties, years, batch_size=1024):
+    """Points synthetiques repartis entre facultes, annees et publics (taille du corpus)."""
+    import uuid
+
+    import numpy as np
+    from qdrant_client.http import models
+
+    from app.core.vector_db import COLLECTION_NAME, get_client
+
+    rng = np.random.default_rng(0)
+    client = get_client()
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        vectors = rng.standard_normal((size, 384)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        client.upsert(collection_name=COLLECTION_NAME, wait=True, points=[
+            models.PointStruct(
+                id=str(uuid.uuid4()),
+                vector=vector.tolist(),
+                payload={"page_content": "", "metadata": {
+                    "source": "synthetique",
+                    "faculty": faculties[(start + i) % len(faculties)],
+                    "audience": ("student", "teacher")[(start + i) // len(faculties) % 2],
+                    "academic_year": years[(start + i) // (2 * len(faculties)) % len(years)],
+                }},
+            )
+            for i, vector in enumerate(vectors)
+        ])
+
+# --- Mesures ---
+
+def count_leaks(docs, scope, leaks) -> int:
+    """Chunks visibles de l'utilisateur ; les autres sont comptes par champ hors perimetre."""
+    allowed = 0
+    for doc in docs:
+        if scope.allows(doc.metadata):
+            allowed += 1
+            continue
+        for field in leaks:
+            value = doc.metadata.get(field)
+            if value not in (None, "all") and not scope.allows({field: value}):
+                leaks[field] += 1
+    return allowed
+
+async def measure_mode(args, mode, users, questions, vectors):
+    """Latences et precision du contexte, recherche restreinte ("scoped") ou non."""
+    from app.service.rag_service import rag_service
+    from app.service.retrieval_scope import UNRESTRICTED, scope_filters, scope_for_user
+
+    retriever = rag_service.retriever
+    vector_latencies, search_latencies = [], []
+    context, allowed, expected_total, expected_found, leaks = 0, 0, 0, 0, {"faculty": 0, "academic_year": 0, "audience": 0}
+    for _ in range(args.rounds):
+        for user, f in users:
+            scope = scope_for_user(user)
+            search_scope = scope if mode == "scoped" else UNRESTRICTED
+            where = search_scope.allows if search_scope.conditions else None
+            for t, question in questions:
+                vector = vectors[question]
+                start = time.perf_counter()
+                await asyncio.to_thread(retriever._vector_search, vector, None, scope_filters.get(search_scope), where)
+                vector_latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                candidates = await retriever.search(question, vector, scope=search_scope)
+                search_latencies.append(time.perf_counter() - start)
+                docs = rag_service.select_docs(candidates)
+
+                context += len(docs)
+                allowed += count_leaks(docs, scope, leaks)
+                # Question enseignant posee par un etudiant : aucune reponse attendue
+                if t < len(TOPICS) or user.role == "teacher":
+                    expected_total += 1
+                    expected_found += any(answer(t, f, 0) in doc.page_content for doc in docs)
+    return {
+        "vector_search": percentiles(vector_latencies),
+        "hybrid_search": percentiles(search_latencies),
+        "answer_hit_rate": round(expected_found / expected_total, 3),
+        "context_precision": round(allowed / context, 3) if context else None,
+        "out_of_scope_chunks": leaks,
+    }
+
+def filter_cache_cost(scope) -> dict:
+    """Cout d'un filtre : construit a chaque requete ou lu dans le cache."""
+    from app.service.retrieval_scope import build_filter, scope_filters
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        build_filter(scope)
+    build_us = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for _ in range(1000):
+        scope_filters.get(scope)
+    cached_us = (time.perf_counter() - start) * 1000
+    return {**scope_filters.stats(), "build_us": round(build_us, 2), "cached_us": round(cached_us, 2)}
+
+async def bench(args, faculties, years):
+    from app.service.rag_service import rag_service
+    from app.service.retrieval_scope import scope_for_user
+
+    await rag_service.retriever.refresh()
+    users = [
+        (SimpleNamespace(role=role, faculty=faculty, academic_year=years[0]), f)
+        for f, faculty in enumerate(faculties)
+        for role in ("student", "teacher")
+    ]
+    questions = [(t, question) for t, (question, _) in enumerate(TOPICS)] + [(len(TOPICS), TEACHER_TOPIC[0])]
+    vectors = {question: await rag_service.query_embedder.embed(question) for _, question in questions}
+
+    results = {mode: await measure_mode(args, mode, users, questions, vectors) for mode in ("unscoped", "scoped")}
+    results["filter_cache"] = filter_cache_cost(scope_for_user(users[0][0]))
+    results["speedup_vector_p50"] = round(
+        results["unscoped"]["vector_search"]["p50_ms"] / max(results["scoped"]["vector_search"]["p50_ms"], 1e-6), 2
+    )
+    return results
+
+def cleanup():
+    from app.core.qdrant_collections import resolve_alias
+    from app.core.vector_db import COLLECTION_NAME, get_client
+
+    client = get_client()
+    name = resolve_alias(client, COLLECTION_NAME)
+    if name:
+        client.delete_collection(name)
+
+def run(args):
+    workdir = configure(args)
+    from app.core.config import settings
+    from app.core.vector_db import COLLECTION_NAME, get_client
+
+    faculties, years = FACULTIES[:args.faculties], YEARS[:args.years]
+
+    async def measure():
+        corpus = await build_corpus(args, workdir, faculties, years)
+        if args.extra_points:
+            await asyncio.to_thread(add_extra_points, args.extra_points, faculties, years)
+        corpus["points"] = get_client().count(COLLECTION_NAME).count
+        return corpus, await bench(args, faculties, years)
+
+    try:
+        corpus, results = asyncio.run(measure())
+    finally:
+        if args.qdrant_url != ":memory:":
+            cleanup()
+    return {
+        "config": {
+            "qdrant": args.qdrant_url,
+            "faculties": len(faculties),
+            "years": len(years),
+            "pages": args.pages,
+            "extra_points": args.extra_points,
+            "rounds": args.rounds,
+            "payload_indexes": settings.QDRANT_PAYLOAD_INDEXES,
+            "retrieval_k": settings.RETRIEVAL_K,
+        },
+        "corpus": corpus,
+        **results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faculties", type=int, default=6, help=f"Facultes (au plus {len(FACULTIES)})")
+    parser.add_argument("--years", type=int, default=2, help=f"Annees universitaires (au plus {len(YEARS)})")
+    parser.add_argument("--pages", type=int, default=10, help="Pages de remplissage par document")
+    parser.add_argument("--extra-points", type=int, default=0, help="Points synthetiques ajoutes au corpus")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--qdrant-url", default=":memory:", help="Serveur Qdrant (collection temporaire)")
+    args = parser.parse_args()
+
+    results = run(args)
+    json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+if __name__ == "__main__":
+    main()
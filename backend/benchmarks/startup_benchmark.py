@@ -0,0 +1,67 @@
+"""
+Mesure le temps d'import de app.api.main dans des processus neufs
+(aucun modele ni connexion Qdrant ne doit etre charge a l'import).
+
+    python -m benchmarks.startup_benchmark [--runs 5] [--top 15]
+
+Resultat en JSON : temps mural par execution et modules les plus couteux
+(temps cumule d'apres `python -X importtime`).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TARGET = "app.api.main"
+
+def run_once():
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative.strip()) / 1000
+    return wall, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    walls, last_modules = [], {}
+    for _ in range(args.runs):
+        wall, last_modules = run_once()
+        walls.append(wall)
+
+    heavy = ("torch", "sentence_transformers", "langchain_huggingface", "langchain_groq", "langchain_qdrant", "transformers", "onnxruntime")
+    results = {
+        "target": TARGET,
+        "runs": args.runs,
+        "wall_s": {
+            "min": round(min(walls), 3),
+            "median": round(statistics.median(walls), 3),
+            "max": round(max(walls), 3),
+        },
+        "import_ms": round(last_modules.get(TARGET, 0.0), 1),
+        "top_modules_ms": dict(sorted(last_modules.items(), key=lambda item: item[1], reverse=True)[:args.top]),
+        "heavy_modules_loaded": [name for name in heavy if name in last_modules],
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
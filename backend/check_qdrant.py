@@ -1,40 +1,284 @@
 #!/usr/bin/env python3
 """
-Script pour vérifier le contenu de la collection Qdrant
+Administration de l'index Qdrant des documents.
+
+    python check_qdrant.py                                   # aperçu de la collection
+    python check_qdrant.py ingest cours/ [--jobs 4] [--checkpoint fichier.jsonl] [--prefix S1/]
+                           [--faculty sciences] [--audience student] [--academic-year 2025-2026]
+    python check_qdrant.py stats [--top 20]
+    python check_qdrant.py snapshot create|list
+    python check_qdrant.py snapshot restore NOM [--collection C | --location URL] [--drop-old]
+    python check_qdrant.py delete SOURCE... [--prefix L1/] [--orphans] [--yes]
+    python check_qdrant.py scope SOURCE... [--prefix L1/] [--faculty F] [--audience A] [--academic-year Y]
+    python check_qdrant.py rebuild [--batch-size 512] [--parallel 2] [--drop-old] [--force]
+    python check_qdrant.py store stats|compact|backfill
+
+- ingest : indexe des arborescences de PDF en parallèle (même pipeline que
+  l'upload), avec barre de progression et reprise après interruption ; le
+  périmètre (faculté, public, année universitaire) s'applique à tous les fichiers ;
+- stats : points par source, sources orphelines (points sans document dans le
+  registre) et documents du registre absents ou incomplets dans Qdrant ;
+- snapshot : instantanés de la collection ; la restauration se fait dans une
+  nouvelle collection puis l'alias bascule, comme une migration ;
+- delete : suppression en masse des points et des documents du registre
+  (simulation sans --yes) ;
+- scope : change le périmètre de documents déjà indexés (payload modifié en
+  place, sans réindexation) ; une option absente vaut "all" ;
+- rebuild : nouvelle collection (configuration courante) remplie depuis le
+  store de chunks local, sans extraction ni embeddings, puis bascule de l'alias ;
+  refusée si le store a moins de points que la collection en service (sauf
+  --force), l'ancienne collection est conservée (sauf --drop-old) ;
+- store : état du store de chunks, compaction, import des points déjà
+  indexés dans Qdrant (corpus antérieur au store).
+
+Les résultats sont affichés en JSON. Les API détectent les changements du
+registre des documents (ajout, modification, périmètre, suppression) à leur
+prochain rafraîchissement de l'index BM25, qui vide aussi le cache de réponses.
 """
+import argparse
+import asyncio
+import json
+import logging
+
 from qdrant_client import QdrantClient
 
-def main():
-    client = QdrantClient(url="http://localhost:6333")
+from app.core.config import settings
+
+def inspect(client):
+    collection = settings.QDRANT_COLLECTION
 
     # Vérifier si la collection existe
     collections = client.get_collections()
     print("Collections disponibles :")
-    for collection in collections.collections:
-        print(f"- {collection.name}")
+    for item in collections.collections:
+        print(f"- {item.name}")
 
-    # Détails de la collection documents
-    if client.collection_exists("documents"):
-        info = client.get_collection("documents")
-        print(f"\nCollection 'documents' :")
+    # Détails de la collection documents (alias ou collection)
+    if client.collection_exists(collection):
+        info = client.get_collection(collection)
+        print(f"\nCollection '{collection}' :")
         print(f"- Points : {info.points_count}")
         print(f"- Vecteurs : {info.config.params.vectors}")
 
         # Récupérer quelques points
         points = client.scroll(
-            collection_name="documents",
+            collection_name=collection,
             limit=5,
             with_payload=True,
             with_vectors=False
         )
 
-        print(f"\nExemples de points indexés :")
+        print("\nExemples de points indexés :")
         for point in points[0]:
             print(f"ID: {point.id}")
             print(f"Payload: {point.payload}")
             print("---")
     else:
-        print("Collection 'documents' n'existe pas")
+        print(f"Collection '{collection}' n'existe pas")
+
+async def ingest(args):
+    from app.core.database import init_db
+    from app.service.bulk_ingestion import Checkpoint, bulk_ingest, find_pdfs
+    from app.service.ingestion import ingestion_service
+
+    files = find_pdfs(args.paths, prefix=args.prefix, flat=args.flat)
+    scope = scope_from_args(args)
+    await init_db()
+    checkpoint = Checkpoint(args.checkpoint)
+    try:
+        report = await bulk_ingest(files, checkpoint, jobs=args.jobs, scope=scope)
+    finally:
+        checkpoint.close()
+        ingestion_service.shutdown()
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({**report, "entries": list(checkpoint.entries.values())}, f, indent=2, ensure_ascii=False)
+    return report
+
+async def stats(client, args):
+    from app.core.qdrant_collections import collection_status, source_point_counts
+    from app.service.document_registry import document_registry
+
+    counts = await asyncio.to_thread(source_point_counts, client)
+    without_source = counts.pop(None, 0)
+    documents = {document.source: document for document in await document_registry.list_documents()}
+    incomplete = [
+        {"source": source, "points": counts[source], "expected": document.chunk_count}
+        for source, document in documents.items()
+        if 0 < counts.get(source, 0) != document.chunk_count
+    ]
+    return {
+        "collection": collection_status(client),
+        "points": sum(counts.values()) + without_source,
+        "sources": len(counts),
+        "registered_documents": len(documents),
+        "points_per_source": dict(counts.most_common(args.top or None)),
+        # Points d'une source inconnue du registre (document supprimé, restauration, ancien upload)
+        "orphaned_sources": {source: count for source, count in sorted(counts.items()) if source not in documents},
+        # Documents enregistrés sans aucun point : jamais réindexés tant qu'ils restent au registre
+        "missing_sources": sorted(source for source in documents if source not in counts),
+        "incomplete_sources": incomplete,
+        "points_without_source": without_source,
+    }
+
+def snapshot(client, args):
+    from app.core.qdrant_collections import (
+        create_snapshot, list_snapshots, physical_collection, restore_snapshot, snapshot_location
+    )
+
+    if args.action == "create":
+        return create_snapshot(client)
+    if args.action == "list":
+        return list_snapshots(client)
+    if not args.name and not args.location:
+        raise SystemExit("snapshot restore : indiquer le nom de l'instantané ou --location")
+    location = args.location or snapshot_location(args.collection or physical_collection(client), args.name)
+    return restore_snapshot(client, location, drop_old=args.drop_old)
+
+async def delete(client, args):
+    from app.core.qdrant_collections import delete_sources, source_point_counts
+    from app.service.document_registry import document_registry
+
+    counts = await asyncio.to_thread(source_point_counts, client)
+    counts.pop(None, 0)
+    registered = {document.source for document in await document_registry.list_documents()}
+    known = set(counts) | registered
+
+    sources = {source for source in args.sources if source in known}
+    if args.prefix:
+        sources |= {source for source in known if source.startswith(args.prefix)}
+    if args.orphans:
+        sources |= {source for source in counts if source not in registered}
+    sources = sorted(sources)
+    result = {
+        "sources": sources,
+        "unknown": sorted(set(args.sources) - known),
+        "points": sum(counts.get(source, 0) for source in sources),
+        "dry_run": not args.yes,
+    }
+    if args.yes and sources:
+        from app.service.chunk_store import chunk_store
+
+        result["points"] = await asyncio.to_thread(delete_sources, client, sources)
+        result["registry_deleted"] = await document_registry.delete_sources(sources)
+        if settings.CHUNK_STORE_ENABLED:
+            chunk_store.delete_sources(sources)
+    return result
+
+def scope_from_args(args):
+    from app.service.retrieval_scope import document_scope
+
+    try:
+        return document_scope(args.faculty, args.audience, args.academic_year)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+async def scope(args):
+    from app.core.database import init_db
+    from app.service.document_registry import document_registry
+    from app.service.ingestion import ingestion_service
+
+    values = scope_from_args(args)
+    await init_db()
+    registered = {document.source for document in await document_registry.list_documents()}
+    sources = {source for source in args.sources if source in registered}
+    if args.prefix:
+        sources |= {source for source in registered if source.startswith(args.prefix)}
+    for source in sorted(sources):
+        await ingestion_service.set_scope(source, values)
+    return {"scope": values, "sources": sorted(sources), "unknown": sorted(set(args.sources) - registered)}
+
+def rebuild(client, args):
+    from app.service.chunk_store import chunk_store, rebuild_collection
+
+    if not len(chunk_store):
+        raise SystemExit(f"Store de chunks vide ({settings.CHUNK_STORE_DIR}) : lancer d'abord 'store backfill'")
+    try:
+        return rebuild_collection(
+            client, chunk_store, batch_size=args.batch_size, parallel=args.parallel,
+            keep_old=not args.drop_old, force=args.force,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+def store(client, args):
+    from app.service.chunk_store import backfill_from_collection, chunk_store
+
+    if args.action == "compact":
+        return chunk_store.compact()
+    if args.action == "backfill":
+        return {"added": backfill_from_collection(client, chunk_store), **chunk_store.stats()}
+    return chunk_store.stats()
+
+def add_scope_arguments(parser):
+    parser.add_argument("--faculty", help="Faculté des documents (défaut : toutes)")
+    parser.add_argument("--audience", choices=["student", "teacher", "all"], help="Public (défaut : all)")
+    parser.add_argument("--academic-year", help="Année universitaire, ex. 2025-2026 (défaut : toutes)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+
+    ingest_parser = commands.add_parser("ingest", help="Indexer des dossiers de PDF")
+    ingest_parser.add_argument("paths", nargs="+", help="Dossiers (parcourus récursivement) ou fichiers PDF")
+    ingest_parser.add_argument("--jobs", type=int, default=settings.INGESTION_WORKER_CONCURRENCY, help="Fichiers en parallèle")
+    ingest_parser.add_argument("--checkpoint", default=".ingest-checkpoint.jsonl", help="Point de reprise JSONL")
+    ingest_parser.add_argument("--prefix", default="", help="Préfixe des sources, ex. 'S1-2025/'")
+    ingest_parser.add_argument("--flat", action="store_true", help="Sources = noms de fichiers seuls, comme à l'upload")
+    ingest_parser.add_argument("--report", help="Rapport JSON complet (durées par fichier)")
+    add_scope_arguments(ingest_parser)
+
+    stats_parser = commands.add_parser("stats", help="Points par source et incohérences avec le registre")
+    stats_parser.add_argument("--top", type=int, default=0, help="Limiter points_per_source aux N plus grosses sources")
+
+    snapshot_parser = commands.add_parser("snapshot", help="Instantanés de la collection")
+    snapshot_parser.add_argument("action", choices=["create", "list", "restore"])
+    snapshot_parser.add_argument("name", nargs="?", help="Instantané à restaurer")
+    snapshot_parser.add_argument("--collection", help="Collection physique de l'instantané (défaut : collection courante)")
+    snapshot_parser.add_argument("--location", help="URL ou file:// d'un instantané, à la place du nom")
+    snapshot_parser.add_argument("--drop-old", action="store_true", help="Supprimer la collection remplacée")
+
+    delete_parser = commands.add_parser("delete", help="Supprimer des sources (points et registre)")
+    delete_parser.add_argument("sources", nargs="*")
+    delete_parser.add_argument("--prefix", help="Toutes les sources commençant par ce préfixe")
+    delete_parser.add_argument("--orphans", action="store_true", help="Sources absentes du registre des documents")
+    delete_parser.add_argument("--yes", action="store_true", help="Supprimer réellement (sinon simulation)")
+
+    scope_parser = commands.add_parser("scope", help="Changer le périmètre de documents indexés")
+    scope_parser.add_argument("sources", nargs="*")
+    scope_parser.add_argument("--prefix", help="Toutes les sources commençant par ce préfixe")
+    add_scope_arguments(scope_parser)
+
+    rebuild_parser = commands.add_parser("rebuild", help="Reconstruire la collection depuis le store de chunks")
+    rebuild_parser.add_argument("--batch-size", type=int, default=512)
+    rebuild_parser.add_argument("--parallel", type=int, default=1, help="Processus d'envoi vers Qdrant")
+    rebuild_parser.add_argument("--drop-old", action="store_true", help="Supprimer la collection remplacée")
+    rebuild_parser.add_argument("--force", action="store_true", help="Reconstruire même si le store a moins de points")
+
+    store_parser = commands.add_parser("store", help="Store de chunks local")
+    store_parser.add_argument("action", choices=["stats", "compact", "backfill"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    client = QdrantClient(url=settings.QDRANT_URL)
+    if args.command is None:
+        inspect(client)
+        return
+    if args.command == "ingest":
+        result = asyncio.run(ingest(args))
+    elif args.command == "stats":
+        result = asyncio.run(stats(client, args))
+    elif args.command == "snapshot":
+        result = snapshot(client, args)
+    elif args.command == "scope":
+        result = asyncio.run(scope(args))
+    elif args.command == "rebuild":
+        result = rebuild(client, args)
+    elif args.command == "store":
+        result = store(client, args)
+    else:
+        result = asyncio.run(delete(client, args))
+    print(json.dumps(result, indent=2, default=str, ensure_ascii=False))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()